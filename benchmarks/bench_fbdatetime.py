@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""Benchmark :py:func:`fborm.types.fbdatetime` against the ``strptime``
+converter it replaced, and the formatter used by
+:py:func:`fborm.parse.fbsetconvert` against the one it replaced, on a case
+history shaped like a real ``search`` response with the ``events`` column.
+
+    python benchmarks/bench_fbdatetime.py --cases 200 --events 50
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+import fborm
+from fborm import types
+from bs4 import BeautifulSoup
+
+def events_xml(cases, events, seed=42):
+    """A ``<response>`` with **cases** cases of **events** events each.
+    Events come in bursts the way FogBugz records them: an edit, the email
+    it triggers and the automatic assignment all share one timestamp.
+    """
+    rnd = random.Random(seed)
+    when = datetime.datetime(2012, 1, 1)
+    out = ['<?xml version="1.0" encoding="UTF-8"?><response><cases>']
+    ixBugEvent = 1
+    for ixBug in xrange(1, cases + 1):
+        out.append('<case ixBug="%d"><events>' % ixBug)
+        for n in xrange(events):
+            if n == 0 or rnd.random() < 0.6:
+                when += datetime.timedelta(seconds=rnd.randint(1, 86400))
+            out.append('<event ixBugEvent="%d" ixBug="%d">'
+                       '<ixBugEvent>%d</ixBugEvent><ixBug>%d</ixBug>'
+                       '<sVerb>Edited</sVerb><ixPerson>%d</ixPerson>'
+                       '<dt>%s</dt><s>Note %d</s></event>'
+                       % (ixBugEvent, ixBug, ixBugEvent, ixBug,
+                          rnd.randint(2, 40),
+                          when.strftime(types.fbisofmt), n))
+            ixBugEvent += 1
+        out.append('</events></case>')
+    out.append('</cases></response>')
+    return ''.join(out)
+
+def strptime_fbdatetime(data):
+    ## fborm.types.fbdatetime as it was
+    strdt = types.fbstring(data)
+    if not strdt:
+        return ''
+    return datetime.datetime.strptime(strdt, types.fbisofmt)
+
+def isoformat_dt2fbdt(dt):
+    ## fborm.parse._dt2fbdt as it was
+    return dt.isoformat().split('.')[0] + 'Z'
+
+def best(func, repeat, number=1):
+    return min(timeit.repeat(func, repeat=repeat, number=number)) / number
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--cases', type=int, default=200)
+    parser.add_argument('--events', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    soup = BeautifulSoup(events_xml(args.cases, args.events), 'xml')
+    elems = soup.find_all('dt')
+    values = [strptime_fbdatetime(elem) for elem in elems]
+    assert values == [types.fbdatetime(elem) for elem in elems]
+    assert ([isoformat_dt2fbdt(dt) for dt in values] ==
+            [fborm.parse._dt2fbdt(dt) for dt in values])
+    print '%d dt values, %d distinct' % (len(elems),
+                                         len(set(elem.text for elem in elems)))
+
+    def cold():
+        types._fbdatetime_cache.clear()
+        for elem in elems:
+            types.fbdatetime(elem)
+    timings = [
+        ('strptime', best(lambda: map(strptime_fbdatetime, elems),
+                          args.repeat)),
+        ('fbdatetime, cold cache', best(cold, args.repeat)),
+        ('fbdatetime, warm cache', best(lambda: map(types.fbdatetime, elems),
+                                        args.repeat)),
+        ('isoformat formatter', best(lambda: map(isoformat_dt2fbdt, values),
+                                     args.repeat)),
+        ('_dt2fbdt', best(lambda: map(fborm.parse._dt2fbdt, values),
+                          args.repeat)),
+    ]
+    base = dict(timings)
+    for name, seconds in timings:
+        ref = base['isoformat formatter' if 'format' in name or
+                   'fbdt' in name else 'strptime']
+        print '%-24s %8.1f us/value  %5.1fx' % (
+            name, seconds / len(elems) * 1e6, ref / seconds)
+
+    typemap = dict(ixBug=fborm.fbint, events=fborm.fbevents(
+        dict(ixBugEvent=fborm.fbint, sVerb=fborm.fbstring,
+             ixPerson=fborm.fbint, dt=fborm.fbdatetime, s=fborm.fbstring)))
+    fast = best(lambda: fborm.extract_all(soup.cases, typemap), args.repeat)
+    slow_typemap = dict(typemap, events=fborm.fbevents(
+        dict(typemap['events'].typemap, dt=strptime_fbdatetime)))
+    slow = best(lambda: fborm.extract_all(soup.cases, slow_typemap),
+                args.repeat)
+    print '%-24s %8.1f ms  (strptime %.1f ms, %.2fx)' % (
+        'extract_all', fast * 1e3, slow * 1e3, slow / fast)
+
+if __name__ == '__main__':
+    main()
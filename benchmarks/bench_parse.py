@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+"""Benchmark the parse and convert pipeline: :py:func:`fborm.parse.extract`,
+:py:func:`fborm.parse.extract_all`, :py:func:`fborm.parse.fbargs`,
+:py:func:`fborm.parse.keys2cols` and the :py:mod:`fborm.types` converters,
+on synthetic responses for every typemap in :py:mod:`fborm.objects` .
+
+For each typemap and size it reports the conversion throughput, the peak
+memory the conversion adds and the number of garbage collected objects
+(dictionaries, lists, instances) left allocated per item. Memory is
+measured in a fresh interpreter per typemap and size, so one measurement
+does not inherit the high-water mark of another.
+
+    python benchmarks/bench_parse.py --sizes 10,100,1000 -o before.json
+    ... change something ...
+    python benchmarks/bench_parse.py --sizes 10,100,1000 -o after.json
+    python benchmarks/compare.py before.json after.json
+"""
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import timeit
+
+_here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(_here, '..'))
+sys.path.insert(0, _here)
+import fborm
+from fborm import types
+import synthetic
+
+converters = dict(
+    fbint       = (types.fbint, u'4242'),
+    fbbool      = (types.fbbool, u'true'),
+    fbfloat     = (types.fbfloat, u'12.5'),
+    fbstring    = (types.fbstring, u'Crash on login with SSO enabled'),
+    fbdatetime  = (types.fbdatetime, u'2013-06-29T22:24:43Z'),
+    fbixBugChildren = (types.fbixBugChildren, u'12,13,14'),
+)
+"""The converters timed on their own, with the text they are given."""
+
+def _soup(typemap, size, events):
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(synthetic.response_xml(typemap, size, events),
+                         'xml')
+
+def _best(func, repeat, number=1):
+    return min(timeit.repeat(func, repeat=repeat, number=number)) / number
+
+def _maxrss_kb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss //= 1024
+    return rss
+
+def measure_memory(name, size, events):
+    """Run in the child interpreter: the peak memory growth and objects
+    left per item for one ``extract_all`` call. Only the first call can
+    raise the high-water mark, so there is no warming up.
+    """
+    typemap = synthetic.typemaps()[name]
+    soup = _soup(typemap, size, events)
+    listing = synthetic.items(soup)
+    plan = fborm.compile_typemap(typemap)
+    gc.collect()
+    gc.disable()
+    before_rss = _maxrss_kb()
+    before_objects = len(gc.get_objects())
+    result = plan.extract_all(listing)
+    objects = len(gc.get_objects()) - before_objects
+    peak = _maxrss_kb() - before_rss
+    gc.enable()
+    return dict(peak_kb=peak,
+                gc_objects_per_item=float(objects) / max(len(result), 1))
+
+def _child_memory(name, size, events):
+    out = subprocess.check_output(
+        [sys.executable, os.path.abspath(__file__), '--child', name,
+         '--sizes', str(size), '--events', str(events)])
+    return json.loads(out)
+
+def bench_typemap(name, typemap, size, events, repeat, memory=True):
+    soup = _soup(typemap, size, events)
+    listing = synthetic.items(soup)
+    fborm.parse.clear_compiled()
+    first = _best(lambda: fborm.extract_all(listing, typemap), 1)
+    seconds = _best(lambda: fborm.extract_all(listing, typemap), repeat)
+    result = fborm.extract_all(listing, typemap)
+    item = listing.find(True, recursive=False)
+    single = _best(lambda: fborm.extract(item, typemap), repeat, 100)
+    args = _best(lambda: [fborm.fbargs(obj, typemap) for obj in result],
+                 repeat)
+    cols = _best(lambda: fborm.keys2cols(typemap), repeat, 1000)
+    res = dict(typemap=name, items=size, events=events,
+               extract_all_s=seconds,
+               extract_all_first_s=first,
+               items_per_s=size / seconds if seconds else None,
+               extract_us=single * 1e6,
+               fbargs_us_per_item=args / max(size, 1) * 1e6,
+               keys2cols_us=cols * 1e6)
+    if memory:
+        res.update(_child_memory(name, size, events))
+    return res
+
+def bench_converters(repeat, number=20000):
+    res = []
+    for name, (conv, text) in sorted(converters.iteritems()):
+        data = types._obj(text=text)
+        seconds = _best(lambda: conv(data), repeat, number)
+        res.append(dict(name='convert/' + name, ns_per_call=seconds * 1e9))
+    return res
+
+def run(args):
+    results = []
+    selected = synthetic.typemaps()
+    if args.typemaps:
+        selected = dict((name, selected[name])
+                        for name in args.typemaps.split(','))
+    sizes = [int(size) for size in args.sizes.split(',')]
+    for name, typemap in sorted(selected.iteritems()):
+        for size in sizes:
+            res = bench_typemap(name, typemap, size, args.events,
+                                args.repeat, not args.no_memory)
+            res['name'] = 'extract_all/%s/%d' % (name, size)
+            results.append(res)
+            sys.stderr.write(
+                '%-44s %10.0f items/s %8s kB %6.1f obj/item\n' % (
+                    res['name'], res['items_per_s'] or 0,
+                    res.get('peak_kb', '-'),
+                    res.get('gc_objects_per_item', 0)))
+    results.extend(bench_converters(args.repeat))
+    return dict(
+        meta=dict(python=platform.python_version(),
+                  implementation=platform.python_implementation(),
+                  platform=platform.platform(),
+                  fborm=fborm.__version_string__,
+                  date=datetime.datetime.utcnow().isoformat(),
+                  sizes=sizes, events=args.events, repeat=args.repeat),
+        results=results)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default='10,100,1000',
+                        help='comma separated item counts')
+    parser.add_argument('--events', type=int, default=10,
+                        help='events per case for the event typemaps')
+    parser.add_argument('--typemaps', default='',
+                        help='comma separated fborm.objects typemap names')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--no-memory', action='store_true',
+                        help='skip the peak memory and object counts')
+    parser.add_argument('-o', '--output', help='write the JSON results here')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        json.dump(measure_memory(args.child, int(args.sizes), args.events),
+                  sys.stdout)
+        return
+    report = run(args)
+    text = json.dumps(report, indent=1, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as fh:
+            fh.write(text)
+    else:
+        print text
+
+if __name__ == '__main__':
+    main()
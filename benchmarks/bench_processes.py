@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""Benchmark the multi-process conversion of :py:mod:`fborm.parallel`
+against converting in one process, on synthetic search responses.
+
+For each size it times the single process conversion of the same `lxml`
+elements (:py:func:`fborm.stream.iterextract`), then
+:py:func:`fborm.parallel.extract_parallel` for every process count, and
+reports the speedup of each, which gives the scaling curve. The pools are
+started before timing, as a long running program would keep one; the cost
+of starting one is reported on its own.
+
+    python benchmarks/bench_processes.py --sizes 1000,10000 \\
+        --processes 1,2,4,8 -o processes.json
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import time
+import timeit
+from cStringIO import StringIO
+
+_here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(_here, '..'))
+sys.path.insert(0, _here)
+import fborm
+import synthetic
+
+def _best(func, repeat):
+    return min(timeit.repeat(func, repeat=repeat, number=1))
+
+def bench_size(typemap, size, events, processes, chunk_size, repeat,
+               pools):
+    xml = synthetic.response_xml(typemap, size, events)
+    single = _best(lambda: list(fborm.iterextract(StringIO(xml), 'case',
+                                                  typemap)), repeat)
+    results = [dict(processes=0, extract_all_s=single,
+                    items_per_s=size / single, speedup=1.0)]
+    for count in processes:
+        seconds = _best(lambda: fborm.extract_parallel(
+            StringIO(xml), 'case', typemap, processes=pools[count],
+            chunk_size=chunk_size), repeat)
+        results.append(dict(processes=count, extract_all_s=seconds,
+                            items_per_s=size / seconds,
+                            speedup=single / seconds))
+    return results
+
+def run(args):
+    typemap = getattr(fborm.objects, args.typemap)
+    sizes = [int(size) for size in args.sizes.split(',')]
+    processes = [int(count) for count in args.processes.split(',')]
+    pools = {}
+    startup = {}
+    for count in processes:
+        start = time.time()
+        pools[count] = multiprocessing.Pool(count)
+        ## wait until every worker has started
+        pools[count].map(abs, range(count))
+        startup[count] = time.time() - start
+    results = []
+    try:
+        for size in sizes:
+            for res in bench_size(typemap, size, args.events, processes,
+                                  args.chunk_size, args.repeat, pools):
+                res['name'] = 'processes/%s/%d/%d' % (
+                    args.typemap, size, res['processes'])
+                res['items'] = size
+                results.append(res)
+                sys.stderr.write('%-44s %10.0f items/s %6.2fx\n' % (
+                    res['name'], res['items_per_s'], res['speedup']))
+    finally:
+        for pool in pools.itervalues():
+            pool.terminate()
+    return dict(
+        meta=dict(python=platform.python_version(),
+                  implementation=platform.python_implementation(),
+                  platform=platform.platform(),
+                  cpus=multiprocessing.cpu_count(),
+                  fborm=fborm.__version_string__,
+                  date=datetime.datetime.utcnow().isoformat(),
+                  typemap=args.typemap, sizes=sizes, events=args.events,
+                  chunk_size=args.chunk_size, repeat=args.repeat,
+                  pool_startup_s=startup),
+        results=results)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default='1000,5000',
+                        help='comma separated case counts')
+    parser.add_argument('--processes', default='1,2,4,8',
+                        help='comma separated process counts')
+    parser.add_argument('--typemap', default='fbBug_withEvents',
+                        help='fborm.objects case typemap name')
+    parser.add_argument('--events', type=int, default=10,
+                        help='events per case for the event typemaps')
+    parser.add_argument('--chunk-size', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('-o', '--output', help='write the JSON results here')
+    args = parser.parse_args(argv)
+    report = run(args)
+    text = json.dumps(report, indent=1, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as fh:
+            fh.write(text)
+    else:
+        print text
+
+if __name__ == '__main__':
+    main()
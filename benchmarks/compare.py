@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""Compare two result files written by ``bench_parse.py -o``, and exit with
+status 1 if any measurement got worse by more than the threshold.
+
+    python benchmarks/compare.py before.json after.json --threshold 15
+"""
+import argparse
+import json
+import sys
+
+metrics = ('extract_all_s', 'extract_us', 'fbargs_us_per_item',
+           'keys2cols_us', 'peak_kb', 'gc_objects_per_item', 'ns_per_call')
+"""The compared measurements, all of which are better when lower."""
+
+_noise = dict(extract_all_s=0.001, peak_kb=256, gc_objects_per_item=0.5)
+## differences smaller than these are treated as noise, and anything not
+## listed is a timing in microseconds or nanoseconds
+
+def _load(filename):
+    with open(filename) as fh:
+        report = json.load(fh)
+    return dict((res['name'], res) for res in report['results'])
+
+def compare(before, after, threshold):
+    """Yield ``(name, metric, old, new, change, regressed)`` for every
+    measurement found in both runs.
+    """
+    for name in sorted(set(before) & set(after)):
+        for metric in sorted(metrics):
+            old = before[name].get(metric)
+            new = after[name].get(metric)
+            if old is None or new is None:
+                continue
+            change = (new - old) / float(old) * 100 if old else 0.0
+            noise = _noise.get(metric, 1)
+            regressed = change > threshold and new - old > noise
+            yield name, metric, old, new, change, regressed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=15.0,
+                        help='percentage worse counted as a regression')
+    parser.add_argument('--all', action='store_true',
+                        help='list every measurement, not only changes')
+    args = parser.parse_args(argv)
+    regressions = 0
+    for name, metric, old, new, change, regressed in compare(
+            _load(args.before), _load(args.after), args.threshold):
+        regressions += regressed
+        if args.all or regressed or abs(change) > args.threshold:
+            print '%-44s %-20s %12.3f %12.3f %+7.1f%%%s' % (
+                name, metric, old, new, change,
+                '  REGRESSION' if regressed else '')
+    print '%d regression(s)' % regressions
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
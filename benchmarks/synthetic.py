@@ -0,0 +1,155 @@
+"""Synthetic FogBugz XML API responses for the benchmarks.
+
+The XML is generated from the typemaps themselves, so every typemap in
+:py:mod:`fborm.objects` (and any custom one) gets a response holding every
+field it extracts, with values of the right type:
+
+    xml = response_xml(fborm.objects.fbBug_withEvents, 1000, events=20)
+    soup = BeautifulSoup(xml, 'xml')
+    cases = fborm.extract_all(items(soup), fborm.objects.fbBug_withEvents)
+
+Generation is seeded, so the same arguments always produce the same XML.
+"""
+import datetime
+import functools
+import random
+from fborm import objects
+from fborm import types
+
+_words = ('build', 'crash', 'login', 'report', 'export', 'page', 'slow',
+          'error', 'customer', 'setting', 'upload', 'search', 'email',
+          'timeout', 'layout', 'import', 'install', 'update')
+
+containers = dict(
+    fbBug               = ('cases', 'case'),
+    fbBug_ixBug         = ('cases', 'case'),
+    fbBug_withEvents    = ('cases', 'case'),
+    fbBug_withMiniEvents = ('cases', 'case'),
+    fbBug_withLatestEvent = ('cases', 'case'),
+    fbBugEvent          = ('events', 'event'),
+    fbBugMiniEvent      = ('events', 'event'),
+    fbPerson            = ('people', 'person'),
+    fbPersonOld         = ('people', 'person'),
+    fbProject           = ('projects', 'project'),
+    fbArea              = ('areas', 'area'),
+    fbCategory          = ('categories', 'category'),
+    fbPriority          = ('priorities', 'priority'),
+    fbStatus            = ('statuses', 'status'),
+    fbFixFor            = ('fixfors', 'fixfor'),
+    fbTag               = ('tags', 'tag'),
+    fbFilter            = ('filters', 'filter'),
+    fbAttachment        = ('rgAttachments', 'attachment'),
+    fbError             = ('errors', 'error'))
+"""The list element and item element names of the responses holding each
+typemap of :py:mod:`fborm.objects`, by typemap name.
+"""
+
+def typemaps():
+    """All the typemaps defined in :py:mod:`fborm.objects`, by name.
+    Aliases such as ``fbMilestone`` are left out.
+    """
+    found = {}
+    for name in sorted(vars(objects)):
+        value = getattr(objects, name)
+        if (name.startswith('fb') and isinstance(value, dict) and
+            all(id(value) != id(seen) for seen in found.itervalues())):
+            found[name] = value
+    return found
+
+def _unwrap(conv):
+    while (isinstance(conv, functools.partial) and not conv.args and
+           not conv.keywords):
+        conv = conv.func
+    return conv
+
+class _Generator(object):
+    def __init__(self, seed, events):
+        self.rnd = random.Random(seed)
+        self.events = events
+        self.when = datetime.datetime(2012, 1, 1)
+
+    def scalar(self, conv):
+        rnd = self.rnd
+        if conv is types.fbint:
+            return str(rnd.randint(1, 5000))
+        if conv is types.fbbool:
+            return rnd.choice(('true', 'false'))
+        if conv is types.fbfloat:
+            return '%.2f' % rnd.uniform(0, 100)
+        if conv is types.fbdatetime:
+            if rnd.random() < 0.6:
+                self.when += datetime.timedelta(
+                    seconds=rnd.randint(1, 86400))
+            return self.when.strftime(types.fbisofmt)
+        return ' '.join(rnd.choice(_words)
+                        for n in xrange(rnd.randint(1, 8)))
+
+    def value(self, conv, tag):
+        """The content of the element for a field converted by **conv** .
+        """
+        conv = _unwrap(conv)
+        if not isinstance(conv, functools.partial):
+            return self.scalar(conv)
+        name = getattr(conv.func, '__name__', '')
+        if name == '_extractall':
+            count = self.events if tag in ('events',) else \
+                    self.rnd.randint(0, 2)
+            return ''.join(self.item(conv.args[0], 'item')
+                           for n in xrange(count))
+        if name == '_listof':
+            return ''.join('<item>%s</item>' % self.value(conv.args[0], '')
+                           for n in xrange(self.rnd.randint(0, 4)))
+        if name == '_fbcommalistof':
+            return ','.join(str(self.rnd.randint(1, 5000))
+                            for n in xrange(self.rnd.randint(0, 3)))
+        if name in ('firstelem', '_conditional'):
+            return self.value(conv.args[0], tag)
+        return self.scalar(conv.func)
+
+    def item(self, typemap, tag):
+        """The element for one item of **typemap** called **tag** .
+        """
+        attrs = []
+        text = ''
+        children = []
+        for name, conv in sorted(typemap.iteritems()):
+            if getattr(conv, 'ignore', False):
+                continue
+            resname = getattr(conv, 'resname', name)
+            if getattr(conv, 'attrib', False):
+                base = _unwrap(conv)
+                if base is types._fbselfstr:
+                    text = self.scalar(types.fbstring)
+                else:
+                    attrs.append(' %s="%s"' % (
+                        resname, self.value(base.args[0], resname)))
+                continue
+            children.append('<%s>%s</%s>' % (
+                resname, self.value(conv, resname), resname))
+        return '<%s%s>%s%s</%s>' % (tag, ''.join(attrs), text,
+                                    ''.join(children), tag)
+
+def response_xml(typemap, count, events=10, container=None, seed=42):
+    """A complete API response with **count** items of **typemap**, each
+    nested list of events holding **events** events. **container** is the
+    ``(list, item)`` pair of element names, looked up in
+    :py:data:`containers` for the typemaps of :py:mod:`fborm.objects` .
+    """
+    if container is None:
+        for name, value in typemaps().iteritems():
+            if value is typemap:
+                container = containers.get(name)
+        container = container or ('items', 'item')
+    listtag, itemtag = container
+    gen = _Generator(seed, events)
+    return ''.join(
+        ['<?xml version="1.0" encoding="UTF-8"?><response>',
+         '<%s count="%d">' % (listtag, count)] +
+        [gen.item(typemap, itemtag) for n in xrange(count)] +
+        ['</%s></response>' % listtag])
+
+def items(soup):
+    """The list element of a parsed response, which is what gets passed to
+    :py:func:`fborm.parse.extract_all` .
+    """
+    return soup.response.find(True, recursive=False)
@@ -18,21 +18,60 @@ from .util import *
 from .types import *
 from .objects import *
 from .parse import *
+from .records import *
+from .columnar import *
 from .commands import *
 from .ext import *
 from .patch import *
+from .stream import *
+from .pool import *
+from .cache import *
+from .index import *
+from .transport import *
+from .fakeserver import *
+from .instrument import *
+from .store import *
+from .sync import *
+from .coalesce import *
+from .resilience import *
+from .projection import *
+from .parallel import *
 
 class FogBugzORM:
     """FogBugzORM Class Interface Documentation
     
+    The **cache** argument enables caching of the reference data ``list*``
+    commands. Pass ``True`` for a default :py:class:`fborm.cache.TTLCache`,
+    or your own configured instance. The **index** argument takes a
+    :py:class:`fborm.index.ReferenceIndex` used to answer ``view*`` commands
+    locally while it is warm. The **transport** argument takes a
+    :py:class:`fborm.transport.PooledTransport` (or ``True`` for a default
+    one) which is used for all API commands and downloads. The
+    **instrument** argument takes a :py:class:`fborm.instrument.Instrument`
+    which times every method call, see :py:mod:`fborm.instrument` .
     
+    The **coalesce** argument takes a
+    :py:class:`fborm.coalesce.SingleFlight` (or ``True`` for a new one)
+    letting identical concurrent ``search``, ``list*`` and ``view*`` calls
+    share one request. The **batch** argument takes a
+    :py:class:`fborm.coalesce.MicroBatcher` (or ``True`` for a default one)
+    which answers bursts of ``view*`` lookups with one ``list*`` command,
+    see :py:mod:`fborm.coalesce` .
+    
+    The **resilience** argument takes a
+    :py:class:`fborm.resilience.Resilience` (or ``True`` for a default one)
+    which retries transient failures of the API commands, and can also
+    rate limit them and stop calling a failing server, see
+    :py:mod:`fborm.resilience` .
     """
     
     #########################################################################
     ## Initialization and Authentication
     
     def __init__(self, hostname, token=None, username=None, password=None,
-                 namemap={}):
+                 namemap={}, cache=None, index=None, transport=None,
+                 instrument=None, coalesce=None, batch=None,
+                 resilience=None):
         if token and (username or password):
             raise TypeError(
                 "if you supply 'token' you can"
@@ -41,8 +80,31 @@ class FogBugzORM:
             raise TypeError(
                 "You must supply both 'username' and 'password'")
         self.namemap = namemap
+        if cache is True:
+            cache = TTLCache()
+        self.cache = cache
+        self.index = index
+        if coalesce is True:
+            coalesce = SingleFlight()
+        self.coalesce = coalesce
+        if batch is True:
+            batch = MicroBatcher()
+        self.batch = batch
         import fogbugz
         self.fb = fogbugz.FogBugz(hostname, token=token)
+        if transport is True:
+            transport = PooledTransport()
+        self.transport = transport
+        if transport is not None:
+            self.fb._opener = transport
+        if resilience is True:
+            resilience = Resilience()
+        self.resilience = resilience
+        if resilience is not None:
+            self.fb = resilience.wrap(self.fb)
+        self.instrument = instrument
+        if instrument is not None:
+            self.fb = instrument.wrap(self.fb)
         self.username = username
         self.password = password
         if username:
@@ -90,6 +152,15 @@ class FogBugzORM:
         except:
             pass
     
+    def clone_session(self):
+        """Return a copy of this object using a cloned FogBugz session, see
+        :py:func:`fborm.pool.clone_session` .
+        """
+        import copy
+        clone = copy.copy(self)
+        clone.fb = clone_session(self.fb)
+        return clone
+    
     def generate_token(self, username=None, password=None):
         """
         """
@@ -121,6 +192,110 @@ class FogBugzORM:
         finally:
             self.fb._token = old_token
     
+    #########################################################################
+    ## Instrumentation, see fborm.instrument
+
+    def _call(self, func, *args, **kwdargs):
+        if self.instrument is None:
+            return func(self.fb, *args, **kwdargs)
+        return self.instrument.call(func.__name__, func, self.fb,
+                                    *args, **kwdargs)
+
+    #########################################################################
+    ## Reference data caching and indexes, see fborm.cache and fborm.index
+    
+    def _shared(self, func, args, kwdargs):
+        if self.coalesce is None:
+            return self._call(func, *args, **kwdargs)
+        res = self.coalesce.do(make_key(func.__name__, args, kwdargs),
+                               lambda: self._call(func, *args, **kwdargs))
+        if isinstance(res, list):
+            res = list(res)
+        return res
+    
+    def _cached(self, entity, func, args, kwdargs):
+        if self.cache is None:
+            return self._shared(func, args, kwdargs)
+        res = self.cache.fetch(entity, (func.__name__,) + args, kwdargs,
+                               lambda: self._shared(func, args, kwdargs))
+        if isinstance(res, list):
+            res = list(res)
+        return res
+    
+    def _invalidate(self, command):
+        entities = invalidated_by.get(command)
+        if self.cache is not None and entities:
+            self.cache.invalidate(*entities)
+    
+    def _viewed(self, entity, func, args, kwdargs):
+        if self.index is None and self.batch is None:
+            return self._shared(func, args, kwdargs)
+        import inspect
+        callargs = inspect.getcallargs(func, self.fb, *args, **kwdargs)
+        del callargs['fb']
+        typearg = [name for name in callargs if name.endswith('type')][0]
+        typemap = callargs.pop(typearg)
+        if self.index is not None:
+            res = self.index.view(entity, typemap, callargs)
+            if res is not None:
+                return res
+        if self.batch is not None and entity in batched_views:
+            key, command, listtype, listargs = batched_views[entity]
+            ix = callargs.pop(key, None)
+            if ix and not any(callargs.itervalues()):
+                def load_all():
+                    items = self._cached(command, getattr(commands, command),
+                                         (), dict(listargs,
+                                                  **{listtype: typemap}))
+                    return dict((item[key], item) for item in items)
+                return self.batch.get(
+                    (entity, id(typemap)), int(ix), load_all,
+                    lambda: self._shared(func, args, kwdargs))
+        return self._shared(func, args, kwdargs)
+    
+    #########################################################################
+    ## Downloads
+    
+    def _download_url(self, url):
+        import urlparse
+        url = urlparse.urljoin(self.fb._url, url)
+        if self.token and 'token=' not in url:
+            url += ('&' if '?' in url else '?') + 'token=' + self.token
+        return url
+    
+    def download(self, url):
+        """Wrapper around :py:func:`fborm.util.download` using the transport
+        of this instance. Relative URLs, such as the ``sURL`` of
+        :py:data:`fborm.objects.fbAttachment`, are resolved against the
+        server, and the token is added for authentication.
+        """
+        return download(self._download_url(url), self.transport,
+                        self.resilience)
+    
+    def download_to_file(self, url, filename, **kwdargs):
+        """Wrapper around :py:func:`fborm.util.download_to_file` , see
+        :py:meth:`fborm.FogBugzORM.download` .
+        """
+        kwdargs.setdefault('resilience', self.resilience)
+        return download_to_file(self._download_url(url), filename,
+                                self.transport, **kwdargs)
+    
+    def download_many(self, downloads, workers=4, **kwdargs):
+        """Wrapper around :py:func:`fborm.util.download_many` , see
+        :py:meth:`fborm.FogBugzORM.download` . The ``url`` of each result is
+        the one passed in.
+        """
+        if hasattr(downloads, 'iteritems'):
+            downloads = downloads.iteritems()
+        downloads = list(downloads)
+        kwdargs.setdefault('resilience', self.resilience)
+        res = download_many([(self._download_url(url), filename)
+                             for url, filename in downloads],
+                            workers, self.transport, **kwdargs)
+        for item, (url, filename) in zip(res, downloads):
+            item.url = url
+        return res
+    
     #########################################################################
     ## Extension interfaces, that look like API, but are not
     
@@ -128,13 +303,13 @@ class FogBugzORM:
         """Wrapper around :py:func:`fborm.ext.listCustomFieldNames` .
         The first argument, the fogbugz instance, is supplied automatically.
         """
-        return listCustomFieldNames(self.fb, sample_bugs)
+        return self._call(listCustomFieldNames, sample_bugs)
     
     def listAllPeople(self, *args, **kwdargs):
         """Wrapper around :py:func:`fborm.ext.listAllPeople` .
         The first argument, the fogbugz instance, is supplied automatically.
         """
-        return listAllPeople(self.fb, *args, **kwdargs)
+        return self._cached('listPeople', listAllPeople, args, kwdargs)
         
     #########################################################################
     ## Now we get to the standard interfaces
@@ -143,7 +318,7 @@ class FogBugzORM:
         """Wrapper around :py:func:`fborm.commands.listFilters` .
         The first argument, the fogbugz instance, is supplied automatically.
         """
-        return listFilters(self.fb, sort_by=sort_by)
+        return self._call(listFilters, sort_by=sort_by)
         
     def setCurrentFilter(self, filter):
         """Wrapper around :py:func:`fborm.commands.setCurrentFilter` .
@@ -152,7 +327,7 @@ class FogBugzORM:
         This extends the normal interface to accept multiple types of objects
         for the **filter** argument.
         """
-        return setCurrentFilter(self.fb, filter)
+        return self._call(setCurrentFilter, filter)
         
     def search(self, *args, **kwdargs):
         """Wrapper around :py:func:`fborm.commands.search` .
@@ -163,7 +338,41 @@ class FogBugzORM:
         if 'namemap' not in kwdargs:
             kwdargs = dict(kwdargs)
             kwdargs['namemap'] = self.namemap
-        return search(self.fb, *args, **kwdargs)
+        return self._shared(search, args, kwdargs)
+
+    def search_iter(self, *args, **kwdargs):
+        """Wrapper around :py:func:`fborm.commands.search_iter` .
+        The first argument, the fogbugz instance, is supplied automatically.
+        The keyword argument **namemap**, if not supplied, will be set to
+        the the namemap member supplied during construction.
+        """
+        if 'namemap' not in kwdargs:
+            kwdargs = dict(kwdargs)
+            kwdargs['namemap'] = self.namemap
+        return search_iter(self.fb, *args, **kwdargs)
+
+    def search_many(self, queries, **kwdargs):
+        """Wrapper around :py:func:`fborm.commands.search_many` .
+        The first argument, the fogbugz instance, is supplied automatically.
+        The keyword argument **namemap**, if not supplied, will be set to
+        the the namemap member supplied during construction. Construct with
+        a **transport** so the workers reuse their connections.
+        """
+        if 'namemap' not in kwdargs:
+            kwdargs = dict(kwdargs)
+            kwdargs['namemap'] = self.namemap
+        return self._call(search_many, queries, **kwdargs)
+
+    def search_stream(self, *args, **kwdargs):
+        """Wrapper around :py:func:`fborm.stream.search_stream` .
+        The first argument, the fogbugz instance, is supplied automatically.
+        The keyword argument **namemap**, if not supplied, will be set to
+        the the namemap member supplied during construction.
+        """
+        if 'namemap' not in kwdargs:
+            kwdargs = dict(kwdargs)
+            kwdargs['namemap'] = self.namemap
+        return search_stream(self.fb, *args, **kwdargs)
 
     def new(self, bug, bugtype, **kwdargs):
         """Wrapper around :py:func:`fborm.commands.new` .
@@ -174,7 +383,10 @@ class FogBugzORM:
         if 'namemap' not in kwdargs:
             kwdargs = dict(kwdargs)
             kwdargs['namemap'] = self.namemap
-        return new(self.fb, bug, bugtype, **kwdargs)
+        try:
+            return self._call(new, bug, bugtype, **kwdargs)
+        finally:
+            self._invalidate('new')
         
     def edit(self, bug, bugtype, **kwdargs):
         """Wrapper around :py:func:`fborm.commands.edit` .
@@ -185,7 +397,10 @@ class FogBugzORM:
         if 'namemap' not in kwdargs:
             kwdargs = dict(kwdargs)
             kwdargs['namemap'] = self.namemap
-        return edit(self.fb, bug, bugtype, **kwdargs)
+        try:
+            return self._call(edit, bug, bugtype, **kwdargs)
+        finally:
+            self._invalidate('edit')
         
     def resolve(self, bug, bugtype, **kwdargs):
         """Wrapper around :py:func:`fborm.commands.resolve` .
@@ -196,7 +411,10 @@ class FogBugzORM:
         if 'namemap' not in kwdargs:
             kwdargs = dict(kwdargs)
             kwdargs['namemap'] = self.namemap
-        return resolve(self.fb, bug, bugtype, **kwdargs)
+        try:
+            return self._call(resolve, bug, bugtype, **kwdargs)
+        finally:
+            self._invalidate('resolve')
         
     def close(self, bug, bugtype, **kwdargs):
         """Wrapper around :py:func:`fborm.commands.close` .
@@ -207,7 +425,10 @@ class FogBugzORM:
         if 'namemap' not in kwdargs:
             kwdargs = dict(kwdargs)
             kwdargs['namemap'] = self.namemap
-        return close(self.fb, bug, bugtype, **kwdargs)
+        try:
+            return self._call(close, bug, bugtype, **kwdargs)
+        finally:
+            self._invalidate('close')
 
     def reopen(self, bug, bugtype, **kwdargs):
         """Wrapper around :py:func:`fborm.commands.reopen` .
@@ -218,7 +439,10 @@ class FogBugzORM:
         if 'namemap' not in kwdargs:
             kwdargs = dict(kwdargs)
             kwdargs['namemap'] = self.namemap
-        return reopen(self.fb, bug, bugtype, **kwdargs)
+        try:
+            return self._call(reopen, bug, bugtype, **kwdargs)
+        finally:
+            self._invalidate('reopen')
 
     def reactivate(self, bug, bugtype, **kwdargs):
         """Wrapper around :py:func:`fborm.commands.reactivate` .
@@ -229,173 +453,339 @@ class FogBugzORM:
         if 'namemap' not in kwdargs:
             kwdargs = dict(kwdargs)
             kwdargs['namemap'] = self.namemap
-        return reactivate(self.fb, bug, bugtype, **kwdargs)
+        try:
+            return self._call(reactivate, bug, bugtype, **kwdargs)
+        finally:
+            self._invalidate('reactivate')
+        
+    def bulk_edit(self, bugs, bugtype, **kwdargs):
+        """Wrapper around :py:func:`fborm.commands.bulk_edit` .
+        The first argument, the fogbugz instance, is supplied automatically.
+        The keyword argument **namemap**, if not supplied, will be set to
+        the the namemap member supplied during construction.
+        """
+        if 'namemap' not in kwdargs:
+            kwdargs = dict(kwdargs)
+            kwdargs['namemap'] = self.namemap
+        try:
+            return self._call(bulk_edit, bugs, bugtype, **kwdargs)
+        finally:
+            self._invalidate('bulk_edit')
+    
+    def sync(self, store, *args, **kwdargs):
+        """Wrapper around :py:func:`fborm.sync.sync_cases` .
+        The first argument, the fogbugz instance, is supplied automatically.
+        The keyword argument **namemap**, if not supplied, will be set to
+        the the namemap member supplied during construction.
+        """
+        if 'namemap' not in kwdargs:
+            kwdargs = dict(kwdargs)
+            kwdargs['namemap'] = self.namemap
+        return self._call(sync_cases, store, *args, **kwdargs)
+    
+    def sync_events(self, store, *args, **kwdargs):
+        """Wrapper around :py:func:`fborm.sync.sync_events` .
+        The first argument, the fogbugz instance, is supplied automatically.
+        The keyword argument **namemap**, if not supplied, will be set to
+        the the namemap member supplied during construction.
+        """
+        if 'namemap' not in kwdargs:
+            kwdargs = dict(kwdargs)
+            kwdargs['namemap'] = self.namemap
+        return self._call(sync_events, store, *args, **kwdargs)
         
     def listTags(self, *args, **kwdargs):
         """Wrapper around :py:func:`fborm.commands.listTags` .
         The first argument, the fogbugz instance, is supplied automatically.
         """
-        return listTags(self.fb, *args, **kwdargs)
+        return self._cached('listTags', listTags, args, kwdargs)
     
     def viewProject(self, *args, **kwdargs):
         """Wrapper around :py:func:`fborm.commands.viewProject` .
         The first argument, the fogbugz instance, is supplied automatically.
         """
-        return viewProject(self.fb, *args, **kwdargs)
+        return self._viewed('projects', viewProject, args, kwdargs)
         
     def listProjects(self, *args, **kwdargs):
         """Wrapper around :py:func:`fborm.commands.listProjects` .
         The first argument, the fogbugz instance, is supplied automatically.
         """
-        return listProjects(self.fb, *args, **kwdargs)
+        return self._cached('listProjects', listProjects, args, kwdargs)
         
     def viewArea(self, *args, **kwdargs):
         """Wrapper around :py:func:`fborm.commands.viewArea` .
         The first argument, the fogbugz instance, is supplied automatically.
         """
-        return viewArea(self.fb, *args, **kwdargs)
+        return self._viewed('areas', viewArea, args, kwdargs)
         
     def listAreas(self, *args, **kwdargs):
         """Wrapper around :py:func:`fborm.commands.listAreas` .
         The first argument, the fogbugz instance, is supplied automatically.
         """
-        return listAreas(self.fb, *args, **kwdargs)
+        return self._cached('listAreas', listAreas, args, kwdargs)
         
     def viewCategory(self, *args, **kwdargs):
         """Wrapper around :py:func:`fborm.commands.viewCategory` .
         The first argument, the fogbugz instance, is supplied automatically.
         """
-        return viewCategory(self.fb, *args, **kwdargs)
+        return self._call(viewCategory, *args, **kwdargs)
         
     def listCategories(self, *args, **kwdargs):
         """Wrapper around :py:func:`fborm.commands.listCategories` .
         The first argument, the fogbugz instance, is supplied automatically.
         """
-        return listCategories(self.fb, *args, **kwdargs)
+        return self._cached('listCategories', listCategories, args, kwdargs)
         
     def viewPriority(self, *args, **kwdargs):
         """Wrapper around :py:func:`fborm.commands.viewPriority` .
         The first argument, the fogbugz instance, is supplied automatically.
         """
-        return viewPriority(self.fb, *args, **kwdargs)
+        return self._call(viewPriority, *args, **kwdargs)
         
     def listPriorities(self, *args, **kwdargs):
         """Wrapper around :py:func:`fborm.commands.listPriorities` .
         The first argument, the fogbugz instance, is supplied automatically.
         """
-        return listPriorities(self.fb, *args, **kwdargs)
+        return self._cached('listPriorities', listPriorities, args, kwdargs)
         
     def viewPerson(self, *args, **kwdargs):
         """Wrapper around :py:func:`fborm.commands.viewPerson` .
         The first argument, the fogbugz instance, is supplied automatically.
         """
-        return viewPerson(self.fb, *args, **kwdargs)
+        return self._viewed('people', viewPerson, args, kwdargs)
         
     def listPeople(self, *args, **kwdargs):
         """Wrapper around :py:func:`fborm.commands.listPeople` .
         The first argument, the fogbugz instance, is supplied automatically.
         """
-        return listPeople(self.fb, *args, **kwdargs)
+        return self._cached('listPeople', listPeople, args, kwdargs)
         
     def viewStatus(self, *args, **kwdargs):
         """Wrapper around :py:func:`fborm.commands.viewStatus` .
         The first argument, the fogbugz instance, is supplied automatically.
         """
-        return viewStatus(self.fb, *args, **kwdargs)
+        return self._viewed('statuses', viewStatus, args, kwdargs)
         
     def listStatuses(self, *args, **kwdargs):
         """Wrapper around :py:func:`fborm.commands.listStatuses` .
         The first argument, the fogbugz instance, is supplied automatically.
         """
-        return listStatuses(self.fb, *args, **kwdargs)
+        return self._cached('listStatuses', listStatuses, args, kwdargs)
         
     def viewFixFor(self, *args, **kwdargs):
         """Wrapper around :py:func:`fborm.commands.viewFixFor` .
         The first argument, the fogbugz instance, is supplied automatically.
         """
-        return viewFixFor(self.fb, *args, **kwdargs)
+        return self._call(viewFixFor, *args, **kwdargs)
         
     def viewMilestone(self, *args, **kwdargs):
         """Wrapper around :py:func:`fborm.commands.viewMilestone` which
         is an alias for :py:func:`fborm.commands.viewFixFor` .
         The first argument, the fogbugz instance, is supplied automatically.
         """
-        return viewMilestone(self.fb, *args, **kwdargs)
+        return self._call(viewMilestone, *args, **kwdargs)
         
     def listFixFors(self, *args, **kwdargs):
         """Wrapper around :py:func:`fborm.commands.listFixFors` .
         The first argument, the fogbugz instance, is supplied automatically.
         """
-        return listFixFors(self.fb, *args, **kwdargs)
+        return self._cached('listFixFors', listFixFors, args, kwdargs)
         
     def listMilestones(self, *args, **kwdargs):
         """Wrapper around :py:func:`fborm.commands.listMilestones` which
         is an alias for :py:func:`fborm.commands.listFixFors` .
         The first argument, the fogbugz instance, is supplied automatically.
         """
-        return listMilestones(self.fb, *args, **kwdargs)
+        return self._cached('listFixFors', listMilestones, args, kwdargs)
 
     def editFixFor(self, *args, **kwdargs):
         """Wrapper around :py:func:`fborm.commands.editFixFor`.
         The first argument, the fogbugz instance, is supplied automatically.
         """
-        return editFixFor(self.fb, *args, **kwdargs)
+        try:
+            return self._call(editFixFor, *args, **kwdargs)
+        finally:
+            self._invalidate('editFixFor')
     
     def editMilestone(self, *args, **kwdargs):
         """Wrapper around :py:func:`fborm.commands.editMilestone` which
         is an alias for :py:func:`fborm.commands.editFixFor` .
         The first argument, the fogbugz instance, is supplied automatically.
         """
-        return editMilestone(self.fb, *args, **kwdargs)
+        try:
+            return self._call(editMilestone, *args, **kwdargs)
+        finally:
+            self._invalidate('editFixFor')
     
     def newFixFor(self, *args, **kwdargs):
         """Wrapper around :py:func:`fborm.commands.newFixFor`.
         The first argument, the fogbugz instance, is supplied automatically.
         """
-        return newFixFor(self.fb, *args, **kwdargs)
+        try:
+            return self._call(newFixFor, *args, **kwdargs)
+        finally:
+            self._invalidate('newFixFor')
     
     def newMilestone(self, *args, **kwdargs):
         """Wrapper around :py:func:`fborm.commands.newMilestone` which
         is an alias for :py:func:`fborm.commands.newFixFor` .
         The first argument, the fogbugz instance, is supplied automatically.
         """
-        return newMilestone(self.fb, *args, **kwdargs)
+        try:
+            return self._call(newMilestone, *args, **kwdargs)
+        finally:
+            self._invalidate('newFixFor')
     
     def addFixForDependency(self, ixFixFor, ixFixForDependsOn):
         """Wrapper around :py:func:`fborm.commands.addFixForDependency` .
         The first argument, the fogbugz instance, is supplied automatically.
         """
-        return addFixForDependency(self.fb, ixFixFor, ixFixForDependsOn)
+        try:
+            return self._call(addFixForDependency, ixFixFor, ixFixForDependsOn)
+        finally:
+            self._invalidate('addFixForDependency')
     
     def addMilestoneDependency(self, ixFixFor, ixFixForDependsOn):
         """Wrapper around :py:func:`fborm.commands.addMilestoneDependency` which
         is an alias for :py:func:`fborm.commands.addFixForDependency` .
         The first argument, the fogbugz instance, is supplied automatically.
         """
-        return addMilestoneDependency(self.fb, ixFixFor, ixFixForDependsOn)
+        try:
+            return self._call(addMilestoneDependency, ixFixFor, ixFixForDependsOn)
+        finally:
+            self._invalidate('addFixForDependency')
     
     def deleteFixForDependency(self, ixFixFor, ixFixForDependsOn):
         """Wrapper around :py:func:`fborm.commands.addFixForDependency` .
         The first argument, the fogbugz instance, is supplied automatically.
         """
-        return deleteFixForDependency(self.fb, ixFixFor, ixFixForDependsOn)
+        try:
+            return self._call(deleteFixForDependency, ixFixFor, ixFixForDependsOn)
+        finally:
+            self._invalidate('deleteFixForDependency')
         
     def deleteMilestoneDependency(self, ixFixFor, ixFixForDependsOn):
         """Wrapper around :py:func:`fborm.commands.deleteMilestoneDependency` 
         is an alias for :py:func:`fborm.commands.deleteFixForDependency` .
         The first argument, the fogbugz instance, is supplied automatically.
         """
-        return deleteMilestoneDependency(self.fb, ixFixFor, ixFixForDependsOn)
+        try:
+            return self._call(deleteMilestoneDependency, ixFixFor, ixFixForDependsOn)
+        finally:
+            self._invalidate('deleteFixForDependency')
 
     def subscribe(self, ixBug, ixPerson=None):
         """Wrapper around :py:func:`fborm.commands.subscribe` .
         The first argument, the fogbugz instance, is supplied automatically.
         """
-        return subscribe(self.fb, ixBug, ixPerson)
+        return self._call(subscribe, ixBug, ixPerson)
     
     def unsubscribe(self, ixBug, ixPerson=None):
         """Wrapper around :py:func:`fborm.commands.unsubscribe` .
         The first argument, the fogbugz instance, is supplied automatically.
         """
-        return unsubscribe(self.fb, ixBug, ixPerson)
-        
\ No newline at end of file
+        return self._call(unsubscribe, ixBug, ixPerson)
+        
+
+_async_commands = (
+    'listCustomFieldNames', 'listAllPeople', 'listFilters', 'setCurrentFilter',
+    'search', 'search_many', 'new', 'edit', 'resolve', 'close', 'reopen',
+    'reactivate', 'bulk_edit', 'sync', 'sync_events', 'listTags',
+    'viewProject', 'listProjects',
+    'viewArea',
+    'listAreas', 'viewCategory', 'listCategories', 'viewPriority',
+    'listPriorities', 'viewPerson', 'listPeople', 'viewStatus', 'listStatuses',
+    'viewFixFor', 'viewMilestone', 'listFixFors', 'listMilestones',
+    'editFixFor', 'editMilestone', 'newFixFor', 'newMilestone',
+    'addFixForDependency', 'addMilestoneDependency', 'deleteFixForDependency',
+    'deleteMilestoneDependency', 'subscribe', 'unsubscribe')
+
+class AsyncFogBugzORM(object):
+    """AsyncFogBugzORM Class Interface Documentation
+    
+    Non-blocking variant of :py:class:`fborm.FogBugzORM` . The constructor
+    takes the same arguments, plus the **workers** and **max_inflight**
+    arguments of :py:class:`fborm.pool.SessionPool` . Every API command
+    method returns immediately with a ``multiprocessing.pool.AsyncResult``
+    while the request and the typemap conversion run on the pool. The
+    keyword argument **callback**, if supplied, is called with the result
+    on success, and **errback** with the exception on failure; ``get()``
+    raises the exception either way.
+    
+    .. code:: python
+    
+        afbo = fborm.AsyncFogBugzORM('https://hostname/', token, workers=16)
+        pending = [afbo.viewPerson(ixPerson=ix) for ix in ixPersons]
+        people = [res.get() for res in pending]
+    
+    Python 2 has no ``asyncio``, so this is built on threads. An event loop
+    can still wait on the results without blocking, for example by passing
+    a **callback** which hands the result back to the loop.
+    """
+    
+    def __init__(self, hostname, token=None, username=None, password=None,
+                 namemap={}, workers=8, max_inflight=None, **kwdargs):
+        self.fbo = hostname
+        if not isinstance(hostname, FogBugzORM):
+            self.fbo = FogBugzORM(hostname, token=token, username=username,
+                                  password=password, namemap=namemap,
+                                  **kwdargs)
+        self.pool = SessionPool(self.fbo, workers, max_inflight)
+    
+    @classmethod
+    def from_orm(cls, fbo, workers=8, max_inflight=None):
+        """Create an instance sharing the session of the already
+        constructed :py:class:`fborm.FogBugzORM` **fbo** .
+        """
+        return cls(fbo, workers=workers, max_inflight=max_inflight)
+    
+    @property
+    def token(self):
+        return self.fbo.token
+    
+    def logon(self, *args, **kwdargs):
+        """Blocking, see :py:meth:`fborm.FogBugzORM.logon` .
+        """
+        return self.fbo.logon(*args, **kwdargs)
+    
+    def logoff(self):
+        """Blocking, see :py:meth:`fborm.FogBugzORM.logoff` . Call this
+        only once all outstanding results have completed.
+        """
+        return self.fbo.logoff()
+    
+    def close(self):
+        """Wait for the outstanding commands and stop the worker threads.
+        """
+        self.pool.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args, **kwdargs):
+        self.close()
+    
+    def _submit(self, name, args, kwdargs):
+        callback = kwdargs.pop('callback', None)
+        errback = kwdargs.pop('errback', None)
+        def call(fbo, *args, **kwdargs):
+            try:
+                return getattr(fbo, name)(*args, **kwdargs)
+            except Exception, e:
+                if errback is not None:
+                    errback(e)
+                raise
+        return self.pool.apply_async(call, args, kwdargs, callback=callback)
+
+def _async_command(name):
+    def command(self, *args, **kwdargs):
+        return self._submit(name, args, kwdargs)
+    command.__name__ = name
+    command.__doc__ = (
+        "Asynchronous :py:meth:`fborm.FogBugzORM.%s` , returning a "
+        "``multiprocessing.pool.AsyncResult`` ." % name)
+    return command
+
+for _name in _async_commands:
+    setattr(AsyncFogBugzORM, _name, _async_command(_name))
+del _name
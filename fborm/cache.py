@@ -0,0 +1,196 @@
+""".. _cache:
+
+==========================================
+Reference Data Caching
+==========================================
+
+People, projects, areas, statuses, priorities, categories, milestones and
+tags change rarely, but scripts which map ``ix`` values to names look them
+up constantly. :py:class:`fborm.FogBugzORM` can keep the results of the
+``list*`` commands in a :py:class:`fborm.cache.TTLCache` so that repeated
+calls with the same arguments are answered locally.
+
+The cache is opt-in:
+
+.. code:: python
+
+    fbo = fborm.FogBugzORM('https://hostname/', token,
+                           cache=fborm.TTLCache(ttl=600,
+                                                ttls=dict(listPeople=60)))
+    people = fbo.listPeople()        # goes to the server
+    people = fbo.listPeople()        # answered from the cache
+    print fbo.cache.stats().hits
+
+Entries expire after the time to live of their entity, the least recently
+used entries are evicted once **maxsize** is reached, and the write
+commands of :py:class:`fborm.FogBugzORM` invalidate the entities they
+change (see :py:data:`fborm.cache.invalidated_by`). Cached results are
+shared between callers, so treat them as read-only.
+
+.. _fborm.cache:
+
+fborm.cache Module Documentation
+====================================
+"""
+import collections
+import threading
+import time
+import jsontree
+
+cached_commands = ('listPeople', 'listProjects', 'listAreas', 'listStatuses',
+                   'listPriorities', 'listCategories', 'listFixFors',
+                   'listTags')
+"""The entities :py:class:`fborm.FogBugzORM` caches, named after the
+:py:mod:`fborm.commands` call producing them.
+"""
+
+invalidated_by = dict(
+    new             = ('listTags',),
+    edit            = ('listTags',),
+    resolve         = ('listTags',),
+    close           = ('listTags',),
+    reopen          = ('listTags',),
+    reactivate      = ('listTags',),
+    bulk_edit       = ('listTags',),
+    newFixFor       = ('listFixFors',),
+    editFixFor      = ('listFixFors',),
+    addFixForDependency     = ('listFixFors',),
+    deleteFixForDependency  = ('listFixFors',))
+"""Which cached entities each :py:class:`fborm.FogBugzORM` write command
+invalidates. Case edits only change tag use counts; the reference data
+itself is edited through the FogBugz UI, which is what the time to live
+is for.
+"""
+
+_missing = object()
+
+def _freeze(value):
+    ## equal arguments give equal keys: lists and tuples become tuples,
+    ## sets frozensets and dicts, such as typemaps, their sorted items,
+    ## with the converters in them keyed on identity.
+    if isinstance(value, dict):
+        ## a projection extracts its items as its own tree_class
+        return ('{', type(value), getattr(value, 'tree_class', None),
+                tuple(sorted((name, _freeze(item))
+                             for name, item in value.iteritems())))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(_freeze(item) for item in value)
+    try:
+        hash(value)
+    except TypeError:
+        return ('@', id(value))
+    return value
+
+def make_key(entity, args=(), kwdargs={}):
+    """Return the cache key for a call to **entity** with the given
+    arguments.
+    """
+    return (entity,
+            tuple(_freeze(arg) for arg in args),
+            tuple(sorted((name, _freeze(value))
+                         for name, value in kwdargs.iteritems())))
+
+class TTLCache(object):
+    """TTLCache(ttl=300, maxsize=256, ttls=None)
+
+    Thread-safe, size-bounded LRU cache where every entry expires **ttl**
+    seconds after it was stored. **ttls** maps entity names to their own
+    time to live, overriding **ttl** for that entity.
+    """
+    def __init__(self, ttl=300, maxsize=256, ttls=None):
+        if maxsize < 1:
+            raise ValueError("'maxsize' must be at least 1")
+        self.ttl = ttl
+        self.ttls = dict(ttls or {})
+        self.maxsize = maxsize
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Zero all the counters reported by :py:meth:`stats` .
+        """
+        self._hits = collections.defaultdict(int)
+        self._misses = collections.defaultdict(int)
+        self._evictions = 0
+        self._expirations = 0
+        self._invalidations = 0
+
+    def get(self, key, default=None):
+        """Return the live value stored for **key**, or **default** .
+        """
+        entity = key[0]
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is not None:
+                expires, value = entry
+                if expires > time.time():
+                    self._data[key] = entry
+                    self._hits[entity] += 1
+                    return value
+                self._expirations += 1
+            self._misses[entity] += 1
+            return default
+
+    def set(self, key, value):
+        """Store **value** for **key**, evicting the least recently used
+        entries if the cache is full.
+        """
+        expires = time.time() + self.ttls.get(key[0], self.ttl)
+        with self._lock:
+            self._data.pop(key, None)
+            while len(self._data) >= self.maxsize:
+                self._data.popitem(last=False)
+                self._evictions += 1
+            self._data[key] = (expires, value)
+
+    def fetch(self, entity, args, kwdargs, load):
+        """Return the cached value for the call, or call **load()** and
+        cache what it returns.
+        """
+        key = make_key(entity, args, kwdargs)
+        value = self.get(key, _missing)
+        if value is _missing:
+            value = load()
+            self.set(key, value)
+        return value
+
+    def invalidate(self, *entities):
+        """Drop every entry for the named entities, or everything if no
+        entity is named.
+        """
+        with self._lock:
+            if not entities:
+                self._invalidations += len(self._data)
+                self._data.clear()
+                return
+            for key in [key for key in self._data if key[0] in entities]:
+                del self._data[key]
+                self._invalidations += 1
+
+    clear = invalidate
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """Return a ``jsontree`` with the ``hits``, ``misses``,
+        ``evictions``, ``expirations``, ``invalidations`` and current
+        ``size`` of the cache, and the hits and misses per entity under
+        ``entities``.
+        """
+        with self._lock:
+            res = jsontree.jsontree(
+                hits=sum(self._hits.itervalues()),
+                misses=sum(self._misses.itervalues()),
+                evictions=self._evictions,
+                expirations=self._expirations,
+                invalidations=self._invalidations,
+                size=len(self._data),
+                entities=jsontree.jsontree())
+            for entity in set(self._hits) | set(self._misses):
+                res.entities[entity] = jsontree.jsontree(
+                    hits=self._hits[entity], misses=self._misses[entity])
+            return res
@@ -0,0 +1,198 @@
+""".. _coalesce:
+
+==========================================
+Request Coalescing
+==========================================
+
+A busy multi-threaded application often asks for the same thing from
+several threads at once: every page of a dashboard looking up the same
+person, or the same project. Each of those calls would go to the server.
+
+:py:class:`fborm.coalesce.SingleFlight` lets identical calls share one
+request. The first caller runs it while the others wait, and all of them
+get its result, or its exception. Once the call has finished the next
+identical call runs again, so unlike :py:mod:`fborm.cache` nothing is
+kept; the two work well together.
+
+:py:class:`fborm.coalesce.MicroBatcher` goes one step further for the
+``view*`` commands. Lookups by ``ix`` arriving within **window** seconds of
+each other are collected, and if at least **threshold** different ones
+arrived, a single ``list*`` command answers all of them. Anything the list
+does not hold is still looked up on its own.
+
+.. code:: python
+
+    fbo = fborm.FogBugzORM('https://hostname/', token,
+                           coalesce=True, batch=fborm.MicroBatcher(
+                               window=0.01, threshold=3))
+    ## called from many threads at once
+    person = fbo.viewPerson(ixPerson=ixPerson)
+    print fbo.coalesce.stats(), fbo.batch.stats()
+
+:py:class:`fborm.FogBugzORM` coalesces ``search`` and the ``list*`` and
+``view*`` commands. The shared results are the same objects for every
+caller, so treat them as read-only, just as with the cache.
+
+.. _fborm.coalesce:
+
+fborm.coalesce Module Documentation
+===================================
+"""
+import sys
+import threading
+import time
+import jsontree
+
+batched_views = dict(
+    people      = ('ixPerson', 'listPeople', 'persontype',
+                   dict(fIncludeDeleted=1, fIncludeVirtual=1,
+                        fIncludeNormal=1, fIncludeActive=1,
+                        fIncludeCommunity=1)),
+    projects    = ('ixProject', 'listProjects', 'projecttype',
+                   dict(fIncludeDeleted=1)),
+    areas       = ('ixArea', 'listAreas', 'areatype', {}),
+    statuses    = ('ixStatus', 'listStatuses', 'statustype', {}))
+"""How :py:class:`fborm.FogBugzORM` batches the ``view*`` lookups of each
+entity: the key argument, the :py:mod:`fborm.commands` list command
+answering them, its typemap argument, and the arguments making it list as
+much as it can.
+"""
+
+class _Call(object):
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight(object):
+    """SingleFlight()
+
+    Thread-safe coalescing of identical concurrent calls, see
+    :py:meth:`do` .
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        self._runs = 0
+        self._shared = 0
+
+    def do(self, key, func):
+        """Return ``func()``, unless a call with the same **key** is already
+        running, in which case wait for it and return its result, or raise
+        its exception.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._runs += 1
+            else:
+                self._shared += 1
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error[0], call.error[1], call.error[2]
+            return call.result
+        try:
+            call.result = func()
+        except:
+            call.error = sys.exc_info()
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+    def stats(self):
+        """Return a ``jsontree`` with the number of calls which went to the
+        server as ``runs``, the number answered by sharing a running call as
+        ``shared``, and the calls running now as ``inflight`` .
+        """
+        with self._lock:
+            return jsontree.jsontree(runs=self._runs, shared=self._shared,
+                                     inflight=len(self._calls))
+
+class _Batch(object):
+    __slots__ = ('keys', 'event', 'results')
+
+    def __init__(self):
+        self.keys = set()
+        self.event = threading.Event()
+        self.results = {}
+
+class MicroBatcher(object):
+    """MicroBatcher(window=0.005, threshold=4)
+
+    Merges lookups made within **window** seconds of the first one into one
+    listing when at least **threshold** different keys were asked for, see
+    :py:meth:`get` .
+    """
+    def __init__(self, window=0.005, threshold=4):
+        if threshold < 1:
+            raise ValueError("'threshold' must be at least 1")
+        self.window = window
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._open = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        self._lookups = 0
+        self._batches = 0
+        self._batched = 0
+        self._failed = 0
+
+    def get(self, group, key, load_all, load_one):
+        """Return the item **key** of **group** . The first caller of a
+        group waits **window** seconds for others to join, then calls
+        ``load_all()``, which returns a dictionary of items by key, if
+        enough keys were asked for. Every caller whose key is not in that
+        dictionary gets ``load_one()`` instead.
+        """
+        with self._lock:
+            self._lookups += 1
+            batch = self._open.get(group)
+            leader = batch is None
+            if leader:
+                batch = self._open[group] = _Batch()
+            batch.keys.add(key)
+        if leader:
+            time.sleep(self.window)
+            with self._lock:
+                del self._open[group]
+            try:
+                if len(batch.keys) >= self.threshold:
+                    batch.results = load_all()
+                    with self._lock:
+                        self._batches += 1
+            except Exception:
+                ## the lookups still work one at a time
+                with self._lock:
+                    self._failed += 1
+            finally:
+                batch.event.set()
+        else:
+            batch.event.wait()
+        if key in batch.results:
+            with self._lock:
+                self._batched += 1
+            return batch.results[key]
+        return load_one()
+
+    def stats(self):
+        """Return a ``jsontree`` with the number of ``lookups``, the
+        ``batches`` loaded, the lookups answered from a batch as
+        ``batched``, and the batches which ``failed`` to load.
+        """
+        with self._lock:
+            return jsontree.jsontree(lookups=self._lookups,
+                                     batches=self._batches,
+                                     batched=self._batched,
+                                     failed=self._failed)
@@ -0,0 +1,314 @@
+""".. _columnar:
+
+==========================================
+Columnar Search Results
+==========================================
+
+Reports which only aggregate over a few columns of many cases do not need
+an object per case. A :py:class:`fborm.columnar.ColumnTable` holds the
+extracted data one column at a time instead:
+
+* :py:func:`fborm.types.fbint` and :py:func:`fborm.types.fbbool` columns
+  are ``array.array`` objects of machine integers,
+* :py:func:`fborm.types.fbfloat` and :py:func:`fborm.types.fbdatetime`
+  columns are arrays of doubles, the dates as seconds since the epoch (UTC)
+  with ``NaN`` for an empty date,
+* :py:func:`fborm.types.fbstring` columns are lists of interned strings,
+  so repeated values such as ``sStatus`` are stored once,
+* anything else is a plain list of the converted values.
+
+The rows are converted straight from the XML, so no per-case dictionary is
+ever built.
+
+.. code:: python
+
+    table = fbo.search(q='status:active', casetype=dict(
+                           ixPriority=fborm.fbint,
+                           ixPersonAssignedTo=fborm.fbint,
+                           dtOpened=fborm.fbdatetime),
+                       result='columnar')
+    print table.count_by('ixPersonAssignedTo')
+    urgent = table.filter(ixPriority=lambda ix: ix <= 2)
+    print len(urgent), min(urgent['dtOpened'])
+
+If `NumPy`_ is installed :py:meth:`ColumnTable.numpy` returns a column as a
+NumPy array sharing the memory of the ``array.array``, and equality filters
+on array columns are done with NumPy. It is not needed otherwise.
+
+.. _NumPy: http://www.numpy.org/
+
+.. _fborm.columnar:
+
+fborm.columnar Module Documentation
+====================================
+"""
+import array
+import collections
+import datetime
+import functools
+from . import parse
+from . import types
+
+_epoch = datetime.datetime(1970, 1, 1)
+_nan = float('nan')
+
+def _dt2epoch(value):
+    if not value:
+        return _nan
+    if value.tzinfo is not None:
+        value = value.replace(tzinfo=None) - value.utcoffset()
+    return (value - _epoch).total_seconds()
+
+def epoch2dt(value):
+    """Turn a value of a date column back into a ``datetime``, or ``''``
+    for an empty date, which is what :py:func:`fborm.types.fbdatetime`
+    returns.
+    """
+    if value != value:
+        return ''
+    return _epoch + datetime.timedelta(seconds=value)
+
+def _base(conv):
+    ## fbcol and friends wrap the converter in argumentless partials
+    while (isinstance(conv, functools.partial) and not conv.args and
+           not conv.keywords):
+        conv = conv.func
+    return conv
+
+def _column(conv):
+    """Return ``(storage, convert)`` for a converter: the empty column and
+    how to turn a converted value into what is stored.
+    """
+    base = _base(conv)
+    if base is types.fbint:
+        return array.array('l'), None
+    if base is types.fbbool:
+        return array.array('b'), None
+    if base is types.fbfloat:
+        return array.array('d'), None
+    if base is types.fbdatetime:
+        return array.array('d'), _dt2epoch
+    if base is types.fbstring:
+        return [], intern
+    return [], None
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+class ColumnTable(object):
+    """ColumnTable(columns, names=None, dates=())
+
+    Table of equally long **columns**, a dictionary of name to column, in
+    the order given by **names** . **dates** names the columns holding
+    dates as epoch seconds, see :py:meth:`row` . Tables are normally made
+    with :py:meth:`extract` or by ``search(..., result='columnar')``.
+    """
+    def __init__(self, columns, names=None, dates=()):
+        self.names = list(names or sorted(columns))
+        self.columns = dict(columns)
+        self.dates = frozenset(dates)
+        lengths = set(len(column) for column in self.columns.itervalues())
+        if len(lengths) > 1:
+            raise ValueError("All columns must be the same length")
+        self._length = lengths.pop() if lengths else 0
+
+    @classmethod
+    def extract(cls, itemiter, fbtypemap, namemap={}):
+        """Convert the XML items in **itemiter** straight into columns,
+        using the converters of **fbtypemap** .
+        """
+        plan = parse.compile_typemap(fbtypemap, namemap)
+        names = []
+        columns = {}
+        appends = []
+        dates = []
+        for step in plan.steps + plan.late:
+            name, conv = step[1], step[2]
+            column, convert = _column(conv)
+            names.append(name)
+            columns[name] = column
+            if convert is _dt2epoch:
+                dates.append(name)
+            appends.append((step, column.append, convert))
+        if itemiter is not None:
+            for item in itemiter:
+                if item != u'\n':
+                    cls._extract_row(plan, item, appends)
+        return cls(columns, names, dates)
+
+    @staticmethod
+    def _extract_row(plan, fbdata, appends):
+        children = parse._childmap(fbdata)
+        row = {} if plan.late else None
+        for (kind, name, conv, tag, lowertag, sub), append, convert in appends:
+            if kind == parse._ATTRIB:
+                value = conv(fbdata, tag)
+            else:
+                inner_data = parse._find(fbdata, children, tag, lowertag)
+                if kind == parse._DATA:
+                    value = conv(inner_data, row)
+                elif inner_data is None:
+                    raise RuntimeError('Could not find attribute: ' +
+                                       repr(tag))
+                elif kind == parse._PLAIN:
+                    value = conv(inner_data)
+                elif kind == parse._NESTED:
+                    plan_, first = sub
+                    if first:
+                        value = plan_.extract_first(inner_data)
+                    else:
+                        value = plan_.extract_all(inner_data)
+                else:
+                    value = conv(inner_data, plan.namemap)
+            if row is not None:
+                row[name] = value
+            if convert is not None:
+                value = convert(value)
+            append(value)
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def row(self, index):
+        """Return row **index** as a ``jsontree``, with the dates turned
+        back into ``datetime`` objects and the flags into ``bool`` .
+        """
+        import jsontree
+        res = jsontree.jsontree()
+        for name in self.names:
+            column = self.columns[name]
+            value = column[index]
+            if name in self.dates:
+                value = epoch2dt(value)
+            elif getattr(column, 'typecode', None) == 'b':
+                value = bool(value)
+            res[name] = value
+        return res
+
+    def rows(self):
+        """Iterate over all rows, see :py:meth:`row` .
+        """
+        for index in xrange(self._length):
+            yield self.row(index)
+
+    def numpy(self, name):
+        """Return column **name** as a NumPy array. Array columns share
+        their memory with the table, list columns are copied into an object
+        array.
+        """
+        import numpy
+        column = self.columns[name]
+        if isinstance(column, array.array):
+            return numpy.frombuffer(column, dtype=column.typecode)
+        return numpy.array(column, dtype=object)
+
+    def _matches(self, name, condition):
+        ## indexes of the rows where the column matches the condition, a
+        ## callable or a value to compare with
+        column = self.columns[name]
+        if callable(condition):
+            return [index for index, value in enumerate(column)
+                    if condition(value)]
+        if isinstance(column, array.array) and len(column):
+            numpy = _numpy()
+            if numpy is not None:
+                return numpy.flatnonzero(
+                    self.numpy(name) == condition).tolist()
+        return [index for index, value in enumerate(column)
+                if value == condition]
+
+    def select(self, **conditions):
+        """Return the indexes of the rows matching all **conditions**, each
+        being a value the column must equal or a callable taking the column
+        value and returning ``True`` for the rows to keep.
+        """
+        if not conditions:
+            return range(self._length)
+        selected = None
+        for name, condition in conditions.iteritems():
+            if selected is None:
+                selected = self._matches(name, condition)
+                continue
+            column = self.columns[name]
+            if callable(condition):
+                selected = [index for index in selected
+                            if condition(column[index])]
+            else:
+                selected = [index for index in selected
+                            if column[index] == condition]
+        return selected
+
+    def sort(self, *names):
+        """Return a new table with the rows sorted on the **names** columns.
+        """
+        keys = self._keys(names)
+        return self.take(sorted(xrange(self._length),
+                                key=keys.__getitem__))
+
+    def take(self, indexes):
+        """Return a new table holding only the rows at **indexes** .
+        """
+        columns = {}
+        for name, column in self.columns.iteritems():
+            if isinstance(column, array.array):
+                columns[name] = array.array(column.typecode,
+                                            (column[i] for i in indexes))
+            else:
+                columns[name] = [column[i] for i in indexes]
+        return ColumnTable(columns, self.names, self.dates)
+
+    def filter(self, **conditions):
+        """Return a new table with the rows matching all **conditions**,
+        see :py:meth:`select` . The date columns hold epoch seconds, so
+        compare them with epoch seconds, not a ``datetime`` .
+
+        .. code:: python
+
+            cutoff = calendar.timegm(opened_since.utctimetuple())
+            table.filter(ixProject=3, dtOpened=lambda dt: dt >= cutoff)
+        """
+        return self.take(self.select(**conditions))
+
+    def count(self, **conditions):
+        """Return the number of rows matching all **conditions** .
+        """
+        if not conditions:
+            return self._length
+        return len(self.select(**conditions))
+
+    def _keys(self, names):
+        if len(names) == 1:
+            return self.columns[names[0]]
+        return zip(*[self.columns[name] for name in names])
+
+    def group_by(self, *names):
+        """Return a dictionary of the distinct values of the **names**
+        columns, a tuple when grouping by several columns, to the list of
+        indexes of the rows holding them. Pass the indexes to
+        :py:meth:`take` to get the rows as a table.
+        """
+        groups = collections.defaultdict(list)
+        for index, key in enumerate(self._keys(names)):
+            groups[key].append(index)
+        return dict(groups)
+
+    def count_by(self, *names):
+        """Return a ``collections.Counter`` of the distinct values of the
+        **names** columns.
+
+        .. code:: python
+
+            per_person = table.count_by('ixPersonAssignedTo')
+            per_project_priority = table.count_by('ixProject', 'ixPriority')
+        """
+        return collections.Counter(self._keys(names))
@@ -16,9 +16,15 @@ from . import objects
 from . import parse
 from . import util
 from . import types
+from . import pool
+from . import columnar
+from . import projection
 import jsontree
+import collections
 import datetime
 import re
+import sys
+import threading
     
 def listFilters(fb, sort_by=None):
     """
@@ -44,18 +50,220 @@ def setCurrentFilter(fb, filter):
 
 def search(fb, casetype=objects.fbBug,
            q=None,
-           namemap={}, sort_by=None, **args):
+           namemap={}, sort_by=None, result=None, fields=None,
+           processes=None, **args):
     """search(fb, casetype=fborm.objects.fbBug, q=None, \
-              namemap={}, sort_by=None, **args)
-    """
+              namemap={}, sort_by=None, result=None, fields=None, \
+              processes=None, **args)
+
+    **result** selects what is returned: by default a list of ``jsontree``
+    objects, with ``'records'`` a list of :py:mod:`fborm.records` objects,
+    with ``'lazy'`` a list of :py:class:`fborm.records.LazyRecord` objects,
+    and with ``'columnar'`` a :py:class:`fborm.columnar.ColumnTable` .
+    
+    **fields** limits the search to those fields of **casetype**, see
+    :py:func:`fborm.projection.project` .
+    
+    **processes** converts the cases in that many worker processes, or in
+    the given ``multiprocessing.Pool``, see :py:mod:`fborm.parallel` .
+    """
+    if result not in _search_results:
+        raise ValueError("'result' must be one of: " +
+                         ', '.join(repr(name) for name in
+                                   sorted(_search_results)))
+    if fields is not None:
+        casetype = projection.project(casetype, fields)
     if 'cols' not in args:
         args['cols'] = parse.keys2cols(casetype, namemap)
     if q is not None:
         args['q'] = q
+    if processes is not None:
+        return _search_parallel(fb, casetype, namemap, sort_by, result,
+                                processes, args)
     res = fb.search(**args)
-    cases = parse.extract_all(res.cases, casetype, namemap, sort_by)
+    if result == 'columnar':
+        table = columnar.ColumnTable.extract(res.cases, casetype, namemap)
+        if sort_by:
+            if not isinstance(sort_by, (list, tuple)):
+                sort_by = [sort_by]
+            table = table.sort(*sort_by)
+        return table
+    cases = parse.extract_all(res.cases, casetype, namemap, sort_by,
+                              record=_search_results[result])
     return cases
 
+_search_results = {None: False, 'records': True, 'lazy': 'lazy',
+                   'columnar': None}
+
+def _search_parallel(fb, casetype, namemap, sort_by, result, processes,
+                     args):
+    from . import parallel
+    from . import stream
+    if result not in (None, 'records'):
+        raise ValueError("'processes' can only be used with 'result' None "
+                         "or 'records'")
+    ## before sending the search, not after
+    parse.typemap_ref(casetype)
+    xml = stream.raw_request(fb, 'search', **args)
+    try:
+        return parallel.extract_parallel(xml, 'case', casetype, namemap,
+                                         sort_by, _search_results[result],
+                                         processes)
+    finally:
+        xml.close()
+
+class _Prefetch(threading.Thread):
+    ## Run a single call in the background and hand back its result, or
+    ## re-raise its exception, when asked for it.
+    def __init__(self, func, *args, **kwdargs):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.func = func
+        self.args = args
+        self.kwdargs = kwdargs
+        self.result = None
+        self.error = None
+        self.start()
+
+    def run(self):
+        try:
+            self.result = self.func(*self.args, **self.kwdargs)
+        except:
+            self.error = sys.exc_info()
+
+    def get(self):
+        self.join()
+        if self.error:
+            raise self.error[0], self.error[1], self.error[2]
+        return self.result
+
+def search_iter(fb, casetype=objects.fbBug,
+                q=None,
+                namemap={}, page_size=250, **args):
+    """search_iter(fb, casetype=fborm.objects.fbBug, q=None, \
+                   namemap={}, page_size=250, **args)
+
+    Generator version of :py:func:`fborm.commands.search` for queries
+    returning more cases than can be fetched in one request.
+    
+    The query is first run asking only for the ``ixBug`` column, which is
+    cheap for the server to produce. The matching case numbers are then
+    split into ascending ranges of **page_size** cases, and each range is
+    fetched with the full **casetype** columns, or its **fields**, as a
+    search on that list of case numbers. While the caller works through
+    one page, the next one is already being fetched in a background
+    thread. A ``max`` argument limits the total number of cases, not the
+    page size.
+    
+    .. code:: python
+    
+        for case in fborm.search_iter(fb, fborm.objects.fbBug_withEvents,
+                                      q='project:"Big One"'):
+            export(case)
+    """
+    if page_size < 1:
+        raise ValueError("'page_size' must be at least 1")
+    idargs = dict(args)
+    idargs.pop('cols', None)
+    idargs.pop('fields', None)
+    args.pop('max', None)
+    ixBugs = sorted(case.ixBug for case in
+                    search(fb, objects.fbBug_ixBug, q=q, **idargs))
+    pages = [ixBugs[i:i + page_size]
+             for i in xrange(0, len(ixBugs), page_size)]
+    if not pages:
+        return
+    def fetch(page):
+        return search(fb, casetype, q=','.join(str(ix) for ix in page),
+                      namemap=namemap, **args)
+    pending = _Prefetch(fetch, pages[0])
+    for page in pages[1:]:
+        cases = pending.get()
+        pending = _Prefetch(fetch, page)
+        for case in cases:
+            yield case
+    for case in pending.get():
+        yield case
+
+def search_many(fb, queries, namemap={}, workers=4, max_inflight=None,
+                dedup=True):
+    """search_many(fb, queries, namemap={}, workers=4, max_inflight=None, \
+                   dedup=True)
+
+    Run many independent :py:func:`fborm.commands.search` calls at once
+    over a :py:class:`fborm.pool.SessionPool` of **workers** sessions
+    sharing the token of **fb**, sending no more than **max_inflight**
+    requests at once. Each query is a ``q`` string, or a ``(q, casetype)``
+    or ``(q, casetype, kwdargs)`` tuple, **kwdargs** being any other
+    arguments of :py:func:`fborm.commands.search` . The results are
+    converted in the workers too.
+
+    Returns an ``OrderedDict`` keyed by ``q``, or by the keys of
+    **queries** if it is a dictionary, with a ``jsontree`` for each query
+    holding ``result`` (what the search returned) and ``error`` (the
+    exception raised, or ``None``). A list of queries sharing a ``q``, for
+    instance with different casetypes, raises ``ValueError``; give those a
+    key each by passing a dictionary.
+
+    With **dedup** a case returned by several queries with the same
+    casetype, namemap and ``result`` mode is the same object in all of
+    their results, the one from the first query in order, which saves the
+    memory of the copies. Treat such results as read-only.
+
+    .. code:: python
+
+        res = fborm.search_many(fb, dict(
+            (project, 'project:"%s" status:open' % project)
+            for project in projects), workers=8)
+        for project, found in res.iteritems():
+            print project, len(found.result or ())
+    """
+    if hasattr(queries, 'iteritems'):
+        queries = queries.items()
+    else:
+        queries = [(query if isinstance(query, basestring) else query[0],
+                    query) for query in queries]
+        seen = set()
+        for key, query in queries:
+            if key in seen:
+                raise ValueError('more than one query for %r, pass a '
+                                 'dictionary to key them apart' % (key,))
+            seen.add(key)
+    def call(session, query):
+        if isinstance(query, basestring):
+            query = (query,)
+        q, casetype, kwdargs = (tuple(query) + (objects.fbBug, {}))[:3]
+        kwdargs = dict(kwdargs)
+        kwdargs.setdefault('namemap', namemap)
+        return search(session, casetype, q=q, **kwdargs)
+    with pool.SessionPool(fb, workers, max_inflight) as sessions:
+        results = sessions.map(call, [query for key, query in queries])
+    res = collections.OrderedDict()
+    shared = {}
+    for (key, query), (result, error) in zip(queries, results):
+        if dedup and isinstance(result, list):
+            result = _dedup(result, query, namemap, shared)
+        res[key] = jsontree.jsontree(result=result, error=error)
+    return res
+
+def _dedup(cases, query, namemap, shared):
+    ## cases are only shared between queries extracting the same fields in
+    ## the same form, which is decided by the arguments of the search
+    if isinstance(query, basestring):
+        query = (query,)
+    casetype, kwdargs = (tuple(query[1:]) + (objects.fbBug, {}))[:2]
+    kind = (id(casetype), id(kwdargs.get('namemap', namemap)),
+            kwdargs.get('result'), tuple(kwdargs.get('fields') or ()))
+    seen = shared.setdefault(kind, {})
+    res = []
+    for case in cases:
+        ixBug = case.get('ixBug')
+        if ixBug is None:
+            res.append(case)
+        else:
+            res.append(seen.setdefault(ixBug, case))
+    return res
+
 
 def new(fb, bug, bugtype, namemap={}, **args):
     if 'cols' in args:
@@ -107,6 +315,43 @@ def reopen(fb, bug, bugtype, namemap={}, **args):
 
 def reactivate(fb, bug, bugtype, namemap={}, **args):
     return _edit(fb.reactivate, fb, bug, bugtype, namemap, args)
+
+_bulk_ops = ('edit', 'resolve', 'close', 'reopen', 'reactivate')
+
+def bulk_edit(fb, bugs, bugtype, op='edit', namemap={},
+              workers=4, max_inflight=None, **args):
+    """bulk_edit(fb, bugs, bugtype, op='edit', namemap={}, \
+                 workers=4, max_inflight=None, **args)
+    
+    Run :py:func:`fborm.commands.edit` , or the ``resolve``, ``close``,
+    ``reopen`` or ``reactivate`` command named by **op**, for every case in
+    **bugs** over a :py:class:`fborm.pool.SessionPool` of **workers**
+    sessions sharing the token of **fb**. No more than **max_inflight**
+    requests are sent at once. Any extra keyword arguments are applied to
+    every case, just like with :py:func:`fborm.commands.edit` .
+    
+    Returns a list in the same order as **bugs**, with a ``jsontree`` for
+    each case holding ``ixBug``, ``result`` (what the single case command
+    returned) and ``error`` (the exception raised, or ``None``).
+    
+    .. code:: python
+    
+        results = fborm.bulk_edit(fb, [dict(ixBug=ix) for ix in ixBugs],
+                                  fborm.objects.fbBug, op='close',
+                                  workers=8)
+        failed = [res for res in results if res.error]
+    """
+    if op not in _bulk_ops:
+        raise ValueError("'op' must be one of: " + ', '.join(_bulk_ops))
+    bugs = list(bugs)
+    def call(session, bug):
+        return _edit(getattr(session, op), session, bug, bugtype,
+                     namemap, dict(args))
+    with pool.SessionPool(fb, workers, max_inflight) as sessions:
+        results = sessions.map(call, bugs)
+    return [jsontree.jsontree(ixBug=(bug or {}).get('ixBug', args.get('ixBug')),
+                              result=result, error=error)
+            for bug, (result, error) in zip(bugs, results)]
     
 def listTags(fb, tagtype=objects.fbTag, sort_by=None):
     """listTags(fb, tagtype=fborm.objects.fbTag, sort_by=None)
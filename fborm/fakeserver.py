@@ -0,0 +1,840 @@
+""".. _fakeserver:
+
+==========================================
+Local FogBugz API Stand-in Server
+==========================================
+
+Tuning a client against production is rude, and against a test install
+slow to set up. A :py:class:`fborm.fakeserver.FakeServer` is a small
+FogBugz XML API served over HTTP on localhost, backed by an in-memory
+:py:class:`fborm.fakeserver.FakeStore` filled with generated people,
+projects, areas, milestones and cases with event histories.
+
+It answers ``logon``, ``logoff``, ``search``, ``new``, ``edit``,
+``assign``, ``resolve``, ``close``, ``reopen``, ``reactivate``, the
+``list*`` and ``view*`` reference data calls, the milestone calls and
+``subscribe``, enough for everything in :py:mod:`fborm.commands` to run
+end to end. Latency, failures and response size can be dialled in to see
+how the concurrency, paging and caching features behave.
+
+.. code:: python
+
+    with fborm.FakeServer(cases=5000, latency=0.05, error_rate=0.01) as server:
+        fbo = fborm.FogBugzORM(server.url, token=server.token,
+                               transport=True)
+        for case in fbo.search_iter(q='status:active'):
+            ...
+        print server.requests
+
+The search syntax understood is a small part of the real one: case
+numbers (``123`` or ``1,2,3``), ``ixBug:``, ``project:``, ``area:``,
+``assignedto:``, ``category:``, ``priority:``, ``tag:``,
+``status:active|resolved|closed|open``, ``edited:`` / ``lastupdated:``
+with ``from..to`` date ranges, and free text matched against the title.
+All the terms must match. Only the columns asked for with ``cols`` are
+returned, as the real server does.
+
+.. _fborm.fakeserver:
+
+fborm.fakeserver Module Documentation
+=====================================
+"""
+import BaseHTTPServer
+import SocketServer
+import cgi
+import collections
+import datetime
+import random
+import re
+import threading
+import time
+import urlparse
+from . import types
+
+_fields_case = ('ixBug', 'ixBugParent', 'ixBugChildren', 'sTitle',
+                'ixProject', 'sProject', 'ixArea', 'sArea', 'ixCategory',
+                'sCategory', 'ixPriority', 'sPriority', 'ixPersonAssignedTo',
+                'sPersonAssignedTo', 'ixPersonOpenedBy', 'ixStatus',
+                'sStatus', 'fOpen', 'ixFixFor', 'sFixFor', 'dtOpened',
+                'dtResolved', 'dtClosed', 'dtLastUpdated', 'ixBugEventLatest',
+                'sLatestTextSummary', 'tags')
+
+_list_items = dict(tags='tag', rgAttachments='attachment', events='event')
+
+_words = ('build', 'crash', 'login', 'report', 'export', 'page', 'slow',
+          'error', 'customer', 'setting', 'upload', 'search', 'email',
+          'timeout', 'layout', 'import', 'install', 'update')
+
+class FakeAPIError(Exception):
+    """Raised by the command handlers, and sent as an ``<error>`` response.
+    """
+    def __init__(self, code, message):
+        Exception.__init__(self, message)
+        self.code = code
+
+def _text(value):
+    ## the response is built as unicode, and encoded once by respond()
+    if isinstance(value, str):
+        return value.decode('utf-8')
+    return unicode(value)
+
+def _xmlvalue(name, value):
+    if value is None:
+        return u''
+    if isinstance(value, bool):
+        return u'true' if value else u'false'
+    if isinstance(value, datetime.datetime):
+        return _text(value.strftime(types.fbisofmt))
+    if isinstance(value, (int, long, float)):
+        return _text(value)
+    if isinstance(value, (list, tuple)):
+        if name not in _list_items:
+            return u','.join(_text(item) for item in value)
+        tag = _list_items[name]
+        return u''.join(_element(tag, item) if isinstance(item, dict) else
+                        u'<%s>%s</%s>' % (tag, _xmlvalue(tag, item), tag)
+                        for item in value)
+    return u'<![CDATA[%s]]>' % _text(value).replace(u']]>',
+                                                     u']]]]><![CDATA[>')
+
+def _element(tag, item, cols=None, attrs=()):
+    """Render the dictionary **item** as the element **tag**, with only the
+    fields in **cols** if given, and the fields in **attrs** as attributes.
+    """
+    names = item.iterkeys() if cols is None else cols
+    return u'<%s%s>%s</%s>' % (
+        tag,
+        u''.join(u' %s="%s"' % (name, _text(item[name])) for name in attrs
+                 if name in item),
+        u''.join(u'<%s>%s</%s>' % (name, _xmlvalue(name, item[name]), name)
+                 for name in names if name in item),
+        tag)
+
+def _parse_time(text):
+    text = text.strip()
+    for fmt in (types.fbisofmt, '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S',
+                '%Y-%m-%d %H:%M', '%Y-%m-%d', '%m/%d/%Y'):
+        try:
+            return datetime.datetime.strptime(text, fmt)
+        except ValueError:
+            pass
+    raise FakeAPIError(10, 'Could not understand the date %r' % text)
+
+_terms_re = re.compile(r'(-?)(?:(\w+):)?("[^"]*"|\S+)')
+
+class FakeStore(object):
+    """FakeStore(cases=100, events=3, people=20, projects=4, seed=0, \
+                 token='fake-token', password='password')
+
+    The data behind a :py:class:`fborm.fakeserver.FakeServer`, generated
+    from **seed**, and the implementation of the API commands. Every person
+    can log on with **password**, and **token** is always a valid token.
+    Everything is plain dictionaries, so tests can look at and change the
+    data directly; take ``store.lock`` when the server is running.
+    """
+    def __init__(self, cases=100, events=3, people=20, projects=4, seed=0,
+                 token='fake-token', password='password'):
+        self.lock = threading.RLock()
+        self.token = token
+        self.password = password
+        self.tokens = set([token])
+        self.rnd = random.Random(seed)
+        self.now = datetime.datetime(2013, 1, 1)
+        self._populate(cases, events, people, projects)
+
+    ## Generated data
+
+    def _tick(self):
+        self.now += datetime.timedelta(seconds=self.rnd.randint(60, 7200))
+        return self.now
+
+    def _populate(self, cases, events, people, projects):
+        rnd = self.rnd
+        self.people = collections.OrderedDict()
+        for ix in xrange(2, people + 2):
+            self.people[ix] = dict(
+                ixPerson=ix, sFullName='Person %d' % ix,
+                sEmail='person%d@example.com' % ix, sPhone='',
+                fAdministrator=ix == 2, fCommunity=False, fVirtual=False,
+                fDeleted=False, fNotify=True, sHomepage='', sLocale='*',
+                sLanguage='*', sTimeZoneKey='*', sLDAPUid='',
+                dtLastActivity=self.now, fRecurseBugChildren=False,
+                fPaletteExpanded=False, ixBugWorkingOn=0, sFrom='')
+        people = list(self.people)
+        self.projects = collections.OrderedDict()
+        self.areas = collections.OrderedDict()
+        self.fixfors = collections.OrderedDict()
+        for ix in xrange(1, projects + 1):
+            owner = self.people[rnd.choice(people)]
+            self.projects[ix] = dict(
+                ixProject=ix, sProject='Project %d' % ix,
+                ixPersonOwner=owner['ixPerson'],
+                sPersonOwner=owner['sFullName'], sEmail=owner['sEmail'],
+                sPhone='', fInbox=ix == 1, ixWorkflow=1, fDeleted=False)
+            for name in ('Code', 'Docs', 'Misc'):
+                ixArea = len(self.areas) + 1
+                self.areas[ixArea] = dict(
+                    ixArea=ixArea, sArea=name, ixProject=ix,
+                    sProject='Project %d' % ix,
+                    ixPersonOwner=owner['ixPerson'],
+                    sPersonOwner=owner['sFullName'], nType=0, cDoc=0)
+            for n in xrange(1, 3):
+                ixFixFor = len(self.fixfors) + 1
+                self.fixfors[ixFixFor] = dict(
+                    ixFixFor=ixFixFor, sFixFor='%d.%d' % (ix, n),
+                    ixProject=ix, sProject='Project %d' % ix,
+                    fDeleted=False, fReallyDeleted=False,
+                    dt=self.now + datetime.timedelta(days=30 * n),
+                    dtStart=self.now, sStartNote='', dependencies=set())
+        self.categories = collections.OrderedDict(
+            (ix, dict(ixCategory=ix, sCategory=name, sPlural=name + 's',
+                      ixStatusDefault=ix, fIsScheduleItem=False,
+                      fDeleted=False, iOrder=ix, nIconType=ix,
+                      ixAttachmentIcon=0, ixStatusDefaultActive=ix))
+            for ix, name in enumerate(('Bug', 'Feature', 'Inquiry'), 1))
+        self.priorities = collections.OrderedDict(
+            (ix, dict(ixPriority=ix, fDefault=ix == 3, sPriority=name))
+            for ix, name in enumerate(('Must Fix', 'Should Fix', 'Normal',
+                                       'Fix If Time', 'Trivial'), 1))
+        self.statuses = collections.OrderedDict()
+        for ixCategory in self.categories:
+            for order, (name, resolved) in enumerate(
+                    (('Active', False), ('Resolved (Fixed)', True),
+                     ("Resolved (Won't Fix)", True))):
+                ix = len(self.statuses) + 1
+                self.statuses[ix] = dict(
+                    ixStatus=ix, sStatus=name, ixCategory=ixCategory,
+                    fWorkDone=resolved and order == 1, fResolved=resolved,
+                    fDuplicate=False, fDeleted=False, iOrder=order)
+        self.filters = [dict(sFilter='ez', type='builtin', name='My Cases'),
+                        dict(sFilter='inbox', type='builtin', name='Inbox')]
+        self.current_filter = 'ez'
+        self.subscriptions = set()
+        self.cases = collections.OrderedDict()
+        self.next_event = 1
+        for n in xrange(cases):
+            case = self._new_case(dict(
+                sTitle=' '.join(rnd.choice(_words) for w in xrange(4)),
+                ixProject=rnd.choice(list(self.projects)),
+                ixPersonAssignedTo=rnd.choice(people),
+                ixPriority=rnd.randint(1, 5),
+                ixCategory=rnd.randint(1, 3),
+                sTags=','.join(rnd.sample(_words[:6], rnd.randint(0, 2))),
+                sEvent='Generated case'), rnd.choice(people))
+            for m in xrange(events - 1):
+                self._add_event(case, 'Edited', rnd.choice(people),
+                                s='Note %d' % m)
+
+    ## Case handling
+
+    def _new_case(self, args, ixPerson):
+        ixBug = len(self.cases) + 1
+        case = dict(ixBug=ixBug, ixBugParent=0, ixBugChildren=[],
+                    fOpen=True, dtOpened=self._tick(), dtResolved=None,
+                    dtClosed=None, ixPersonOpenedBy=ixPerson, tags=[],
+                    ixCategory=1, ixPriority=3, ixFixFor=0,
+                    ixPersonAssignedTo=ixPerson, events=[])
+        project = self.projects.values()[0]
+        case['ixProject'] = project['ixProject']
+        case['ixArea'] = self._areas_of(project['ixProject'])[0]
+        self.cases[ixBug] = case
+        self._apply(case, args)
+        case['ixStatus'] = self._status(case['ixCategory'], 'Active')
+        self._names(case)
+        self._add_event(case, 'Opened', ixPerson, s=args.get('sEvent', ''),
+                        files=args.get('_files'))
+        return case
+
+    def _areas_of(self, ixProject):
+        return [ix for ix, area in self.areas.iteritems()
+                if area['ixProject'] == ixProject] or [0]
+
+    def _status(self, ixCategory, name):
+        for ix, status in self.statuses.iteritems():
+            if (status['ixCategory'] == ixCategory and
+                status['sStatus'].startswith(name)):
+                return ix
+        return 1
+
+    def _apply(self, case, args):
+        for name in ('ixProject', 'ixArea', 'ixCategory', 'ixPriority',
+                     'ixPersonAssignedTo', 'ixFixFor', 'ixBugParent',
+                     'ixStatus'):
+            if args.get(name):
+                case[name] = int(args[name])
+        if 'ixProject' in args and not args.get('ixArea'):
+            case['ixArea'] = self._areas_of(case['ixProject'])[0]
+        for name, value in args.iteritems():
+            if name.startswith('s') and name in _fields_case:
+                case[name] = value
+        if 'sTags' in args:
+            case['tags'] = [tag for tag in re.split(r'[,\s]+', args['sTags'])
+                            if tag]
+        if 'ixBugChildren' in args:
+            case['ixBugChildren'] = [
+                int(ix) for ix in re.split(r'[,\s]+', args['ixBugChildren'])
+                if ix]
+        if args.get('sEvent'):
+            case['sLatestTextSummary'] = args['sEvent'][:100]
+
+    def _names(self, case):
+        ## keep the denormalised names in step with the ix values
+        def name(table, ix, field, default=''):
+            return table[ix][field] if ix in table else default
+        case['sProject'] = name(self.projects, case['ixProject'], 'sProject')
+        case['sArea'] = name(self.areas, case['ixArea'], 'sArea')
+        case['sCategory'] = name(self.categories, case['ixCategory'],
+                                 'sCategory')
+        case['sPriority'] = name(self.priorities, case['ixPriority'],
+                                 'sPriority')
+        case['sPersonAssignedTo'] = name(self.people,
+                                         case['ixPersonAssignedTo'],
+                                         'sFullName', 'CLOSED')
+        case['sStatus'] = name(self.statuses, case['ixStatus'], 'sStatus')
+        case['sFixFor'] = name(self.fixfors, case['ixFixFor'], 'sFixFor',
+                               'Undecided')
+
+    def _add_event(self, case, verb, ixPerson, s='', changes='',
+                   files=None):
+        when = self._tick()
+        event = dict(
+            ixBugEvent=self.next_event, ixBug=case['ixBug'], evt=1,
+            sVerb=verb, ixPerson=ixPerson,
+            sPerson=self.people.get(ixPerson, {}).get('sFullName', ''),
+            ixPersonAssignedTo=case['ixPersonAssignedTo'], dt=when,
+            fHTML=False, sFormat='', sChanges=changes,
+            evtDescription='%s by %s' % (
+                verb, self.people.get(ixPerson, {}).get('sFullName', '')),
+            rgAttachments=[dict(sFilename=name, sURL='default.asp?'
+                                'pg=pgDownload&pgType=pgFile&ixBugEvent=%d'
+                                '&sFileName=%s' % (self.next_event, name))
+                           for name in (files or ())],
+            fEmail=False, fExternal=False, s=s, sHTML='')
+        self.next_event += 1
+        case['events'].append(event)
+        case['ixBugEventLatest'] = event['ixBugEvent']
+        case['dtLastUpdated'] = when
+        return event
+
+    def _case(self, args):
+        try:
+            return self.cases[int(args.get('ixBug', 0))]
+        except (KeyError, ValueError):
+            raise FakeAPIError(3, 'Case %s does not exist' %
+                               args.get('ixBug'))
+
+    def _render_case(self, case, cols):
+        cols = [col for col in re.split(r'[,\s]+', cols or '') if col]
+        view = dict(case)
+        if 'latestEvent' in cols and 'events' not in cols:
+            view['events'] = case['events'][-1:]
+        if 'minievents' in cols or 'latestEvent' in cols:
+            cols = [col for col in cols
+                    if col not in ('minievents', 'latestEvent')]
+            cols.append('events')
+        return _element('case', view, cols, attrs=('ixBug',))
+
+    def _events(self, events):
+        return ''.join(_element('event', event,
+                                attrs=('ixBugEvent', 'ixBug'))
+                       for event in events)
+
+    ## Search
+
+    def _match(self, case, field, value):
+        value = value.strip('"')
+        lower = value.lower()
+        if field in ('ixbug', 'case', 'cases'):
+            return case['ixBug'] in [int(ix) for ix in value.split(',')
+                                     if ix.isdigit()]
+        if field == 'project':
+            return case['sProject'].lower() == lower or \
+                   str(case['ixProject']) == value
+        if field == 'area':
+            return case['sArea'].lower() == lower
+        if field == 'assignedto':
+            person = self.people.get(case['ixPersonAssignedTo'], {})
+            return lower in (person.get('sFullName', '').lower(),
+                             person.get('sEmail', '').lower(),
+                             str(case['ixPersonAssignedTo']))
+        if field == 'category':
+            return case['sCategory'].lower() == lower
+        if field == 'priority':
+            return (str(case['ixPriority']) == value or
+                    case['sPriority'].lower() == lower)
+        if field == 'tag':
+            return lower in [tag.lower() for tag in case['tags']]
+        if field == 'status':
+            if lower == 'open':
+                return case['fOpen']
+            if lower == 'closed':
+                return not case['fOpen']
+            return (case['fOpen'] and
+                    case['sStatus'].lower().startswith(lower))
+        if field in ('edited', 'lastupdated'):
+            start, sep, end = value.partition('..')
+            if not sep:
+                end = start
+            when = case['dtLastUpdated']
+            return ((not start or when >= _parse_time(start)) and
+                    (not end or when <= _parse_time(end)))
+        if field is None:
+            if re.match(r'^[\d,]+$', value):
+                return self._match(case, 'ixbug', value)
+            return lower in case['sTitle'].lower()
+        raise FakeAPIError(10, 'Unknown search axis %r' % field)
+
+    def search(self, q=None, cols='', max=None, **args):
+        terms = _terms_re.findall(q or '')
+        found = []
+        for case in self.cases.itervalues():
+            if not terms and not case['fOpen']:
+                continue
+            if all(bool(self._match(case, field.lower() or None, value))
+                   != bool(negate) for negate, field, value in terms):
+                found.append(case)
+        if max:
+            found = found[:int(max)]
+        return '<cases count="%d">%s</cases>' % (
+            len(found), ''.join(self._render_case(case, cols)
+                                for case in found))
+
+    ## Case editing
+
+    def new(self, cols='', ixPerson=None, **args):
+        case = self._new_case(args, ixPerson)
+        return self._render_case(case, cols)
+
+    def _edit(self, verb, args, ixPerson, change=None):
+        case = self._case(args)
+        self._apply(case, args)
+        if change:
+            change(case)
+        self._names(case)
+        self._add_event(case, verb, ixPerson, s=args.get('sEvent', ''),
+                        files=args.get('_files'))
+        return self._render_case(case, args.get('cols'))
+
+    def edit(self, ixPerson=None, **args):
+        return self._edit('Edited', args, ixPerson)
+
+    def assign(self, ixPerson=None, **args):
+        return self._edit('Assigned', args, ixPerson)
+
+    def resolve(self, ixPerson=None, **args):
+        def resolve(case):
+            if not args.get('ixStatus'):
+                case['ixStatus'] = self._status(case['ixCategory'],
+                                                'Resolved')
+            case['dtResolved'] = self.now
+            case['ixPersonAssignedTo'] = case['ixPersonOpenedBy']
+        return self._edit('Resolved', args, ixPerson, resolve)
+
+    def close(self, ixPerson=None, **args):
+        def close(case):
+            case['fOpen'] = False
+            case['dtClosed'] = self.now
+            case['ixPersonAssignedTo'] = 1
+        return self._edit('Closed', args, ixPerson, close)
+
+    def _reopen(self, verb, args, ixPerson):
+        def reopen(case):
+            case['fOpen'] = True
+            case['ixStatus'] = self._status(case['ixCategory'], 'Active')
+            case['dtResolved'] = case['dtClosed'] = None
+        return self._edit(verb, args, ixPerson, reopen)
+
+    def reopen(self, ixPerson=None, **args):
+        return self._reopen('Reopened', args, ixPerson)
+
+    def reactivate(self, ixPerson=None, **args):
+        return self._reopen('Reactivated', args, ixPerson)
+
+    ## Reference data
+
+    def _list(self, tag, item, items):
+        return '<%s>%s</%s>' % (tag, ''.join(_element(item, value)
+                                             for value in items), tag)
+
+    def _find(self, table, args, keys, what):
+        for name in keys:
+            if args.get(name):
+                for value in table.itervalues():
+                    if all(unicode(value.get(key)) == args.get(key)
+                           for key in name.split('+')):
+                        return value
+        raise FakeAPIError(3, '%s not found' % what)
+
+    def listPeople(self, **args):
+        def included(person):
+            if person['fDeleted']:
+                return args.get('fIncludeDeleted') == '1'
+            return args.get('fIncludeActive', '1') == '1'
+        return self._list('people', 'person',
+                          [person for person in self.people.itervalues()
+                           if included(person)])
+
+    def viewPerson(self, ixPerson=None, sEmail=None, **args):
+        for person in self.people.itervalues():
+            if (str(person['ixPerson']) == ixPerson or
+                (sEmail and person['sEmail'] == sEmail)):
+                return self._list('people', 'person', [person])
+        return '<people></people>'
+
+    def listProjects(self, **args):
+        return self._list('projects', 'project', self.projects.values())
+
+    def viewProject(self, **args):
+        return _element('project', self._find(
+            self.projects, args, ('ixProject', 'sProject'), 'Project'))
+
+    def listAreas(self, ixProject=None, **args):
+        return self._list('areas', 'area',
+                          [area for area in self.areas.itervalues()
+                           if not ixProject or
+                           str(area['ixProject']) == ixProject])
+
+    def viewArea(self, **args):
+        if args.get('sArea'):
+            keys = ('sArea+ixProject',) if args.get('ixProject') \
+                   else ('sArea',)
+        else:
+            keys = ('ixArea',)
+        return _element('area', self._find(self.areas, args, keys, 'Area'))
+
+    def listCategories(self, **args):
+        return self._list('categories', 'category',
+                          self.categories.values())
+
+    def viewCategory(self, **args):
+        return _element('category', self._find(
+            self.categories, args, ('ixCategory',), 'Category'))
+
+    def listPriorities(self, **args):
+        return self._list('priorities', 'priority',
+                          self.priorities.values())
+
+    def viewPriority(self, **args):
+        return _element('priority', self._find(
+            self.priorities, args, ('ixPriority',), 'Priority'))
+
+    def listStatuses(self, ixCategory=None, fResolved=None, **args):
+        return self._list('statuses', 'status',
+                          [status for status in self.statuses.itervalues()
+                           if (not ixCategory or
+                               str(status['ixCategory']) == ixCategory) and
+                              (not fResolved or status['fResolved'])])
+
+    def viewStatus(self, **args):
+        return _element('status', self._find(
+            self.statuses, args, ('ixStatus', 'sStatus+ixCategory'),
+            'Status'))
+
+    def _fixfor(self, fixfor):
+        return dict((name, value) for name, value in fixfor.iteritems()
+                    if name != 'dependencies')
+
+    def listFixFors(self, ixProject=None, ixFixFor=None, **args):
+        return self._list('fixfors', 'fixfor',
+                          [self._fixfor(fixfor)
+                           for fixfor in self.fixfors.itervalues()
+                           if (not ixProject or
+                               str(fixfor['ixProject']) == ixProject) and
+                              (not ixFixFor or
+                               str(fixfor['ixFixFor']) == ixFixFor)])
+
+    def viewFixFor(self, **args):
+        return _element('fixfor', self._fixfor(self._find(
+            self.fixfors, args, ('ixFixFor', 'sFixFor+ixProject'),
+            'FixFor')))
+
+    def newFixFor(self, ixProject=None, sFixFor='', dtRelease=None,
+                  dtStart=None, sStartNote='', fAssignable=None, **args):
+        ixFixFor = len(self.fixfors) + 1
+        project = self.projects.get(int(ixProject or 0), {})
+        self.fixfors[ixFixFor] = dict(
+            ixFixFor=ixFixFor, sFixFor=sFixFor,
+            ixProject=project.get('ixProject', -1),
+            sProject=project.get('sProject', ''),
+            fDeleted=fAssignable != '1', fReallyDeleted=False,
+            dt=_parse_time(dtRelease) if dtRelease else None,
+            dtStart=_parse_time(dtStart) if dtStart else None,
+            sStartNote=sStartNote, dependencies=set())
+        return _element('fixfor', self._fixfor(self.fixfors[ixFixFor]))
+
+    def editFixFor(self, ixFixFor=None, **args):
+        fixfor = self._find(self.fixfors, dict(ixFixFor=ixFixFor),
+                            ('ixFixFor',), 'FixFor')
+        for name in ('sFixFor', 'sStartNote'):
+            if name in args:
+                fixfor[name] = args[name]
+        if args.get('dtRelease'):
+            fixfor['dt'] = _parse_time(args['dtRelease'])
+        if args.get('dtStart'):
+            fixfor['dtStart'] = _parse_time(args['dtStart'])
+        if 'fAssignable' in args:
+            fixfor['fDeleted'] = args['fAssignable'] != '1'
+        return _element('fixfor', self._fixfor(fixfor))
+
+    def addFixForDependency(self, ixFixFor=None, ixFixForDependsOn=None,
+                            **args):
+        self._find(self.fixfors, dict(ixFixFor=ixFixFor), ('ixFixFor',),
+                   'FixFor')['dependencies'].add(int(ixFixForDependsOn))
+        return ''
+
+    def deleteFixForDependency(self, ixFixFor=None, ixFixForDependsOn=None,
+                               **args):
+        self._find(self.fixfors, dict(ixFixFor=ixFixFor), ('ixFixFor',),
+                   'FixFor')['dependencies'].discard(int(ixFixForDependsOn))
+        return ''
+
+    def listTags(self, **args):
+        counts = collections.Counter(tag for case in self.cases.itervalues()
+                                     for tag in case['tags'])
+        return self._list('tags', 'tag',
+                          [dict(ixTag=ix, sTag=tag, cTagUses=counts[tag])
+                           for ix, tag in enumerate(sorted(counts), 1)])
+
+    def listFilters(self, **args):
+        return '<filters>%s</filters>' % ''.join(
+            '<filter type="%s" sFilter="%s"%s>%s</filter>' % (
+                value['type'], value['sFilter'],
+                ' status="current"'
+                if value['sFilter'] == self.current_filter else '',
+                _xmlvalue('name', value['name']))
+            for value in self.filters)
+
+    def setCurrentFilter(self, sFilter=None, **args):
+        self.current_filter = sFilter
+        return ''
+
+    def subscribe(self, ixBug=None, ixPerson=None, **args):
+        self.subscriptions.add((int(ixBug or 0), ixPerson))
+        return ''
+
+    def unsubscribe(self, ixBug=None, ixPerson=None, **args):
+        self.subscriptions.discard((int(ixBug or 0), ixPerson))
+        return ''
+
+    ## Sessions
+
+    def logon(self, email=None, password=None, **args):
+        for person in self.people.itervalues():
+            if email in (person['sEmail'], person['sFullName']):
+                if password == self.password:
+                    token = 'token-%d-%d' % (person['ixPerson'],
+                                             len(self.tokens))
+                    self.tokens.add(token)
+                    return '<token>%s</token>' % _xmlvalue('token', token)
+        raise FakeAPIError(1, 'Incorrect password or username')
+
+    def logoff(self, token=None, **args):
+        if token != self.token:
+            self.tokens.discard(token)
+        return ''
+
+    def person_of(self, token):
+        """The ``ixPerson`` a token belongs to, the administrator for the
+        preset **token** .
+        """
+        match = re.match(r'^token-(\d+)-', token or '')
+        if match:
+            return int(match.group(1))
+        return self.people.keys()[0]
+
+    _public = frozenset(('logon', 'logoff'))
+
+    def call(self, cmd, args, files=()):
+        """Run the command **cmd** with the request **args**, and return the
+        body of its response.
+        """
+        handler = getattr(self, cmd, None) if cmd and cmd[0] != '_' else None
+        if handler is None or cmd in ('call', 'person_of'):
+            raise FakeAPIError(0, 'Unknown command %r' % cmd)
+        token = args.pop('token', None)
+        if cmd not in self._public and token not in self.tokens:
+            raise FakeAPIError(3, 'Not logged on')
+        args = dict((str(name), value) for name, value in args.iteritems())
+        if cmd == 'logoff':
+            args['token'] = token
+        elif cmd not in self._public and cmd in (
+                'new', 'edit', 'assign', 'resolve', 'close', 'reopen',
+                'reactivate'):
+            args['ixPerson'] = self.person_of(token)
+            args['_files'] = list(files)
+        with self.lock:
+            return handler(**args)
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        if self.server.fake.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, *args)
+
+    def _reply(self, code, body, content_type='text/xml; charset=utf-8'):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path, _, query = self.path.partition('?')
+        if path.endswith('/api.xml'):
+            return self._reply(200, self.server.fake.api_xml())
+        if path.endswith('/api.asp'):
+            args = dict((name, values[-1]) for name, values in
+                        urlparse.parse_qs(query).iteritems())
+            return self._api(args, [])
+        if path.endswith('/default.asp'):
+            return self._reply(200, 'attachment ' + query,
+                               'application/octet-stream')
+        self._reply(404, 'Not found', 'text/plain')
+
+    def do_POST(self):
+        path = self.path.partition('?')[0]
+        if not path.endswith('/api.asp'):
+            return self._reply(404, 'Not found', 'text/plain')
+        form = cgi.FieldStorage(
+            fp=self.rfile, headers=self.headers,
+            environ=dict(REQUEST_METHOD='POST',
+                         CONTENT_TYPE=self.headers.get('content-type', ''),
+                         CONTENT_LENGTH=self.headers.get('content-length',
+                                                         '0')))
+        args = {}
+        files = []
+        for name in form.keys():
+            field = form[name]
+            if isinstance(field, list):
+                field = field[-1]
+            if field.filename:
+                files.append(field.filename)
+            else:
+                args[name] = field.value.decode('utf-8')
+        self._api(args, files)
+
+    def _api(self, args, files):
+        fake = self.server.fake
+        code, body = fake.respond(args, files)
+        self._reply(code, body)
+
+class _HTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class FakeServer(object):
+    """FakeServer(store=None, host='127.0.0.1', port=0, latency=0, \
+                  error_rate=0.0, api_error_rate=0.0, padding=0, \
+                  verbose=False, **store_args)
+
+    Serve a :py:class:`fborm.fakeserver.FakeStore` over HTTP, built from
+    **store_args** if no **store** is given. **port** 0 picks a free port,
+    see :py:attr:`url` .
+
+    * **latency** is added to every API request, in seconds, or drawn
+      uniformly from a ``(low, high)`` pair.
+    * **error_rate** is the fraction of API requests answered with an HTTP
+      503 error, and **api_error_rate** the fraction answered with a
+      FogBugz ``<error>`` response instead of running the command.
+    * **padding** adds that many bytes to every API response, as an XML
+      comment, to simulate large responses.
+
+    The settings can be changed while the server runs. ``requests`` counts
+    the API commands received, by command name. A command failing with
+    anything but a :py:class:`fborm.fakeserver.FakeAPIError` is answered
+    with an HTTP 500 error.
+    """
+    def __init__(self, store=None, host='127.0.0.1', port=0, latency=0,
+                 error_rate=0.0, api_error_rate=0.0, padding=0,
+                 verbose=False, seed=0, **store_args):
+        if store is None:
+            store = FakeStore(seed=seed, **store_args)
+        self.store = store
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.error_rate = error_rate
+        self.api_error_rate = api_error_rate
+        self.padding = padding
+        self.verbose = verbose
+        self.requests = collections.Counter()
+        self._rnd = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def token(self):
+        """The token which is always logged on."""
+        return self.store.token
+
+    @property
+    def url(self):
+        """The URL to give ``fogbugz.FogBugz`` or
+        :py:class:`fborm.FogBugzORM`, once started."""
+        return 'http://%s:%d/' % (self.host, self.port)
+
+    def api_xml(self):
+        return ('<?xml version="1.0" encoding="UTF-8"?><response>'
+                '<version>8</version><minversion>1</minversion>'
+                '<url>api.asp?</url></response>')
+
+    def respond(self, args, files):
+        """Return the HTTP status and body for an API request.
+        """
+        cmd = args.pop('cmd', None)
+        with self._lock:
+            self.requests[cmd] += 1
+            draw = self._rnd.random()
+            latency = self.latency
+            if isinstance(latency, (tuple, list)):
+                latency = self._rnd.uniform(*latency)
+        if latency:
+            time.sleep(latency)
+        if draw < self.error_rate:
+            return 503, 'Service Unavailable'
+        if draw < self.error_rate + self.api_error_rate:
+            body = '<error code="99"><![CDATA[Injected failure]]></error>'
+        else:
+            try:
+                body = self.store.call(cmd, args, files)
+            except FakeAPIError, e:
+                body = '<error code="%d">%s</error>' % (
+                    e.code, _xmlvalue('error', e.args[0]))
+            except Exception, e:
+                ## a bug in the fake, answered instead of dropping the
+                ## connection
+                return 500, 'Internal error in %s: %r' % (cmd, e)
+        if self.padding:
+            body += '<!--%s-->' % ('x' * self.padding)
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+        return 200, ('<?xml version="1.0" encoding="UTF-8"?>'
+                     '<response>%s</response>' % body)
+
+    def start(self):
+        """Start serving in a background thread. Returns the server.
+        """
+        self._server = _HTTPServer((self.host, self.port), _Handler)
+        self._server.fake = self
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving.
+        """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
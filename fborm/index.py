@@ -0,0 +1,223 @@
+""".. _index:
+
+==========================================
+Reference Data Lookup Tables
+==========================================
+
+Cases refer to people, statuses, areas and the rest by their ``ix`` values,
+so nearly every report needs dictionaries to turn those back into names.
+A :py:class:`fborm.index.ReferenceIndex` builds those lookup tables once
+from the ``list*`` commands, with O(1) lookups on the unique keys of each
+entity and grouping indexes such as statuses by category.
+
+.. code:: python
+
+    idx = fborm.ReferenceIndex().refresh(fbo)
+    for case in fbo.search(q='assignedto:me'):
+        print idx.people[case.ixPersonAssignedTo].sEmail,
+        print idx.areas.lookup(ixProject=case.ixProject, sArea=case.sArea)
+    resolved = idx.statuses.group('fResolved', True)
+
+Once set as the ``index`` of a :py:class:`fborm.FogBugzORM`, its
+``viewPerson``, ``viewStatus``, ``viewArea`` and ``viewProject`` methods are
+answered from the index whenever it is warm and holds the entity, without
+a round trip to the server.
+
+.. _fborm.index:
+
+fborm.index Module Documentation
+====================================
+"""
+import time
+import jsontree
+from . import objects
+from . import commands
+from . import ext
+
+reference_entities = dict(
+    people      = dict(command='listAllPeople', typemap=objects.fbPerson,
+                       key='ixPerson',
+                       unique=(('sEmail',), ('sFullName',)),
+                       groups=()),
+    projects    = dict(command='listProjects', typemap=objects.fbProject,
+                       key='ixProject',
+                       unique=(('sProject',),),
+                       groups=('ixPersonOwner',)),
+    areas       = dict(command='listAreas', typemap=objects.fbArea,
+                       key='ixArea',
+                       unique=(('ixProject', 'sArea'),),
+                       groups=('ixProject', 'ixPersonOwner')),
+    categories  = dict(command='listCategories', typemap=objects.fbCategory,
+                       key='ixCategory',
+                       unique=(('sCategory',),),
+                       groups=()),
+    priorities  = dict(command='listPriorities', typemap=objects.fbPriority,
+                       key='ixPriority',
+                       unique=(('sPriority',),),
+                       groups=()),
+    statuses    = dict(command='listStatuses', typemap=objects.fbStatus,
+                       key='ixStatus',
+                       unique=(('ixCategory', 'sStatus'),),
+                       groups=('ixCategory', 'fResolved')),
+    fixfors     = dict(command='listFixFors', typemap=objects.fbFixFor,
+                       key='ixFixFor',
+                       unique=(('ixProject', 'sFixFor'),),
+                       groups=('ixProject',)))
+"""The entities a :py:class:`fborm.index.ReferenceIndex` loads: the
+command used to list them, the typemap, the primary key, the other unique
+keys (single or compound) and the fields to group by. Keys missing from a
+custom typemap are skipped.
+"""
+
+class EntityIndex(object):
+    """EntityIndex(typemap, items, key, unique=(), groups=())
+
+    Lookup tables over the **items** of one entity. Index by the primary
+    **key** with ``index[ix]``, by any of the **unique** keys with
+    :py:meth:`lookup` and by the **groups** fields with :py:meth:`group` .
+    """
+    def __init__(self, typemap, items, key, unique=(), groups=()):
+        self.typemap = typemap
+        self.items = list(items)
+        self.key = key
+        self.loaded = time.time()
+        self._unique = {}
+        self._groups = {}
+        for names in ((key,),) + tuple(unique):
+            if all(name in typemap for name in names):
+                self._unique[names] = {}
+        for name in groups:
+            if name in typemap:
+                self._groups[name] = {}
+        for item in self.items:
+            for names, table in self._unique.iteritems():
+                table.setdefault(tuple(item[name] for name in names), item)
+            for name, table in self._groups.iteritems():
+                table.setdefault(item[name], []).append(item)
+
+    def __getitem__(self, ix):
+        return self._unique[(self.key,)][(ix,)]
+
+    def __contains__(self, ix):
+        return (ix,) in self._unique[(self.key,)]
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def get(self, ix, default=None):
+        return self._unique[(self.key,)].get((ix,), default)
+
+    def lookup(self, **keys):
+        """Return the item matching a unique key, given as keyword arguments,
+        or ``None``. Raises ``KeyError`` if the combination of names given
+        is not indexed.
+
+        .. code:: python
+
+            idx.areas.lookup(ixProject=2, sArea='Code')
+        """
+        names = tuple(sorted(keys))
+        for indexed, table in self._unique.iteritems():
+            if tuple(sorted(indexed)) == names:
+                return table.get(tuple(keys[name] for name in indexed))
+        raise KeyError("No unique index on: " + ', '.join(names))
+
+    def group(self, name, value):
+        """Return the list of items whose field **name** equals **value** .
+        """
+        return list(self._groups[name].get(value, ()))
+
+    def groups(self, name):
+        """Return the whole grouping index for **name**, a dictionary of
+        value to list of items.
+        """
+        return dict((value, list(items))
+                    for value, items in self._groups[name].iteritems())
+
+class ReferenceIndex(object):
+    """ReferenceIndex(typemaps=None, max_age=None)
+
+    Holds an :py:class:`fborm.index.EntityIndex` per entity in
+    :py:data:`fborm.index.reference_entities` as attributes (``people``,
+    ``statuses``, ...) once loaded. **typemaps** overrides the typemap used
+    for an entity. The index is warm for **max_age** seconds after it was
+    loaded, or until :py:meth:`clear` if **max_age** is ``None`` .
+    """
+    def __init__(self, typemaps=None, max_age=None):
+        self.typemaps = dict((name, spec['typemap'])
+                             for name, spec in reference_entities.iteritems())
+        self.typemaps.update(typemaps or {})
+        self.max_age = max_age
+        self._entities = {}
+
+    def __getattr__(self, name):
+        if name in reference_entities:
+            try:
+                return self._entities[name]
+            except KeyError:
+                raise AttributeError(
+                    "The %r reference index has not been loaded" % name)
+        raise AttributeError(name)
+
+    def load(self, entity, items):
+        """Build the index for **entity** from already fetched **items**,
+        which must have been extracted with the typemap of this index.
+        """
+        spec = reference_entities[entity]
+        self._entities[entity] = EntityIndex(
+            self.typemaps[entity], items, spec['key'],
+            spec['unique'], spec['groups'])
+        return self._entities[entity]
+
+    def refresh(self, fbo, *entities):
+        """Fetch and index the named entities, or all of them, using either a
+        :py:class:`fborm.FogBugzORM` or a ``fogbugz.FogBugz`` instance.
+        Returns the index itself.
+        """
+        for entity in entities or reference_entities:
+            command = reference_entities[entity]['command']
+            typemap = self.typemaps[entity]
+            if hasattr(fbo.__class__, command):
+                items = getattr(fbo, command)(typemap)
+            elif command == 'listAllPeople':
+                items = ext.listAllPeople(fbo, typemap)
+            else:
+                items = getattr(commands, command)(fbo, typemap)
+            self.load(entity, items)
+        return self
+
+    def clear(self, *entities):
+        """Forget the named entities, or all of them.
+        """
+        for entity in entities or list(self._entities):
+            self._entities.pop(entity, None)
+
+    def warm(self, entity):
+        """True if **entity** is loaded and not older than **max_age** .
+        """
+        index = self._entities.get(entity)
+        if index is None:
+            return False
+        return (self.max_age is None or
+                time.time() - index.loaded < self.max_age)
+
+    def view(self, entity, typemap, keys):
+        """Answer a ``view*`` command locally. Returns a copy of the item
+        matching the unique key given in **keys**, or ``None`` if the index
+        is not warm, was built with a different typemap, or does not hold
+        the item, in which case the server should be asked.
+        """
+        if not self.warm(entity) or self.typemaps[entity] is not typemap:
+            return None
+        keys = dict((name, value) for name, value in keys.iteritems()
+                    if value is not None)
+        try:
+            item = self._entities[entity].lookup(**keys)
+        except KeyError:
+            return None
+        if item is None:
+            return None
+        return jsontree.jsontree(item)
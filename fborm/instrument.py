@@ -0,0 +1,550 @@
+""".. _instrument:
+
+==========================================
+Call Instrumentation and Metrics
+==========================================
+
+When a call is slow the time can go to the network, to FogBugzPy parsing
+the response with BeautifulSoup, or to :py:mod:`fborm.parse` converting
+it with the typemap. An :py:class:`fborm.instrument.Instrument` measures
+each of them. Every command produces a
+:py:class:`fborm.instrument.CallRecord` with the time spent in each phase,
+the bytes sent and received, the number of items returned and the error
+code of a failed call, which is handed to the hooks and the sinks.
+
+.. code:: python
+
+    instrument = fborm.Instrument()
+    fbo = fborm.FogBugzORM('https://hostname/', token,
+                           instrument=instrument)
+    fbo.search(q='status:active')
+    print instrument.aggregator.summary()['search']
+    print fborm.PrometheusExporter(instrument.aggregator).render()
+
+The phases of a call are:
+
+* ``request``: sending the request and reading the response body.
+* ``parse``: the rest of the time FogBugzPy spends on the API command,
+  which is building the BeautifulSoup tree.
+* ``convert``: the rest of the command, which is mostly the typemap
+  conversion of :py:mod:`fborm.parse` .
+
+:py:class:`fborm.FogBugzORM` records one call per method. A ``fogbugz``
+instance wrapped with :py:meth:`Instrument.wrap` , which is what the
+functions of :py:mod:`fborm.commands` are given, records one call per API
+command, unless it is made inside :py:meth:`Instrument.command` , which
+records the whole block as one call:
+
+.. code:: python
+
+    fb = instrument.wrap(fogbugz.FogBugz('https://hostname/', token))
+    with instrument.command('search'):
+        fborm.search(fb, q='status:active')
+
+Calls made from other threads, such as the pages fetched ahead by
+:py:func:`fborm.commands.search_iter` , are recorded by themselves.
+
+Sinks are objects with a ``record(record)`` method. The instrument always
+feeds its :py:class:`fborm.instrument.Aggregator` , which keeps a histogram
+per command and phase for :py:class:`fborm.instrument.PrometheusExporter`
+to render. A :py:class:`fborm.instrument.StatsdSink` sends every call to
+StatsD as it completes.
+
+.. _fborm.instrument:
+
+fborm.instrument Module Documentation
+=====================================
+"""
+import collections
+import contextlib
+import re
+import socket
+import threading
+import timeit
+from . import columnar
+from . import pool
+
+_clock = timeit.default_timer
+
+phases = ('request', 'parse', 'convert', 'total')
+"""The phases timed for every call, see :py:class:`CallRecord` ."""
+
+class CallRecord(object):
+    """The measurements of one call, all times in seconds.
+
+    ``command`` is the :py:class:`fborm.FogBugzORM` method, the name given
+    to :py:meth:`Instrument.command` , or the API command. ``api`` lists the
+    API commands it sent. ``items`` is the number of objects returned, and
+    ``error`` the error code of a failed call: the FogBugz error code, as a
+    string, ``'http<status>'`` for HTTP errors, or the exception class name.
+    """
+    __slots__ = ('command', 'args', 'api', 'start', 'request', 'parse',
+                 'convert', 'total', 'bytes_sent', 'bytes_received',
+                 'items', 'error', 'exception')
+
+    def __init__(self, command, args=None):
+        self.command = command
+        self.args = args or {}
+        self.api = []
+        self.start = _clock()
+        self.request = self.parse = self.convert = self.total = 0.0
+        self.bytes_sent = self.bytes_received = 0
+        self.items = 0
+        self.error = self.exception = None
+
+    def returned(self, result):
+        """Count the items in **result**, and return it.
+        """
+        if result is None:
+            self.items = 0
+        elif isinstance(result, (list, tuple, columnar.ColumnTable)):
+            self.items = len(result)
+        else:
+            self.items = 1
+        return result
+
+    def failed(self, exception):
+        self.exception = exception
+        self.error = error_code(exception)
+
+    def __repr__(self):
+        return ('<CallRecord %s request=%.6f parse=%.6f convert=%.6f '
+                'total=%.6f sent=%d received=%d items=%d error=%s>' % (
+                    self.command, self.request, self.parse, self.convert,
+                    self.total, self.bytes_sent, self.bytes_received,
+                    self.items, self.error))
+
+_error_re = re.compile(r'Error Code (-?\d+)')
+
+def error_code(exception):
+    """The error code recorded for **exception**, see
+    :py:class:`CallRecord` .
+    """
+    match = _error_re.search(str(exception))
+    if match:
+        return match.group(1)
+    for error in (exception,) + tuple(getattr(exception, 'args', ())):
+        code = getattr(error, 'code', None)
+        if isinstance(code, (int, long)):
+            return 'http%d' % code
+    return exception.__class__.__name__
+
+class _TimedResponse(object):
+    def __init__(self, response, record):
+        self._response = response
+        self._record = record
+
+    def read(self, *args):
+        start = _clock()
+        data = self._response.read(*args)
+        self._record.request += _clock() - start
+        self._record.bytes_received += len(data)
+        return data
+
+    def readline(self, *args):
+        start = _clock()
+        data = self._response.readline(*args)
+        self._record.request += _clock() - start
+        self._record.bytes_received += len(data)
+        return data
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+class _TimedOpener(object):
+    """Wraps the ``urllib2`` opener of a FogBugz instance, adding the time
+    to send the request and read the response to the current call.
+    """
+    def __init__(self, opener, instrument):
+        self.opener = opener
+        self.instrument = instrument
+
+    def open(self, request, *args, **kwdargs):
+        record = self.instrument.current()
+        if record is None:
+            return self.opener.open(request, *args, **kwdargs)
+        data = request.get_data() if hasattr(request, 'get_data') else None
+        if data is not None:
+            record.bytes_sent += len(data)
+        start = _clock()
+        try:
+            response = self.opener.open(request, *args, **kwdargs)
+        finally:
+            record.request += _clock() - start
+        return _TimedResponse(response, record)
+
+    def __getattr__(self, name):
+        return getattr(self.opener, name)
+
+class InstrumentedFogBugz(object):
+    """InstrumentedFogBugz(fb, instrument)
+
+    Wrapper around the ``fogbugz.FogBugz`` instance **fb** which times
+    every API command, made with :py:meth:`Instrument.wrap` . It can be
+    used anywhere the FogBugz instance can, including
+    :py:func:`fborm.pool.clone_session` .
+    """
+    def __init__(self, fb, instrument):
+        object.__setattr__(self, '_fb', fb)
+        object.__setattr__(self, '_instrument', instrument)
+        object.__setattr__(self, '_handlers', {})
+        if not isinstance(fb._opener, _TimedOpener):
+            fb._opener = _TimedOpener(fb._opener, instrument)
+
+    def clone_session(self):
+        return InstrumentedFogBugz(pool.clone_session(self._fb),
+                                   self._instrument)
+
+    def __getattr__(self, name):
+        if (name.startswith('_') or
+            (hasattr(self._fb.__class__, name) and
+             name not in ('logon', 'logoff'))):
+            return getattr(self._fb, name)
+        handler = self._handlers.get(name)
+        if handler is None:
+            fb = self._fb
+            api = self._instrument.api
+            def handler(*args, **kwdargs):
+                return api(fb, name, args, kwdargs)
+            self._handlers[name] = handler
+        return handler
+
+    def __setattr__(self, name, value):
+        if name == '_opener' and not isinstance(value, _TimedOpener):
+            value = _TimedOpener(value, self._instrument)
+        setattr(self._fb, name, value)
+
+class Instrument(object):
+    """Instrument(*sinks)
+
+    Collects a :py:class:`CallRecord` for every call made through the
+    FogBugz instances it wraps, and hands each to the hooks, to
+    :py:attr:`aggregator` and to **sinks** . It is thread-safe, and one
+    instrument can be shared by any number of sessions.
+    """
+    def __init__(self, *sinks):
+        self.aggregator = Aggregator()
+        self.sinks = [self.aggregator] + list(sinks)
+        self._hooks = collections.defaultdict(list)
+        self._local = threading.local()
+
+    def wrap(self, fb):
+        """Return an :py:class:`InstrumentedFogBugz` for the FogBugz
+        instance **fb** .
+        """
+        if isinstance(fb, InstrumentedFogBugz):
+            return fb
+        return InstrumentedFogBugz(fb, self)
+
+    def add_hook(self, pre=None, post=None, command=None):
+        """Call ``pre(record)`` before and ``post(record)`` after every
+        call, or only those of **command** . The pre hook sees the command
+        and its arguments, the post hook the completed record, including
+        the ``exception`` of a failed call.
+        """
+        self._hooks[command].append((pre, post))
+
+    def remove_hook(self, pre=None, post=None, command=None):
+        self._hooks[command].remove((pre, post))
+
+    def _run_hooks(self, record, which):
+        for command in (None, record.command):
+            for hook in self._hooks.get(command, ()):
+                if hook[which] is not None:
+                    hook[which](record)
+
+    def current(self):
+        """The :py:class:`CallRecord` of the call in progress in this
+        thread, or ``None`` .
+        """
+        return getattr(self._local, 'record', None)
+
+    def _begin(self, command, args):
+        record = CallRecord(command, args)
+        self._local.record = record
+        if self._hooks:
+            self._run_hooks(record, 0)
+        return record
+
+    def _end(self, record):
+        self._local.record = None
+        record.total = _clock() - record.start
+        record.convert = max(record.total - record.request - record.parse,
+                             0.0)
+        if self._hooks:
+            self._run_hooks(record, 1)
+        for sink in self.sinks:
+            sink.record(record)
+
+    @contextlib.contextmanager
+    def command(self, command, args=None):
+        """Context manager recording everything in the block as one call of
+        **command**, yielding its :py:class:`CallRecord` . Nested inside
+        another call it does nothing, and yields ``None`` .
+        """
+        if self.current() is not None:
+            yield None
+            return
+        record = self._begin(command, args)
+        try:
+            yield record
+        except Exception, e:
+            record.failed(e)
+            raise
+        finally:
+            self._end(record)
+
+    def call(self, command, func, fb, *args, **kwdargs):
+        """Call ``func(fb, *args, **kwdargs)`` recorded as **command**, and
+        return its result.
+        """
+        with self.command(command, kwdargs) as record:
+            res = func(fb, *args, **kwdargs)
+            if record is not None:
+                record.returned(res)
+            return res
+
+    def api(self, fb, name, args, kwdargs):
+        """Send the API command **name** through the FogBugz instance
+        **fb**, timing it as part of the current call.
+        """
+        record = self.current()
+        alone = record is None
+        if alone:
+            record = self._begin(name, kwdargs)
+        record.api.append(name)
+        request = record.request
+        start = _clock()
+        try:
+            res = getattr(fb, name)(*args, **kwdargs)
+        except Exception, e:
+            if alone:
+                record.failed(e)
+            raise
+        finally:
+            record.parse += _clock() - start - (record.request - request)
+            if alone:
+                self._end(record)
+        return res
+
+class Histogram(object):
+    """Histogram(buckets=Histogram.buckets)
+
+    Counts observed values into buckets by their upper bounds, and keeps
+    the count, sum, minimum and maximum.
+    """
+    buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+               1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+    """The default bucket upper bounds, for times in seconds."""
+
+    def __init__(self, buckets=None):
+        self.bounds = tuple(sorted(buckets or self.buckets)) + (
+            float('inf'),)
+        self.counts = [0] * len(self.bounds)
+        self.count = 0
+        self.sum = 0.0
+        self.min = self.max = None
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        for index, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+
+    def cumulative(self):
+        """``(bound, count)`` pairs counting the values up to each bound.
+        """
+        total = 0
+        res = []
+        for bound, count in zip(self.bounds, self.counts):
+            total += count
+            res.append((bound, total))
+        return res
+
+    def quantile(self, q):
+        """An estimate of the **q** quantile, interpolated within the bucket
+        holding it, and clamped to the observed range.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        low = 0.0
+        below = 0
+        for bound, count in zip(self.bounds, self.counts):
+            if count and below + count >= rank:
+                high = self.max if bound == float('inf') else bound
+                value = low + (high - low) * (rank - below) / count
+                return min(max(value, self.min), self.max)
+            below += count
+            low = bound
+        return self.max
+
+    def summary(self):
+        return dict(count=self.count, sum=self.sum, min=self.min,
+                    max=self.max,
+                    mean=self.sum / self.count if self.count else None,
+                    p50=self.quantile(0.5), p90=self.quantile(0.9),
+                    p99=self.quantile(0.99))
+
+class Aggregator(object):
+    """Aggregator(buckets=None)
+
+    Sink keeping a :py:class:`Histogram` per command and phase, and counters
+    of calls, bytes, items and errors per command.
+    """
+    counters = ('calls', 'api_calls', 'bytes_sent', 'bytes_received',
+                'items')
+    """The counters kept per command."""
+
+    def __init__(self, buckets=None):
+        self.bucket_bounds = buckets
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+            self.totals = collections.defaultdict(collections.Counter)
+            self.errors = collections.defaultdict(collections.Counter)
+
+    def record(self, record):
+        with self._lock:
+            command = record.command
+            for phase in phases:
+                key = (command, phase)
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram(
+                        self.bucket_bounds)
+                histogram.observe(getattr(record, phase))
+            totals = self.totals[command]
+            totals['calls'] += 1
+            totals['api_calls'] += len(record.api)
+            totals['bytes_sent'] += record.bytes_sent
+            totals['bytes_received'] += record.bytes_received
+            totals['items'] += record.items
+            if record.error is not None:
+                self.errors[command][record.error] += 1
+
+    def commands(self):
+        with self._lock:
+            return sorted(self.totals)
+
+    def summary(self):
+        """A dictionary by command, each holding the counters, the
+        ``errors`` by code and the :py:meth:`Histogram.summary` of each
+        phase.
+        """
+        with self._lock:
+            res = {}
+            for command, totals in self.totals.iteritems():
+                res[command] = item = dict(
+                    (name, totals[name]) for name in self.counters)
+                item['errors'] = dict(self.errors.get(command, {}))
+                for phase in phases:
+                    item[phase] = self.histograms[
+                        (command, phase)].summary()
+            return res
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class PrometheusExporter(object):
+    """PrometheusExporter(aggregator, namespace='fborm')
+
+    Renders an :py:class:`Aggregator` in the Prometheus text exposition
+    format, to be served by whatever HTTP endpoint the application has.
+    """
+    content_type = 'text/plain; version=0.0.4'
+
+    def __init__(self, aggregator, namespace='fborm'):
+        self.aggregator = aggregator
+        self.namespace = namespace
+
+    def render(self):
+        agg = self.aggregator
+        ns = self.namespace
+        lines = ['# HELP %s_call_seconds Time per call and phase.' % ns,
+                 '# TYPE %s_call_seconds histogram' % ns]
+        with agg._lock:
+            for (command, phase), histogram in sorted(
+                    agg.histograms.iteritems()):
+                labels = 'command="%s",phase="%s"' % (_label(command),
+                                                      _label(phase))
+                for bound, count in histogram.cumulative():
+                    lines.append('%s_call_seconds_bucket{%s,le="%s"} %d' % (
+                        ns, labels, _number(bound), count))
+                lines.append('%s_call_seconds_sum{%s} %s' % (
+                    ns, labels, _number(histogram.sum)))
+                lines.append('%s_call_seconds_count{%s} %d' % (
+                    ns, labels, histogram.count))
+            for name in agg.counters:
+                lines.append('# TYPE %s_%s_total counter' % (ns, name))
+                for command, totals in sorted(agg.totals.iteritems()):
+                    lines.append('%s_%s_total{command="%s"} %d' % (
+                        ns, name, _label(command), totals[name]))
+            lines.append('# TYPE %s_errors_total counter' % ns)
+            for command, errors in sorted(agg.errors.iteritems()):
+                for code, count in sorted(errors.iteritems()):
+                    lines.append('%s_errors_total{command="%s",code="%s"} %d'
+                                 % (ns, _label(command), _label(code),
+                                    count))
+        return '\n'.join(lines) + '\n'
+
+class StatsdSink(object):
+    """StatsdSink(send=None, host='127.0.0.1', port=8125, prefix='fborm')
+
+    Sink sending every call to StatsD: a timer in milliseconds per phase,
+    and counters for the bytes, items and errors, named
+    ``<prefix>.<command>.<metric>`` . The lines of a call go in one UDP
+    packet to **host** and **port**, or are passed one at a time to
+    **send** if given, which is how to collect them locally. Send errors are
+    ignored, as StatsD is only ever best effort.
+    """
+    def __init__(self, send=None, host='127.0.0.1', port=8125,
+                 prefix='fborm'):
+        self.prefix = prefix
+        self.send = send
+        self.address = (host, port)
+        self._socket = None
+        if send is None:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def lines(self, record):
+        name = '%s.%s' % (self.prefix, record.command)
+        res = ['%s.%s:%.3f|ms' % (name, phase, getattr(record, phase) * 1e3)
+               for phase in phases]
+        res.extend('%s.%s:%d|c' % (name, counter, getattr(record, counter))
+                   for counter in ('bytes_sent', 'bytes_received', 'items'))
+        if record.error is not None:
+            res.append('%s.errors.%s:1|c' % (name, record.error))
+        return res
+
+    def record(self, record):
+        lines = self.lines(record)
+        if self.send is not None:
+            for line in lines:
+                self.send(line)
+            return
+        try:
+            self._socket.sendto('\n'.join(lines), self.address)
+        except socket.error:
+            pass
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
@@ -0,0 +1,128 @@
+""".. _parallel:
+
+==========================================
+Multi-Process Conversion
+==========================================
+
+Converting a large search is CPU bound: walking the XML, ``strptime`` for
+every date, building the objects. Threads do not help with that in Python
+2, so one core does all the work while the others sit idle.
+
+:py:func:`fborm.parallel.extract_parallel` splits the raw response into
+chunks of **chunk_size** items with the `lxml`_ incremental parser, and
+converts the chunks in a ``multiprocessing`` pool of **processes**. The
+typemap is sent to the workers as a pickled
+:py:class:`fborm.parse.CompiledTypemap`, which refers to the typemap by
+the module and name it is defined as (see
+:py:func:`fborm.parse.typemap_ref`), so it has to be a module level
+variable, or a projection of one. The converted items come back in the
+order of the response, and are then sorted by **sort_by** .
+
+:py:func:`fborm.commands.search` does this when given **processes** .
+
+.. code:: python
+
+    cases = fbo.search(q='project:"Big One"',
+                       casetype=fborm.objects.fbBug_withEvents,
+                       sort_by='ixBug', processes=8)
+
+Splitting the response and sending the items back costs time the single
+process conversion does not spend, so this pays off for large searches
+with many columns, or the ``events`` column, on a machine with cores to
+spare. ``benchmarks/bench_processes.py`` measures where it starts to pay
+off on yours. The items are ``jsontree`` objects, or
+:py:mod:`fborm.records` objects, but not lazy records, which would need
+the XML in the worker. They are extracted from `lxml`_ elements, exactly
+as :py:mod:`fborm.stream` extracts them.
+
+.. _lxml: http://lxml.de/
+
+.. _fborm.parallel:
+
+fborm.parallel Module Documentation
+===================================
+"""
+import multiprocessing
+import fogbugz
+from . import parse
+from . import stream
+
+def split_chunks(xml, tag, chunk_size=200):
+    """split_chunks(xml, tag, chunk_size=200)
+
+    Generator reading the **tag** elements of the XML stream **xml**, and
+    yielding them **chunk_size** at a time as one XML string. An
+    ``<error>`` response is raised as ``fogbugz.FogBugzAPIError`` .
+    """
+    from lxml import etree
+    if chunk_size < 1:
+        raise ValueError("'chunk_size' must be at least 1")
+    chunk = []
+    for event, elem in etree.iterparse(xml, events=('end',),
+                                       tag=(tag, 'error'),
+                                       strip_cdata=False):
+        if elem.tag == 'error':
+            raise fogbugz.FogBugzAPIError(
+                'Error Code %s: %s' % (elem.get('code'), elem.text))
+        chunk.append(etree.tostring(elem, with_tail=False))
+        ## as in fborm.stream.iterextract, the tree does not grow
+        elem.clear()
+        parent = elem.getparent()
+        while elem.getprevious() is not None:
+            del parent[0]
+        if len(chunk) >= chunk_size:
+            yield '<chunk>%s</chunk>' % ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield '<chunk>%s</chunk>' % ''.join(chunk)
+
+def convert_chunk(plan, chunk):
+    """Convert the items of the XML string **chunk**, from
+    :py:func:`fborm.parallel.split_chunks`, with the compiled typemap
+    **plan** .
+    """
+    from lxml import etree
+    parser = etree.XMLParser(strip_cdata=False)
+    return [plan.extract(stream._node(elem))
+            for elem in etree.fromstring(chunk, parser)]
+
+def extract_parallel(xml, tag, fbtypemap, namemap={}, sort_by=None,
+                     record=False, processes=None, chunk_size=200):
+    """extract_parallel(xml, tag, fbtypemap, namemap={}, sort_by=None, \
+                        record=False, processes=None, chunk_size=200)
+
+    Convert every **tag** element of the XML stream **xml**, like
+    :py:func:`fborm.parse.extract_all`, in a pool of worker processes.
+    **processes** is the number of processes, by default one per core, or
+    a ``multiprocessing.Pool`` to use instead of starting one.
+    """
+    if record == 'lazy':
+        raise ValueError('lazy records can not be converted in another '
+                         'process')
+    plan = parse.compile_typemap(fbtypemap, namemap, record)
+    ## fail before starting any work if the workers can not find it
+    parse.typemap_ref(plan.typemap)
+    pool = processes
+    if processes is None or isinstance(processes, (int, long)):
+        pool = multiprocessing.Pool(processes)
+    try:
+        ## the workers convert while the rest of the response is split
+        pending = [pool.apply_async(convert_chunk, (plan, chunk))
+                   for chunk in split_chunks(xml, tag, chunk_size)]
+        items = []
+        for converted in pending:
+            items.extend(converted.get())
+    except:
+        if pool is not processes:
+            pool.terminate()
+        raise
+    if pool is not processes:
+        pool.close()
+        pool.join()
+    if not record and hasattr(plan.typemap, 'tree_class'):
+        ## a projection's jsontree is pickled as a plain one, guard it again
+        for item in items:
+            object.__setattr__(item, '__class__', plan.factory)
+    if sort_by:
+        items.sort(key=parse._sort_by(sort_by))
+    return items
@@ -12,6 +12,8 @@ fborm.parse Module Documentation
 """
 import functools
 import datetime
+import sys
+from . import records
 
 def keys2cols(fbtypemap, namemap={}):
     """
@@ -22,6 +24,7 @@ def keys2cols(fbtypemap, namemap={}):
         fbobj = extract(res.events.event, fbtypemap, namemap)
         res = fb.edit(**fbargs(fbobj, fbtypemap, namemap))
     """
+    fbtypemap = getattr(fbtypemap, 'typemap', fbtypemap)
     return ','.join(namemap.get(getattr(conv, 'colname', name),
                                 getattr(conv, 'colname', name))
                     for name, conv in fbtypemap.iteritems()
@@ -37,6 +40,7 @@ def fbargs(data, fbtypemap={}, namemap={}):
         fbobj = extract(res.events.event, fbtypemap, namemap)
         res = fb.edit(**fbargs(fbobj, fbtypemap, namemap))
     """
+    fbtypemap = getattr(fbtypemap, 'typemap', fbtypemap)
     return dict((str(namemap.get(getattr(fbtypemap.get(name), 'setname', name),
                                  getattr(fbtypemap.get(name), 'setname', name))),
                 getattr(fbtypemap.get(name), 'setconvert', fbsetconvert)(value))
@@ -45,29 +49,322 @@ def fbargs(data, fbtypemap={}, namemap={}):
                     getattr(fbtypemap.get(name), 'settable', True)))
 
 
-def _convert(res, fbdata, name, conv, typemap, namemap):
-    mappedname = namemap.get(getattr(conv, 'resname', name),
-                             getattr(conv, 'resname', name))
+_ATTRIB, _PLAIN, _MAP, _NESTED, _DATA = range(5)
 
-    if getattr(conv, 'ignore', False):
-        return
-    elif getattr(conv, 'attrib', False):
-        res[name] = conv(fbdata, mappedname)
-    else:
-        inner_data = fbdata.find(mappedname)
-        if inner_data is None:
-            inner_data = fbdata.find(mappedname.lower())
-            if inner_data is None:
-                #res[name] = None
-                raise RuntimeError('Could not find attribute: ' + repr(mappedname))
-        if getattr(conv, 'takes_map', False):
-            res[name] = conv(inner_data, namemap)
-        elif getattr(conv, 'takes_data', False):
-            res[name] = conv(inner_data, res)
-        else:
-            res[name] = conv(inner_data)
+class CompiledTypemap(object):
+    """Precomputed extraction plan for a ``(fbtypemap, namemap)`` pair.
+
+    Everything :py:func:`fborm.parse.extract` used to work out for every
+    field of every item is resolved once here: the field order, the tag or
+    attribute name after applying the ``namemap``, and which calling
+    convention the converter uses. Converters which take the partially
+    converted data (``takes_data``) are kept in a separate list which is run
+    after all the other fields. Nested typemaps, as created by
+    :py:func:`fborm.types.fblistof` and :py:func:`fborm.types.fbevents`,
+    are compiled as well so event lists do not need their own lookups.
+
+    You will not normally create these directly, instead use
+    :py:func:`fborm.parse.compile_typemap` which caches the result. A
+    compiled typemap can be passed anywhere a typemap is accepted by
+    :py:func:`fborm.parse.extract` and :py:func:`fborm.parse.extract_all`.
+
+    With **record** set the items are extracted as
+    :py:mod:`fborm.records` instances instead of ``jsontree`` objects,
+    using either the given record class or one generated from the typemap.
+    With **record** set to ``'lazy'`` they are
+    :py:class:`fborm.records.LazyRecord` instances, which only convert a
+    field when it is first read. Nested typemaps use the same mode.
     
-def extract(fbdata, fbtypemap, name_map={}):
+    Compiled typemaps can be pickled, to be sent to another process, as
+    long as the typemap can be found by :py:func:`fborm.parse.typemap_ref`
+    there; the other process compiles it again.
+    """
+    __slots__ = ('typemap', 'namemap', 'size', 'steps', 'late', 'factory',
+                 'record', 'fields')
+
+    def __init__(self, fbtypemap, namemap={}, record=False):
+        self.typemap = fbtypemap
+        self.namemap = namemap
+        self.size = (len(fbtypemap), len(namemap))
+        self.record = record
+        if isinstance(record, type):
+            self.factory = record
+        elif record == 'lazy':
+            self.factory = records.lazy_record_class(fbtypemap)
+        elif record:
+            self.factory = records.record_class(fbtypemap)
+        elif hasattr(fbtypemap, 'tree_class'):
+            ## a fborm.projection.Projection guarding its unfetched fields
+            self.factory = fbtypemap.tree_class
+        else:
+            import jsontree
+            self.factory = jsontree.jsontree
+        self.steps = []
+        self.late = []
+        self.fields = {}
+        for name, conv in fbtypemap.iteritems():
+            if getattr(conv, 'ignore', False):
+                continue
+            resname = getattr(conv, 'resname', name)
+            tag = namemap.get(resname, resname)
+            lowertag = tag.lower()
+            if lowertag == tag:
+                lowertag = None
+            sub = None
+            if getattr(conv, 'attrib', False):
+                kind = _ATTRIB
+            elif getattr(conv, 'takes_data', False):
+                kind = _DATA
+            elif (getattr(conv, 'takes_map', False) and
+                  isinstance(getattr(conv, 'typemap', None), dict)):
+                kind = _NESTED
+                sub = (compile_typemap(conv.typemap, namemap,
+                                       record if record == 'lazy'
+                                       else bool(record)),
+                       getattr(conv, 'first', False))
+            elif getattr(conv, 'takes_map', False):
+                kind = _MAP
+            else:
+                kind = _PLAIN
+            step = (kind, name, conv, tag, lowertag, sub)
+            self.fields[name] = step
+            if kind == _DATA:
+                self.late.append(step)
+            else:
+                self.steps.append(step)
+
+    def extract(self, fbdata):
+        """Convert a single XML element. See :py:func:`fborm.parse.extract`.
+        """
+        if self.record == 'lazy':
+            return self._extract_lazy(fbdata)
+        res = self.factory()
+        children = _childmap(fbdata)
+        for kind, name, conv, tag, lowertag, sub in self.steps:
+            if kind == _ATTRIB:
+                res[name] = conv(fbdata, tag)
+                continue
+            inner_data = _find(fbdata, children, tag, lowertag)
+            if inner_data is None:
+                raise RuntimeError('Could not find attribute: ' + repr(tag))
+            if kind == _PLAIN:
+                res[name] = conv(inner_data)
+            elif kind == _NESTED:
+                plan, first = sub
+                if first:
+                    res[name] = plan.extract_first(inner_data)
+                else:
+                    res[name] = plan.extract_all(inner_data)
+            else:
+                res[name] = conv(inner_data, self.namemap)
+        for kind, name, conv, tag, lowertag, sub in self.late:
+            ## late converters decide for themselves what a missing element
+            ## means, fborm.types.fbconditional will never look at it when
+            ## the condition is not met.
+            res[name] = conv(_find(fbdata, children, tag, lowertag), res)
+        return res
+
+    def _extract_lazy(self, fbdata):
+        ## only find the elements now, so missing ones still fail here
+        children = _childmap(fbdata)
+        raw = {}
+        for kind, name, conv, tag, lowertag, sub in self.steps:
+            if kind == _ATTRIB:
+                raw[name] = fbdata
+                continue
+            inner_data = _find(fbdata, children, tag, lowertag)
+            if inner_data is None:
+                raise RuntimeError('Could not find attribute: ' + repr(tag))
+            raw[name] = inner_data
+        for kind, name, conv, tag, lowertag, sub in self.late:
+            raw[name] = _find(fbdata, children, tag, lowertag)
+        res = self.factory()
+        res._plan = self
+        res._raw = raw
+        return res
+
+    def convert(self, name, inner_data, res):
+        """Convert field **name** from its XML element, for the item
+        **res** . Used by :py:class:`fborm.records.LazyRecord` .
+        """
+        kind, name, conv, tag, lowertag, sub = self.fields[name]
+        if kind == _ATTRIB:
+            return conv(inner_data, tag)
+        if kind == _PLAIN:
+            return conv(inner_data)
+        if kind == _NESTED:
+            plan, first = sub
+            if first:
+                return plan.extract_first(inner_data)
+            return plan.extract_all(inner_data)
+        if kind == _DATA:
+            return conv(inner_data, res)
+        return conv(inner_data, self.namemap)
+
+    def extract_all(self, itemiter, sort_by=None):
+        """Convert every item. See :py:func:`fborm.parse.extract_all`.
+        """
+        if itemiter is None:
+            return []
+        convert = self.extract
+        gen = (convert(item) for item in itemiter if item != u'\n')
+        if not sort_by:
+            return list(gen)
+        return sorted(gen, key=_sort_by(sort_by))
+
+    def extract_first(self, itemiter):
+        """Convert only the first item, or return ``None`` if there is none.
+        """
+        if itemiter is not None:
+            for item in itemiter:
+                if item != u'\n':
+                    return self.extract(item)
+        return None
+
+    def __reduce__(self):
+        record = self.record
+        if isinstance(record, type) and issubclass(record, records.Record):
+            ## generated record classes are made again from the typemap
+            record = 'lazy' if issubclass(record, records.LazyRecord) \
+                     else True
+        return (_compile_ref, (typemap_ref(self.typemap), dict(self.namemap),
+                               record))
+
+_refs = {}
+
+def typemap_ref(fbtypemap):
+    """Return a picklable reference to **fbtypemap**, which holds
+    converter functions and cannot be pickled itself: the module and name
+    of the module level variable it is, found by identity, or for a
+    :py:class:`fborm.projection.Projection` the reference to its source
+    and its fields. Raises ``pickle.PicklingError`` if there is neither.
+    :py:func:`fborm.parse.resolve_typemap` turns the reference back into
+    the typemap.
+    """
+    fbtypemap = getattr(fbtypemap, 'typemap', fbtypemap)
+    ref = _refs.get(id(fbtypemap))
+    if ref is not None and ref[0] is fbtypemap:
+        return ref[1]
+    if hasattr(fbtypemap, 'source') and hasattr(fbtypemap, 'unfetched'):
+        ref = ('project', typemap_ref(fbtypemap.source), fbtypemap.fields,
+               fbtypemap.strict)
+    else:
+        ## the defining module first, the packages re-exporting it after
+        for modname, module in sorted(sys.modules.items(),
+                                      key=lambda item: -item[0].count('.')):
+            for name, value in getattr(module, '__dict__', {}).iteritems():
+                if value is fbtypemap:
+                    ref = ('module', modname, name)
+                    break
+            if ref is not None:
+                break
+    if ref is None:
+        import pickle
+        raise pickle.PicklingError(
+            'typemap is not a module level variable, so it can not be '
+            'found in another process')
+    _refs[id(fbtypemap)] = (fbtypemap, ref)
+    return ref
+
+def resolve_typemap(ref):
+    """Return the typemap referred to by **ref**, from
+    :py:func:`fborm.parse.typemap_ref` .
+    """
+    if ref[0] == 'project':
+        from . import projection
+        return projection.project(resolve_typemap(ref[1]), ref[2], ref[3])
+    __import__(ref[1])
+    return getattr(sys.modules[ref[1]], ref[2])
+
+_ref_plans = {}
+
+def _compile_ref(ref, namemap, record):
+    ## every pickled plan arrives with its own copy of the namemap, which
+    ## would miss the identity keyed cache of compile_typemap
+    key = (ref, tuple(sorted(namemap.iteritems())), record)
+    plan = _ref_plans.get(key)
+    if plan is None:
+        plan = _ref_plans[key] = CompiledTypemap(resolve_typemap(ref),
+                                                 namemap, record)
+    return plan
+
+def _childmap(fbdata):
+    ## One pass over the direct children replaces a recursive find() per
+    ## field. Only when a name is not a direct child do we walk the
+    ## descendants, once, which is needed for responses where the object is
+    ## wrapped (viewProject, new, ...) and for optional fields.
+    children = {}
+    for child in getattr(fbdata, 'children', ()):
+        name = getattr(child, 'name', None)
+        if name and name not in children:
+            children[name] = child
+    return children
+
+def _descend(fbdata, children):
+    descendants = getattr(fbdata, 'descendants', None)
+    if descendants is None:
+        return False
+    for child in descendants:
+        name = getattr(child, 'name', None)
+        if name and name not in children:
+            children[name] = child
+    return True
+
+def _find(fbdata, children, tag, lowertag):
+    inner_data = children.get(tag)
+    if inner_data is None and lowertag:
+        inner_data = children.get(lowertag)
+    if inner_data is None:
+        if None not in children:
+            children[None] = _descend(fbdata, children)
+            if children[None]:
+                return _find(fbdata, children, tag, lowertag)
+        if not children[None]:
+            inner_data = fbdata.find(tag)
+            if inner_data is None and lowertag:
+                inner_data = fbdata.find(lowertag)
+    return inner_data
+
+_compiled = {}
+_compiled_max = 256
+
+def compile_typemap(fbtypemap, namemap={}, record=False):
+    """Return the :py:class:`fborm.parse.CompiledTypemap` for a typemap and
+    namemap pair, compiling it on first use. See
+    :py:class:`fborm.parse.CompiledTypemap` for **record** .
+
+    .. code:: python
+
+        plan = compile_typemap(fborm.objects.fbBug_withEvents, namemap)
+        cases = extract_all(res.cases, plan, sort_by='ixBug')
+
+    Compiled typemaps are cached on the identity of the two dictionaries,
+    so the typemaps are treated as constants once they have been used. If
+    you change a typemap in place after it has been used, call
+    :py:func:`fborm.parse.clear_compiled` . A compiled typemap is returned
+    unchanged, unless a different **record** mode is asked for.
+    """
+    if isinstance(fbtypemap, CompiledTypemap):
+        if not record or fbtypemap.record == record:
+            return fbtypemap
+        fbtypemap, namemap = fbtypemap.typemap, fbtypemap.namemap
+    key = (id(fbtypemap), id(namemap), record)
+    plan = _compiled.get(key)
+    if (plan is None or plan.typemap is not fbtypemap or
+        plan.namemap is not namemap or
+        plan.size != (len(fbtypemap), len(namemap))):
+        plan = CompiledTypemap(fbtypemap, namemap, record)
+        if len(_compiled) >= _compiled_max:
+            _compiled.clear()
+        _compiled[key] = plan
+    return plan
+
+def clear_compiled():
+    """Drop all cached :py:class:`fborm.parse.CompiledTypemap` objects.
+    """
+    _compiled.clear()
+
+def extract(fbdata, fbtypemap, name_map={}, record=False):
     """
 
     .. code:: python
@@ -75,20 +372,14 @@ def extract(fbdata, fbtypemap, name_map={}):
         res = fb.search(q="1234", cols=keys2cols(fbtypemap, namemap))
         fbobj = extract(res.events.event, fbtypemap, namemap)
         res = fb.edit(**fbargs(fbobj, fbtypemap, namemap))
+
+    Pass **record** as ``True``, or a record class, to get a
+    :py:mod:`fborm.records` instance instead of a ``jsontree``, or as
+    ``'lazy'`` to have each field converted on first access.
     """
-    import jsontree
-    res = jsontree.jsontree()
-    late_processes = []
-    for name, conv in fbtypemap.iteritems():
-        if getattr(conv, 'takes_data', False):
-            late_processes.append((name, conv))
-        else:
-            _convert(res, fbdata, name, conv, fbtypemap, name_map)
-    for name, conv in late_processes:
-        _convert(res, fbdata, name, conv, fbtypemap, name_map)
-    return res
+    return compile_typemap(fbtypemap, name_map, record).extract(fbdata)
     
-def extract_all(itemiter, type_map, name_map={}, sort_by=None):
+def extract_all(itemiter, type_map, name_map={}, sort_by=None, record=False):
     """
     
     .. code:: python
@@ -96,11 +387,8 @@ def extract_all(itemiter, type_map, name_map={}, sort_by=None):
         res = fb.search(q="1234", cols=keys2cols(fbtypemap, namemap))
         events = extract_all(res.events, fbtypemap, namemap, sort_by='ixBug')
     """
-    gen = (extract(item, type_map, name_map) for item in itemiter
-           if item != u'\n')
-    if not sort_by:
-        return list(gen)
-    return sorted(gen, key=_sort_by(sort_by))
+    return compile_typemap(type_map, name_map, record).extract_all(itemiter,
+                                                                  sort_by)
 
 def _sort_by(names):
     if not isinstance(names, (list, tuple)):
@@ -110,7 +398,13 @@ def _sort_by(names):
     return functools.partial(_sort_by_, names)
 
 def _dt2fbdt(dt):
-    return dt.isoformat().split('.')[0] + 'Z'
+    ## isoformat() is done in C, the rest is avoiding the split() on every
+    ## value when there are no microseconds to cut off
+    if dt.tzinfo is not None and dt.utcoffset() is not None:
+        dt = dt.replace(tzinfo=None) - dt.utcoffset()
+    if dt.microsecond:
+        dt = dt.replace(microsecond=0)
+    return dt.isoformat() + 'Z'
     
 def fbsetconvert(value):
     """
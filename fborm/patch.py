@@ -4,19 +4,148 @@ Monkey Patch
 ======================
 
 Monkey patch for the fogbugz module to deal with unicode encoding issues
-properly in python 2.7 and some python3 versions.
+properly in python 2.7 and some python3 versions, and to stream file
+uploads rather than building the whole request body in memory.
 
 You need to explicitly call monkey_patch() to enable the patch, and do so
 before constructing your first FogBugz or FBORM object.
 
 """
+import mmap
+import os
 import fogbugz
+from . import types
+
+_blocksize = 65536
+
+class MultipartBody(object):
+    """MultipartBody(parts, blocksize=65536)
+
+    Multipart form body which is produced while it is being sent instead of
+    being built in memory. **parts** is a sequence of byte strings and file
+    objects. Files given by name on disk (see
+    :py:data:`fborm.types.fbFiles`) are memory mapped, opened only while
+    they are being sent and closed straight after. Other file objects are
+    read **blocksize** bytes at a time from their current position, and are
+    left open for their owner to close.
+
+    The length is worked out up front, so ``len()`` gives the
+    ``Content-Length``. The body is file like, which is what ``httplib``
+    streams from, and iterating over it yields the body in blocks.
+    """
+    def __init__(self, parts, blocksize=_blocksize):
+        self.blocksize = blocksize
+        self._parts = []
+        for part in parts:
+            if isinstance(part, str):
+                self._parts.append((part, None, len(part)))
+            elif isinstance(part, types._DiskFile):
+                self._parts.append((None, part.name,
+                                    os.path.getsize(part.name)))
+            else:
+                self._parts.append(self._fileobj(part))
+        ## empty files have nothing to send, and cannot be memory mapped
+        self._parts = [part for part in self._parts if part[2]]
+        self._length = sum(size for data, fileobj, size in self._parts)
+        self._index = 0
+        self._offset = 0
+        self._position = 0
+        self._source = None
+
+    def _fileobj(self, fileobj):
+        try:
+            start = fileobj.tell()
+            fileobj.seek(0, os.SEEK_END)
+            end = fileobj.tell()
+            fileobj.seek(start)
+            return (None, (fileobj, start), end - start)
+        except (AttributeError, IOError, ValueError):
+            ## not seekable, the one case where it has to be read up front
+            data = fileobj.read()
+            return (data, None, len(data))
+
+    def __len__(self):
+        return self._length
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        """Only rewinding to the start is supported, so the body can be sent
+        again when a kept alive connection turned out to be closed.
+        """
+        if offset != 0 or whence != os.SEEK_SET:
+            raise IOError("MultipartBody can only be rewound to the start")
+        self._close_source()
+        for data, fileobj, size in self._parts:
+            if isinstance(fileobj, tuple):
+                fileobj[0].seek(fileobj[1])
+        self._index = self._offset = self._position = 0
+
+    def _open_source(self, name):
+        fh = open(name, 'rb')
+        try:
+            self._source = (fh, mmap.mmap(fh.fileno(), 0,
+                                          access=mmap.ACCESS_READ))
+        except:
+            fh.close()
+            raise
+
+    def _close_source(self):
+        source, self._source = self._source, None
+        if source is not None:
+            source[1].close()
+            source[0].close()
+
+    def _read_part(self, size):
+        data, fileobj, length = self._parts[self._index]
+        size = min(size, length - self._offset)
+        if data is not None:
+            chunk = data[self._offset:self._offset + size]
+        elif isinstance(fileobj, tuple):
+            chunk = fileobj[0].read(size)
+            if len(chunk) != size:
+                raise IOError("File changed size while being uploaded")
+        else:
+            if self._source is None:
+                self._open_source(fileobj)
+            chunk = self._source[1][self._offset:self._offset + size]
+        self._offset += len(chunk)
+        if self._offset >= length:
+            self._close_source()
+            self._index += 1
+            self._offset = 0
+        return chunk
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._length - self._position
+        chunks = []
+        while size > 0 and self._index < len(self._parts):
+            chunk = self._read_part(size)
+            chunks.append(chunk)
+            size -= len(chunk)
+        data = ''.join(chunks)
+        self._position += len(data)
+        return data
+
+    def __iter__(self):
+        while True:
+            block = self.read(self.blocksize)
+            if not block:
+                return
+            yield block
+
+    def close(self):
+        self._close_source()
+        self._index = len(self._parts)
 
 def __encode_multipart_formdata(self, fields, files):
     """
     fields is a sequence of (key, value) elements for regular form fields.
     files is a sequence of (filename, filehandle) files to be uploaded
-    returns (content_type, body)
+    returns (content_type, body) where body is a
+    :py:class:`fborm.patch.MultipartBody`
     """
     BOUNDARY = fogbugz._make_boundary()
 
@@ -24,7 +153,7 @@ def __encode_multipart_formdata(self, fields, files):
         fields['nFileCount'] = str(len(files))
 
     crlf = '\r\n'
-    buf = fogbugz.BytesIO()
+    parts = []
 
     for k, v in fields.items():
         vcall = str
@@ -39,7 +168,7 @@ def __encode_multipart_formdata(self, fields, files):
             vcall(v),
             '',
         ]
-        buf.write(crlf.join(lines).encode('utf-8'))
+        parts.append(crlf.join(lines).encode('utf-8'))
 
     n = 0
     for f, h in files.items():
@@ -50,25 +179,26 @@ def __encode_multipart_formdata(self, fields, files):
                 'filename="%s"' % (n, f),
             '',
         ]
-        buf.write(crlf.join(lines).encode('utf-8'))
+        parts.append(crlf.join(lines).encode('utf-8'))
         lines = [
             'Content-type: application/octet-stream',
             '',
             '',
         ]
-        buf.write(crlf.join(lines).encode('utf-8'))
-        buf.write(h.read())
-        buf.write(crlf.encode('utf-8'))
+        parts.append(crlf.join(lines).encode('utf-8'))
+        parts.append(h)
+        parts.append(crlf.encode('utf-8'))
 
-    buf.write(('--' + BOUNDARY + '--' + crlf).encode('utf-8'))
+    parts.append(('--' + BOUNDARY + '--' + crlf).encode('utf-8'))
     content_type = "multipart/form-data; boundary=%s" % BOUNDARY
-    return content_type, buf.getvalue()
+    return content_type, MultipartBody(parts)
 
 def monkey_patch():
     """Monkey patch (replace/override) the private method
     ``fogbugz.FogBugz._FogBugz__encode_multipart_formdata`` to replace it with
     an alternative version which will properly encode unicode data in fields
-    with a sane backoff when mixed unicode pages are encountered.
+    with a sane backoff when mixed unicode pages are encountered, and which
+    streams attached files instead of reading them into memory.
     """
     fogbugz.FogBugz._FogBugz__encode_multipart_formdata=__encode_multipart_formdata
     
@@ -0,0 +1,123 @@
+""".. _pool:
+
+==========================================
+Concurrent API Calls
+==========================================
+
+Every FogBugz XML API command is a separate HTTP request, so scripts which
+touch thousands of cases spend nearly all their time waiting on the
+network. A :py:class:`fborm.pool.SessionPool` runs calls on a bounded
+number of worker threads, each with its own session cloned from a single
+logged on ``fogbugz.FogBugz`` instance, so they all share the one token.
+
+.. code:: python
+
+    with fborm.SessionPool(fb, workers=8) as pool:
+        results = pool.map(
+            lambda session, bug: session.viewPerson(ixPerson=bug.ixPerson),
+            bugs)
+
+.. _fborm.pool:
+
+fborm.pool Module Documentation
+====================================
+"""
+import copy
+import sys
+import threading
+
+def clone_session(fb):
+    """Return a copy of the ``fogbugz.FogBugz`` instance **fb** which shares
+    its URL, token and opener, but can be used from another thread.
+
+    FogBugzPy caches the API command handlers it creates as closures over
+    the instance, so a plain copy would still send every call through the
+    original instance. Objects providing their own ``clone_session()``
+    method, such as the wrappers around a FogBugz instance, are asked to
+    clone themselves. (FogBugzPy answers every attribute lookup with an API
+    command, hence looking on the class.)
+    """
+    if hasattr(fb.__class__, 'clone_session'):
+        return fb.clone_session()
+    clone = copy.copy(fb)
+    clone._FogBugz__handlerCache = {}
+    return clone
+
+class SessionPool(object):
+    """SessionPool(fb, workers=4, max_inflight=None)
+
+    A bounded pool of **workers** threads, each of which lazily clones its
+    own session from **fb** with :py:func:`fborm.pool.clone_session` .
+    **max_inflight** limits how many calls may be talking to the server at
+    once, and defaults to **workers** . It can also be a semaphore shared
+    between pools so that several pools together stay under one limit.
+
+    The functions passed to :py:meth:`apply_async` and :py:meth:`map` are
+    called with the session as their first argument.
+    """
+    def __init__(self, fb, workers=4, max_inflight=None):
+        from multiprocessing.pool import ThreadPool
+        if workers < 1:
+            raise ValueError("'workers' must be at least 1")
+        if max_inflight is None:
+            max_inflight = workers
+        if isinstance(max_inflight, (int, long)):
+            if max_inflight < 1:
+                raise ValueError("'max_inflight' must be at least 1")
+            max_inflight = threading.BoundedSemaphore(max_inflight)
+        self.fb = fb
+        self.workers = workers
+        self.inflight = max_inflight
+        self._local = threading.local()
+        self._pool = ThreadPool(workers)
+
+    def session(self):
+        """The session belonging to the calling worker thread.
+        """
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = clone_session(self.fb)
+        return session
+
+    def _call(self, func, args, kwdargs):
+        session = self.session()
+        self.inflight.acquire()
+        try:
+            return func(session, *args, **kwdargs)
+        finally:
+            self.inflight.release()
+
+    def _call_safe(self, func_args):
+        func, args = func_args
+        try:
+            return self._call(func, args, {}), None
+        except Exception:
+            return None, sys.exc_info()[1]
+
+    def apply_async(self, func, args=(), kwdargs={}, callback=None):
+        """Queue ``func(session, *args, **kwdargs)`` and return a
+        ``multiprocessing.pool.AsyncResult`` for it.
+        """
+        return self._pool.apply_async(self._call, (func, args, kwdargs),
+                                      callback=callback)
+
+    def map(self, func, items):
+        """Call ``func(session, item)`` for every item, and return a list of
+        ``(result, error)`` pairs in the same order as **items** . Exceptions
+        are caught per item, so one bad item does not lose the results of
+        all the others; **error** is the exception, or ``None`` .
+        """
+        return self._pool.map(self._call_safe,
+                              [(func, (item,)) for item in items])
+
+    def close(self):
+        """Finish the queued calls and stop the worker threads.
+        """
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
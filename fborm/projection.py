@@ -0,0 +1,139 @@
+""".. _projection:
+
+==========================================
+Column Projection
+==========================================
+
+:py:func:`fborm.parse.keys2cols` asks the server for every field of the
+typemap. A script reading only the title of its cases, but searching with
+:py:data:`fborm.objects.fbBug_withEvents`, has the server write out, and
+the client parse, the whole history of every case.
+
+:py:func:`fborm.projection.project` makes the typemap holding only the
+fields the script reads, and so the ``cols`` the search asks for. The
+**fields** argument of :py:func:`fborm.commands.search`,
+:py:func:`fborm.commands.search_iter` and
+:py:func:`fborm.stream.search_stream` does the same in place.
+
+.. code:: python
+
+    for case in fbo.search(q='project:"Big One"',
+                           casetype=fborm.objects.fbBug_withEvents,
+                           fields=['ixBug', 'sTitle']):
+        print case.ixBug, case.sTitle
+        print case.events       # raises fborm.UnfetchedFieldError
+
+A ``jsontree`` normally creates an empty ``jsontree`` for any name it does
+not hold, so reading a field the projection left out would quietly give
+an empty value. Instead it raises
+:py:class:`fborm.projection.UnfetchedFieldError`, which is both an
+``AttributeError`` and a ``KeyError``, or with ``strict='warn'`` issues a
+:py:class:`fborm.projection.UnfetchedFieldWarning` and carries on as
+before. Record results (``result='records'`` or ``'lazy'``) do not hold
+the unfetched fields either, and raise ``AttributeError`` for them.
+
+Converters which take the partially converted case, made with
+:py:func:`fborm.types.fbconditional`, read the fields their condition
+names, so list those as well: ``sFrom`` of an event needs ``fEmail`` .
+
+.. _fborm.projection:
+
+fborm.projection Module Documentation
+=====================================
+"""
+import threading
+import warnings
+import jsontree
+
+class UnfetchedFieldError(AttributeError, KeyError):
+    """Raised when reading a field which the projection did not fetch.
+    """
+    def __str__(self):
+        return Exception.__str__(self)
+
+class UnfetchedFieldWarning(UserWarning):
+    """Issued, with ``strict='warn'``, when reading a field which the
+    projection did not fetch.
+    """
+
+class _ProjectedTree(jsontree.jsontree):
+    ## the jsontree of a projection, with the fields it left out in
+    ## _unfetched; reading one of those does not create an empty jsontree
+    _unfetched = frozenset()
+    _strict = True
+
+    def __missing__(self, name):
+        if name in self._unfetched:
+            message = ('field %r was not fetched, add it to the fields of '
+                       'the projection' % (name,))
+            if self._strict != 'warn':
+                raise UnfetchedFieldError(message)
+            warnings.warn(message, UnfetchedFieldWarning, stacklevel=3)
+        return jsontree.jsontree.__missing__(self, name)
+
+    def __reduce__(self):
+        ## pickled, and copied, as a plain jsontree
+        return (jsontree.jsontree, (), None, None, self.iteritems())
+
+class Projection(dict):
+    """The typemap made by :py:func:`fborm.projection.project`, holding the
+    projected fields of the typemap **source** . ``unfetched`` holds the
+    names of the other fields, and ``tree_class`` the ``jsontree`` class
+    guarding them, which :py:class:`fborm.parse.CompiledTypemap` extracts
+    the items as.
+    """
+    def __init__(self, source, fields, strict=True):
+        dict.__init__(self, ((name, source[name]) for name in fields))
+        self.source = source
+        self.fields = tuple(fields)
+        self.strict = strict
+        self.unfetched = frozenset(name for name in source
+                                   if name not in self)
+        self.tree_class = jsontree.jsontree
+        if strict:
+            self.tree_class = type('Projected', (_ProjectedTree,),
+                                   dict(_unfetched=self.unfetched,
+                                        _strict=strict))
+
+_projections = {}
+_projections_max = 256
+_projections_lock = threading.Lock()
+
+def project(fbtypemap, fields, strict=True):
+    """Return the typemap holding only the **fields** of **fbtypemap**,
+    a :py:class:`fborm.projection.Projection` .
+
+    .. code:: python
+
+        titles = fborm.project(fborm.objects.fbBug_withEvents,
+                               ['ixBug', 'sTitle'])
+        cols = fborm.keys2cols(titles)         # 'ixBug,sTitle'
+        cases = fbo.search(q='status:open', casetype=titles)
+
+    **strict** sets what reading an unfetched field of a ``jsontree``
+    result does: ``True`` raises
+    :py:class:`fborm.projection.UnfetchedFieldError`, ``'warn'`` issues an
+    :py:class:`fborm.projection.UnfetchedFieldWarning`, and ``False`` gives
+    the plain ``jsontree`` behaviour. A field not in **fbtypemap** raises
+    ``ValueError`` . The projections are cached, so the same one is
+    returned, and its compiled form reused, for the same arguments.
+    """
+    fbtypemap = getattr(fbtypemap, 'typemap', fbtypemap)
+    if isinstance(fbtypemap, Projection):
+        fbtypemap = fbtypemap.source
+    if isinstance(fields, basestring):
+        fields = [field.strip() for field in fields.split(',')]
+    fields = tuple(fields)
+    unknown = [name for name in fields if name not in fbtypemap]
+    if unknown:
+        raise ValueError('not in the typemap: ' +
+                         ', '.join(repr(name) for name in unknown))
+    key = (id(fbtypemap), fields, strict)
+    with _projections_lock:
+        res = _projections.get(key)
+        if res is None or res.source is not fbtypemap:
+            res = Projection(fbtypemap, fields, strict)
+            if len(_projections) >= _projections_max:
+                _projections.clear()
+            _projections[key] = res
+        return res
@@ -0,0 +1,262 @@
+""".. _records:
+
+==========================================
+Compact Record Classes
+==========================================
+
+By default every extracted object is a ``jsontree``, a dictionary with
+attribute access. That is convenient, but each case then costs a whole hash
+table. For large result sets a record class generated from the typemap,
+using ``__slots__``, holds the same data in a fraction of the memory while
+keeping both the attribute access and the read side of the dictionary
+interface.
+
+.. code:: python
+
+    plan = fborm.compile_typemap(fborm.objects.fbBug_withEvents, record=True)
+    cases = fborm.extract_all(res.cases, plan)
+    print cases[0].sTitle, cases[0]['ixBug'], cases[0].events[0].sVerb
+    print cases[0].to_json()
+
+Nested typemaps, such as the events of a case, are extracted as records as
+well. A field which was not part of the response is simply not set, so it
+raises ``AttributeError`` (or ``KeyError`` when indexed) instead of
+auto-creating an empty ``jsontree``. Records can be pickled.
+
+Lazy Records
+------------
+
+Converting a case is mostly spent in the converters: ``strptime`` for every
+date, a full extraction for every event in the history, a split for every
+comma list. A :py:class:`fborm.records.LazyRecord` only looks up the XML
+element of each field when it is extracted, and runs the converter the
+first time the field is read. The result is stored in the record, so it
+is converted once. A script that reads 2 of the 30 columns it asked for
+pays for those 2.
+
+.. code:: python
+
+    for case in fbo.search(q='project:Big', casetype=fborm.fbBug_withEvents,
+                           result='lazy'):
+        if case.ixPriority <= 2:            # the only field converted
+            print case.sTitle, len(case.events)
+
+The XML elements are kept alive until every field has been read, so
+lazy records are for reading a few fields of many cases, not for keeping
+results around. Pickling or calling ``to_dict()`` converts everything.
+
+.. _fborm.records:
+
+fborm.records Module Documentation
+====================================
+"""
+import threading
+
+class Record(object):
+    """Base class of the generated record classes. ``_fields`` holds the
+    field names in typemap order.
+
+    Supports ``record.name``, ``record['name']``, ``get()``, ``keys()``,
+    ``values()``, ``items()``, ``iteritems()``, ``in``, ``len()`` and
+    iteration over the names of the fields which are set, so records can be
+    passed to :py:func:`fborm.parse.fbargs` and the write commands like any
+    other extracted object.
+    """
+    __slots__ = ()
+    _fields = ()
+
+    def __init__(self, *args, **kwdargs):
+        for name, value in dict(*args, **kwdargs).iteritems():
+            setattr(self, name, value)
+
+    def __getitem__(self, name):
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name)
+
+    def __setitem__(self, name, value):
+        try:
+            setattr(self, name, value)
+        except AttributeError:
+            raise KeyError(name)
+
+    def __delitem__(self, name):
+        try:
+            delattr(self, name)
+        except AttributeError:
+            raise KeyError(name)
+
+    def __contains__(self, name):
+        return name in self._fields and hasattr(self, name)
+
+    def get(self, name, default=None):
+        return getattr(self, name, default)
+
+    def iteritems(self):
+        for name in self._fields:
+            try:
+                yield name, getattr(self, name)
+            except AttributeError:
+                pass
+
+    def iterkeys(self):
+        for name, value in self.iteritems():
+            yield name
+
+    def itervalues(self):
+        for name, value in self.iteritems():
+            yield value
+
+    def items(self):
+        return list(self.iteritems())
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def values(self):
+        return list(self.itervalues())
+
+    __iter__ = iterkeys
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__,
+                           ', '.join('%s=%r' % item
+                                     for item in self.iteritems()))
+
+    def __reduce__(self):
+        return (_unpickle, (self.__class__.__name__, self._fields,
+                            self.items()))
+
+    def to_dict(self, cls=None):
+        """Return the record as a ``jsontree``, or **cls**, converting
+        nested records (and lists of them) as well.
+        """
+        if cls is None:
+            import jsontree
+            cls = jsontree.jsontree
+        return cls((name, _plain(value, cls))
+                   for name, value in self.iteritems())
+
+    def to_json(self, **kwdargs):
+        """Serialize the record with ``jsontree.dumps``, which takes care of
+        the ``datetime`` values.
+        """
+        import jsontree
+        return jsontree.dumps(self.to_dict(), **kwdargs)
+
+def _plain(value, cls):
+    if isinstance(value, Record):
+        return value.to_dict(cls)
+    if isinstance(value, list):
+        return [_plain(item, cls) for item in value]
+    return value
+
+_classes = {}
+_classes_lock = threading.Lock()
+
+class LazyRecord(Record):
+    """Base class of the generated lazy record classes. Fields not read yet
+    are kept as their XML element in ``_raw`` and converted, by the
+    :py:class:`fborm.parse.CompiledTypemap` in ``_plan``, on first access.
+    """
+    __slots__ = ('_plan', '_raw')
+
+    def __getattr__(self, name):
+        ## only called for fields which have not been set yet
+        try:
+            raw = object.__getattribute__(self, '_raw')
+        except AttributeError:
+            raw = None
+        if not raw or name not in raw:
+            raise AttributeError("%r object has no attribute %r" %
+                                 (self.__class__.__name__, name))
+        value = self._plan.convert(name, raw[name], self)
+        ## drops the element from _raw as well
+        setattr(self, name, value)
+        return value
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        raw = getattr(self, '_raw', None)
+        if raw and name in raw:
+            del raw[name]
+
+    def __delattr__(self, name):
+        raw = getattr(self, '_raw', None)
+        if raw and name in raw:
+            del raw[name]
+            return
+        object.__delattr__(self, name)
+
+    def __contains__(self, name):
+        raw = getattr(self, '_raw', None)
+        return bool(raw and name in raw) or Record.__contains__(self, name)
+
+    def pending(self):
+        """The names of the fields which have not been converted yet.
+        """
+        return [name for name in self._fields
+                if name in (getattr(self, '_raw', None) or ())]
+
+def make_record_class(name, fields, base=Record):
+    """Return the **base** subclass called **name** with the given
+    **fields**. Classes are cached on the name, fields and base, so the same
+    class is returned for the same layout.
+    """
+    fields = tuple(str(field) for field in fields)
+    key = (name, fields, base)
+    with _classes_lock:
+        cls = _classes.get(key)
+        if cls is None:
+            cls = _classes[key] = type(str(name), (base,),
+                                       dict(__slots__=fields,
+                                            _fields=fields))
+        return cls
+
+def record_fields(fbtypemap):
+    """The field names a record for **fbtypemap** has, which are the
+    typemap keys that get extracted.
+    """
+    fbtypemap = getattr(fbtypemap, 'typemap', fbtypemap)
+    return tuple(name for name, conv in fbtypemap.iteritems()
+                 if not getattr(conv, 'ignore', False))
+
+def record_class(fbtypemap, name=None):
+    """Return the record class for **fbtypemap** . The class name defaults
+    to ``Record`` followed by a digest of the field names.
+
+    .. code:: python
+
+        Case = fborm.record_class(fborm.objects.fbBug, 'Case')
+    """
+    fields = record_fields(fbtypemap)
+    if name is None:
+        name = 'Record_%08x' % (hash(fields) & 0xffffffff)
+    return make_record_class(name, fields)
+
+def lazy_record_class(fbtypemap, name=None):
+    """Return the :py:class:`fborm.records.LazyRecord` class for
+    **fbtypemap** . The class name defaults to ``Lazy`` followed by a digest
+    of the field names.
+    """
+    fields = record_fields(fbtypemap)
+    if name is None:
+        name = 'Lazy_%08x' % (hash(fields) & 0xffffffff)
+    return make_record_class(name, fields, LazyRecord)
+
+def _unpickle(name, fields, items):
+    return make_record_class(name, fields)(items)
@@ -0,0 +1,374 @@
+""".. _resilience:
+
+==========================================
+Retries, Rate Limiting and Circuit Breaking
+==========================================
+
+A FogBugz server under load answers some requests with a 503, or drops
+the connection, and a batch job which raises on the first of those dies
+halfway. A :py:class:`fborm.resilience.Resilience` wraps the FogBugz
+instance so that every API command goes through
+
+* a :py:class:`fborm.resilience.TokenBucket` rate limiter, shared by all
+  the threads and sessions using it, which makes callers wait rather than
+  overload the server,
+* a :py:class:`fborm.resilience.CircuitBreaker` , which after repeated
+  failures fails every call at once with
+  :py:class:`fborm.resilience.CircuitOpenError` until the server had time
+  to recover, and
+* a :py:class:`fborm.resilience.RetryPolicy` , which retries transient
+  failures after an exponential backoff with jitter.
+
+.. code:: python
+
+    resilience = fborm.Resilience(
+        retry=fborm.RetryPolicy(attempts=5, base=0.5, cap=30),
+        limiter=fborm.TokenBucket(rate=20, burst=40),
+        breaker=fborm.CircuitBreaker(failures=10, reset_timeout=60))
+    fbo = fborm.FogBugzORM('https://hostname/', token,
+                           resilience=resilience)
+    ...
+    print resilience.stats()
+
+Only transient failures are retried: connection errors, timeouts, and the
+HTTP 429 and 5xx statuses, waiting at least as long as a ``Retry-After``
+header asks. FogBugz API errors, such as a case not existing, are not
+transient, unless their code is listed in **retry_codes** . Reads, the
+``search``, ``list*`` and ``view*`` commands and ``logon``, are always
+retried. Writes might have reached the server before the connection
+failed, and retrying ``new`` would then create the case twice, so they are
+only retried when named in **retry_writes**, or if it is ``True`` .
+
+The requests sent without FogBugzPy, by :py:func:`fborm.stream.raw_request`
+for :py:func:`fborm.stream.search_stream` and the **processes** option of
+:py:func:`fborm.commands.search`, go through the same policies, and so do
+the downloads of :py:class:`fborm.FogBugzORM`, as the ``download`` command.
+Only sending the request and receiving the response headers is retried,
+not reading the rest of the response.
+
+.. _fborm.resilience:
+
+fborm.resilience Module Documentation
+=====================================
+"""
+import httplib
+import random
+import socket
+import threading
+import time
+import urllib2
+import jsontree
+from . import pool
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the server while the circuit breaker is
+    open.
+    """
+
+def is_read(command):
+    """Whether the API **command** only reads, and is safe to retry.
+    """
+    return command.startswith(('search', 'list', 'view')) or \
+           command in ('logon', 'logoff', 'download')
+
+def resilience_of(fb):
+    """The :py:class:`Resilience` applied to the FogBugz instance **fb**,
+    looking through other wrappers such as
+    :py:class:`fborm.instrument.InstrumentedFogBugz`, or ``None`` .
+    Used by the code sending requests without the FogBugzPy command
+    handlers, such as :py:func:`fborm.stream.raw_request` .
+    """
+    while fb is not None:
+        if isinstance(fb, ResilientFogBugz):
+            return fb._resilience
+        ## FogBugzPy answers any other attribute with an API command
+        fb = getattr(fb, '__dict__', {}).get('_fb')
+    return None
+
+def _http_status(exception):
+    for error in (exception,) + tuple(getattr(exception, 'args', ())):
+        code = getattr(error, 'code', None)
+        if isinstance(code, (int, long)):
+            return code, error
+    return None, None
+
+class RetryPolicy(object):
+    """RetryPolicy(attempts=4, base=0.5, cap=30.0, retry_writes=(), \
+                   retry_codes=(), seed=None)
+
+    Try a command at most **attempts** times. Before retry ``n`` (from 0)
+    wait a random time up to ``min(cap, base * 2 ** n)`` seconds, the "full
+    jitter" backoff, which keeps clients from retrying in step.
+    """
+    def __init__(self, attempts=4, base=0.5, cap=30.0, retry_writes=(),
+                 retry_codes=(), seed=None):
+        if attempts < 1:
+            raise ValueError("'attempts' must be at least 1")
+        self.attempts = attempts
+        self.base = base
+        self.cap = cap
+        self.retry_writes = retry_writes
+        self.retry_codes = frozenset(str(code) for code in retry_codes)
+        self._random = random.Random(seed)
+
+    def retryable(self, command):
+        """Whether **command** may be retried at all.
+        """
+        if is_read(command) or self.retry_writes is True:
+            return True
+        return command in self.retry_writes
+
+    def transient(self, exception):
+        """Whether **exception** is worth retrying.
+        """
+        status, error = _http_status(exception)
+        if status is not None:
+            return status == 429 or status >= 500
+        if isinstance(exception, (socket.error, httplib.HTTPException,
+                                  urllib2.URLError)):
+            return True
+        message = str(exception)
+        if message.startswith('Error Code '):
+            return message[11:].split(':')[0] in self.retry_codes
+        ## FogBugzConnectionError wrapping a URLError, or a timeout
+        return exception.__class__.__name__ == 'FogBugzConnectionError'
+
+    def delay(self, retry, exception=None):
+        """The seconds to wait before retry number **retry** (from 0).
+        """
+        wait = self._random.uniform(0, min(self.cap,
+                                           self.base * 2 ** retry))
+        status, error = _http_status(exception)
+        headers = getattr(error, 'hdrs', None) or getattr(error, 'headers',
+                                                           None)
+        if status is not None and headers is not None:
+            try:
+                wait = max(wait, min(float(headers.get('Retry-After')),
+                                     self.cap))
+            except (TypeError, ValueError):
+                pass
+        return wait
+
+class TokenBucket(object):
+    """TokenBucket(rate, burst=None)
+
+    Thread-safe rate limiter allowing **rate** calls per second on average,
+    and bursts of up to **burst** calls, which defaults to **rate** .
+    """
+    def __init__(self, rate, burst=None):
+        if rate <= 0:
+            raise ValueError("'rate' must be positive")
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self._tokens = self.burst
+        self._stamp = time.time()
+        self._lock = threading.Lock()
+        self.throttled = 0
+        self.waited = 0.0
+
+    def acquire(self):
+        """Take a token, waiting for one if there is none. Returns the
+        seconds waited.
+        """
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.burst, self._tokens +
+                               (now - self._stamp) * self.rate)
+            self._stamp = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            ## the token is reserved, so later callers queue behind this one
+            wait = -self._tokens / self.rate
+            self.throttled += 1
+            self.waited += wait
+        time.sleep(wait)
+        return wait
+
+class CircuitBreaker(object):
+    """CircuitBreaker(failures=5, reset_timeout=30.0)
+
+    Opens after **failures** transient failures in a row. While open every
+    call fails at once. After **reset_timeout** seconds one trial call is
+    let through: if it succeeds the breaker closes, otherwise it stays open
+    for another **reset_timeout** .
+    """
+    closed, open, half_open = 'closed', 'open', 'half-open'
+
+    def __init__(self, failures=5, reset_timeout=30.0):
+        if failures < 1:
+            raise ValueError("'failures' must be at least 1")
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self.state = self.closed
+        self._failed = 0
+        self._opened = 0.0
+        self._lock = threading.Lock()
+        self.opens = 0
+        self.rejected = 0
+
+    def before(self):
+        """Raise :py:class:`CircuitOpenError` if the call may not go ahead.
+        """
+        with self._lock:
+            if self.state == self.closed:
+                return
+            if (self.state == self.open and
+                time.time() - self._opened >= self.reset_timeout):
+                self.state = self.half_open
+                return
+            self.rejected += 1
+            raise CircuitOpenError(
+                'FogBugz server unavailable, retrying in %.0f seconds' % max(
+                    self.reset_timeout - (time.time() - self._opened), 0))
+
+    def success(self):
+        with self._lock:
+            self._failed = 0
+            self.state = self.closed
+
+    def failure(self):
+        with self._lock:
+            self._failed += 1
+            if (self.state == self.half_open or
+                (self.state == self.closed and
+                 self._failed >= self.failures)):
+                if self.state != self.open:
+                    self.opens += 1
+                self.state = self.open
+                self._opened = time.time()
+
+class Resilience(object):
+    """Resilience(retry=None, limiter=None, breaker=None)
+
+    The policies applied to every API command of the FogBugz instances it
+    wraps. **retry** defaults to a :py:class:`RetryPolicy` with its
+    defaults; pass ``False`` to disable retries. **limiter** and
+    **breaker** are off unless given. One instance can be shared by any
+    number of sessions and threads.
+    """
+    def __init__(self, retry=None, limiter=None, breaker=None):
+        if retry is None:
+            retry = RetryPolicy()
+        elif retry is False:
+            retry = RetryPolicy(attempts=1)
+        self.retry = retry
+        self.limiter = limiter
+        self.breaker = breaker
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self._calls = 0
+        self._retries = 0
+        self._recovered = 0
+        self._giveups = 0
+        self._sleep = 0.0
+
+    def wrap(self, fb):
+        """Return a :py:class:`ResilientFogBugz` for the FogBugz instance
+        **fb** .
+        """
+        if isinstance(fb, ResilientFogBugz):
+            return fb
+        return ResilientFogBugz(fb, self)
+
+    def _count(self, name, value=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    def call(self, command, func, *args, **kwdargs):
+        """Call ``func(*args, **kwdargs)`` as the API command **command**,
+        applying the policies.
+        """
+        self._count('_calls')
+        retry = self.retry
+        retryable = retry.attempts > 1 and retry.retryable(command)
+        attempt = 0
+        while True:
+            if self.limiter is not None:
+                self.limiter.acquire()
+            if self.breaker is not None:
+                self.breaker.before()
+            try:
+                res = func(*args, **kwdargs)
+            except Exception, e:
+                transient = retry.transient(e)
+                if transient and self.breaker is not None:
+                    self.breaker.failure()
+                elif self.breaker is not None:
+                    ## the server answered, so it is up
+                    self.breaker.success()
+                if (not transient or not retryable or
+                    attempt + 1 >= retry.attempts):
+                    if transient and retryable:
+                        self._count('_giveups')
+                    raise
+                delay = retry.delay(attempt, e)
+                self._count('_retries')
+                self._count('_sleep', delay)
+                time.sleep(delay)
+                attempt += 1
+                continue
+            if self.breaker is not None:
+                self.breaker.success()
+            if attempt:
+                self._count('_recovered')
+            return res
+
+    def stats(self):
+        """Return a ``jsontree`` with the API ``calls`` made, the
+        ``retries`` done, the calls which succeeded after a retry as
+        ``recovered``, and those which ran out of attempts as ``giveups``,
+        the seconds slept by the backoff as ``backoff``, the calls the
+        limiter ``throttled`` and the seconds it made them wait as
+        ``throttle_wait``, and the ``breaker`` state with how often it
+        ``opens`` and the calls it ``rejected`` .
+        """
+        with self._lock:
+            res = jsontree.jsontree(
+                calls=self._calls, retries=self._retries,
+                recovered=self._recovered, giveups=self._giveups,
+                backoff=self._sleep, throttled=0, throttle_wait=0.0)
+        if self.limiter is not None:
+            res.throttled = self.limiter.throttled
+            res.throttle_wait = self.limiter.waited
+        if self.breaker is not None:
+            res.breaker = jsontree.jsontree(state=self.breaker.state,
+                                            opens=self.breaker.opens,
+                                            rejected=self.breaker.rejected)
+        return res
+
+class ResilientFogBugz(object):
+    """ResilientFogBugz(fb, resilience)
+
+    Wrapper around the ``fogbugz.FogBugz`` instance **fb** sending every API
+    command through **resilience**, made with :py:meth:`Resilience.wrap` .
+    It can be used anywhere the FogBugz instance can, including
+    :py:func:`fborm.pool.clone_session` .
+    """
+    def __init__(self, fb, resilience):
+        object.__setattr__(self, '_fb', fb)
+        object.__setattr__(self, '_resilience', resilience)
+        object.__setattr__(self, '_handlers', {})
+
+    def clone_session(self):
+        return ResilientFogBugz(pool.clone_session(self._fb),
+                                self._resilience)
+
+    def __getattr__(self, name):
+        if (name.startswith('_') or
+            (hasattr(self._fb.__class__, name) and
+             name not in ('logon', 'logoff'))):
+            return getattr(self._fb, name)
+        handler = self._handlers.get(name)
+        if handler is None:
+            func = getattr(self._fb, name)
+            call = self._resilience.call
+            def handler(*args, **kwdargs):
+                return call(name, func, *args, **kwdargs)
+            self._handlers[name] = handler
+        return handler
+
+    def __setattr__(self, name, value):
+        setattr(self._fb, name, value)
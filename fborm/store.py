@@ -0,0 +1,639 @@
+""".. _store:
+
+==========================================
+Local Case Stores
+==========================================
+
+A case store keeps a local copy of cases, keyed by ``ixBug``, together
+with a small ``state`` dictionary that :py:class:`fborm.sync.CaseSync`
+uses for its high-water mark. Any object with the methods of
+:py:class:`fborm.store.DictStore` can be used as a store.
+
+:py:class:`fborm.store.DictStore` holds the cases in a dictionary, and
+if given a **filename** pickles the cases and the state to it on
+:py:meth:`DictStore.commit` , so the next run carries on where the last one
+stopped:
+
+.. code:: python
+
+    store = fborm.DictStore('/var/lib/mirror/cases.pickle')
+    print len(store), store.get(1234)
+
+:py:class:`fborm.store.SQLiteStore` keeps the cases in an SQLite database
+whose tables are derived from a typemap: one column per field, and a child
+table per list field, such as the events of a case and the attachments of
+an event. Writes are batched into one transaction per **batch_size**
+cases, and the common report queries are answered from indexes:
+
+.. code:: python
+
+    casetype = dict(fborm.objects.fbBug_withEvents, tags=fborm.types.fbtags)
+    store = fborm.SQLiteStore('/var/lib/mirror/cases.db', casetype)
+    fbo.sync(store, casetype=casetype)
+    mine = store.find(ixPersonAssignedTo=12, fOpen=True)
+    late = store.select('dtLastUpdated < ?', ['2013-01-01T00:00:00Z'])
+    tagged = store.tagged('customer')
+
+.. _fborm.store:
+
+fborm.store Module Documentation
+================================
+"""
+import copy_reg
+import cPickle
+import functools
+import json
+import os
+import tempfile
+import threading
+import jsontree
+from . import columnar
+from . import objects
+from . import parse
+from . import sync
+from . import types
+from . import util
+
+def _reduce_jsontree(tree):
+    return jsontree.jsontree, (), None, None, tree.iteritems()
+
+## jsontree passes its own class to defaultdict, so the defaultdict pickle
+## support re-creates it with one argument too many
+copy_reg.pickle(jsontree.jsontree, _reduce_jsontree)
+
+class DictStore(object):
+    """DictStore(filename=None)
+
+    In memory case store, saved to and loaded from **filename** if given.
+    Cases are stored as they are given, and can be any of the objects
+    returned by :py:func:`fborm.commands.search` .
+    """
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.cases = {}
+        self.state = {}
+        self._lock = threading.RLock()
+        if filename and os.path.exists(filename):
+            with open(filename, 'rb') as fh:
+                data = cPickle.load(fh)
+            self.cases = data['cases']
+            self.state = data['state']
+
+    def get(self, ixBug, default=None):
+        """The stored case **ixBug**, or **default** .
+        """
+        return self.cases.get(ixBug, default)
+
+    def marks(self, ixBugs):
+        """Return a dictionary of the stored cases among **ixBugs** to a
+        dictionary of their :py:data:`fborm.sync.marktype` fields, which is
+        all :py:class:`fborm.sync.CaseSync` needs to know which cases
+        changed. A store without this method is read with :py:meth:`get` .
+        """
+        res = {}
+        with self._lock:
+            for ixBug in ixBugs:
+                case = self.cases.get(ixBug)
+                if case is not None:
+                    res[ixBug] = dict((name, case.get(name))
+                                      for name in sync.marktype)
+        return res
+
+    def upsert(self, cases):
+        """Store **cases**, replacing the stored cases with the same
+        ``ixBug`` . Returns the number of cases stored.
+        """
+        count = 0
+        with self._lock:
+            for case in cases:
+                self.cases[case['ixBug']] = case
+                count += 1
+        return count
+
+    def delete(self, ixBugs):
+        """Remove the cases numbered **ixBugs**, if stored.
+        """
+        with self._lock:
+            for ixBug in ixBugs:
+                self.cases.pop(ixBug, None)
+
+    def get_state(self):
+        """A copy of the state dictionary.
+        """
+        with self._lock:
+            return dict(self.state)
+
+    def set_state(self, state):
+        """Replace the state dictionary, which should only hold strings and
+        numbers.
+        """
+        with self._lock:
+            self.state = dict(state)
+
+    def commit(self):
+        """Save the cases and the state to **filename**, if given. The file
+        is written under another name and then renamed, so a crash leaves
+        the previous copy intact.
+        """
+        if not self.filename:
+            return
+        with self._lock:
+            dirname = os.path.dirname(os.path.abspath(self.filename))
+            fd, tmpname = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as fh:
+                    cPickle.dump(dict(cases=self.cases, state=self.state),
+                                 fh, cPickle.HIGHEST_PROTOCOL)
+                if os.name == 'nt' and os.path.exists(self.filename):
+                    os.remove(self.filename)
+                os.rename(tmpname, self.filename)
+            except:
+                if os.path.exists(tmpname):
+                    os.remove(tmpname)
+                raise
+
+    def close(self):
+        self.commit()
+
+    def __contains__(self, ixBug):
+        return ixBug in self.cases
+
+    def __len__(self):
+        return len(self.cases)
+
+    def __iter__(self):
+        """Iterate over the stored cases, in ``ixBug`` order.
+        """
+        with self._lock:
+            cases = [self.cases[ixBug] for ixBug in sorted(self.cases)]
+        return iter(cases)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+indexed = ('ixProject', 'ixArea', 'ixPersonAssignedTo', 'ixFixFor',
+           'ixStatus', 'ixCategory', 'ixPriority', 'fOpen', 'dtLastUpdated')
+"""The columns :py:class:`SQLiteStore` indexes by default, when the typemap
+has them."""
+
+def _utf8(value):
+    if isinstance(value, str):
+        return value.decode('utf-8')
+    return value
+
+def _int(value):
+    return None if value is None else int(bool(value))
+
+def _bool(value):
+    return None if value is None else bool(value)
+
+def _dt2sql(value):
+    return parse._dt2fbdt(value) if value else None
+
+def _sql2dt(value):
+    return types.parse_fbdatetime(value) if value else ''
+
+_sqltypes = {
+    types.fbint:        ('INTEGER', None, None),
+    types.fbbool:       ('INTEGER', _int, _bool),
+    types.fbfloat:      ('REAL', None, None),
+    types.fbdatetime:   ('TEXT', _dt2sql, _sql2dt),
+    types.fbstring:     ('TEXT', _utf8, None),
+}
+
+def _scalar(conv):
+    """``(sqltype, to_sql, from_sql)`` for a scalar converter, storing
+    anything unknown as text.
+    """
+    return _sqltypes.get(conv, ('TEXT', _utf8, None))
+
+def _classify(conv):
+    """Return ``(kind, conv, first)``, where kind is ``'table'`` for a list
+    of objects, with **conv** the typemap, ``'list'`` for a list of values,
+    ``'comma'`` for a comma separated list, ``'column'`` for a single value,
+    or ``None`` for a field which is never extracted.
+    """
+    if getattr(conv, 'ignore', False):
+        return None, None, False
+    typemap = getattr(conv, 'typemap', None)
+    if isinstance(typemap, dict):
+        return 'table', typemap, getattr(conv, 'first', False)
+    base = columnar._base(conv)
+    while isinstance(base, functools.partial) and base.args:
+        name = getattr(base.func, '__name__', '')
+        if name == '_listof':
+            return 'list', columnar._base(base.args[0]), False
+        if name == '_fbcommalistof':
+            return 'comma', columnar._base(base.args[0]), False
+        if name not in ('getattr', '_conditional', 'firstelem'):
+            break
+        base = columnar._base(base.args[0])
+    return 'column', base, False
+
+def _comma(elem):
+    def to_sql(values):
+        if values is None:
+            return None
+        return u','.join(_utf8(parse.fbsetconvert(value))
+                         for value in values)
+    def from_sql(value):
+        return [elem(types._obj(text=item))
+                for item in util.comma_or_space_split(value or '')]
+    return to_sql, from_sql
+
+class _Table(object):
+    """One table of an :py:class:`SQLiteStore`, holding the fields of
+    **typemap** . Child tables have an ``_id`` key, a ``_parent`` column
+    holding the key of the parent row, and an ``_ord`` column keeping the
+    order of the list.
+    """
+    def __init__(self, name, typemap, key=None, first=False):
+        self.name = name
+        self.key = key
+        self.first = first
+        self.columns = []
+        self.children = []
+        for field, conv in sorted(typemap.iteritems()):
+            kind, conv, childfirst = _classify(conv)
+            if kind == 'table':
+                self.children.append((field, _Table(
+                    '%s_%s' % (name, field), conv, first=childfirst)))
+            elif kind == 'list':
+                child = _Table('%s_%s' % (name, field), {})
+                child.columns.append(('value',) + _scalar(conv))
+                child.scalar = True
+                self.children.append((field, child))
+            elif kind == 'comma':
+                self.columns.append((field, 'TEXT') + _comma(conv))
+            elif kind == 'column':
+                self.columns.append((field,) + _scalar(conv))
+        self.scalar = False
+
+    def tables(self):
+        yield self
+        for field, child in self.children:
+            for table in child.tables():
+                yield table
+
+    def create(self, conn):
+        if self.key:
+            head = ['"%s" INTEGER PRIMARY KEY' % self.key]
+        else:
+            head = ['_id INTEGER PRIMARY KEY', '_parent INTEGER NOT NULL',
+                    '_ord INTEGER NOT NULL']
+        columns = [(name, sqltype) for name, sqltype, to_sql, from_sql
+                   in self.columns if name != self.key]
+        conn.execute('CREATE TABLE IF NOT EXISTS "%s" (%s)' % (
+            self.name, ', '.join(head + ['"%s" %s' % column
+                                         for column in columns])))
+        existing = set(row[1] for row in
+                       conn.execute('PRAGMA table_info("%s")' % self.name))
+        for name, sqltype in columns:
+            if name not in existing:
+                conn.execute('ALTER TABLE "%s" ADD COLUMN "%s" %s' % (
+                    self.name, name, sqltype))
+        if not self.key:
+            conn.execute('CREATE INDEX IF NOT EXISTS "%s__parent" '
+                         'ON "%s" (_parent, _ord)' % (self.name, self.name))
+        for field, child in self.children:
+            child.create(conn)
+        names = [name for name, sqltype, to_sql, from_sql in self.columns]
+        head = [] if self.key else ['_id', '_parent', '_ord']
+        self.insert = 'INSERT OR REPLACE INTO "%s" (%s) VALUES (%s)' % (
+            self.name, ', '.join('"%s"' % name for name in head + names),
+            ', '.join('?' * (len(head) + len(names))))
+        self.select = 'SELECT %s FROM "%s"' % (
+            ', '.join('"%s"' % name for name in head + names), self.name)
+
+    def rows(self, obj, rows, ids, parent=None, ord=0):
+        """Add the rows for **obj** and its children to **rows**, by table
+        name, taking new child keys from **ids** .
+        """
+        if self.scalar:
+            to_sql = self.columns[0][2]
+            values = [obj if to_sql is None else to_sql(obj)]
+        else:
+            get = obj.get
+            values = [get(name) if to_sql is None else to_sql(get(name))
+                      for name, sqltype, to_sql, from_sql in self.columns]
+        if self.key:
+            key = get(self.key)
+        else:
+            key = ids[self.name] = ids[self.name] + 1
+            values[:0] = [key, parent, ord]
+        rows[self.name].append(values)
+        if self.scalar:
+            return
+        for field, child in self.children:
+            items = get(field)
+            if items is None:
+                continue
+            if child.first or isinstance(items, dict):
+                items = [items]
+            for index, item in enumerate(items):
+                if item is not None:
+                    child.rows(item, rows, ids, key, index)
+
+    def delete(self, conn, keys):
+        """Delete the children of the rows with **keys** .
+        """
+        for field, child in self.children:
+            child._delete(conn, 'IN (%s)' % ', '.join('?' * len(keys)),
+                          keys)
+
+    def _delete(self, conn, where, params):
+        nested = 'IN (SELECT _id FROM "%s" WHERE _parent %s)' % (
+            self.name, where)
+        for field, child in self.children:
+            child._delete(conn, nested, params)
+        conn.execute('DELETE FROM "%s" WHERE _parent %s' % (self.name, where),
+                     params)
+
+    def load(self, conn, rows):
+        """Turn **rows** of this table into ``jsontree`` objects, loading
+        their children. Returns ``(key, object)`` pairs.
+        """
+        offset = 0 if self.key else 3
+        names = [(index + offset, name, from_sql) for index, (
+            name, sqltype, to_sql, from_sql) in enumerate(self.columns)]
+        res = []
+        for row in rows:
+            if self.scalar:
+                value = row[3]
+                from_sql = self.columns[0][3]
+                obj = value if from_sql is None else from_sql(value)
+            else:
+                obj = jsontree.jsontree()
+                for index, name, from_sql in names:
+                    value = row[index]
+                    obj[name] = value if from_sql is None else \
+                                from_sql(value)
+            if self.key:
+                res.append((obj[self.key], obj, None))
+            else:
+                res.append((row[0], obj, row[1]))
+        if self.children and res:
+            byparent = dict((key, obj) for key, obj, parent in res)
+            keys = list(byparent)
+            for field, child in self.children:
+                for obj in byparent.itervalues():
+                    obj[field] = None if child.first else []
+                for start in xrange(0, len(keys), 500):
+                    chunk = keys[start:start + 500]
+                    found = child.load(conn, conn.execute(
+                        '%s WHERE _parent IN (%s) ORDER BY _parent, _ord' % (
+                            child.select, ', '.join('?' * len(chunk))),
+                        chunk))
+                    for key, obj, parent in found:
+                        if child.first:
+                            byparent[parent][field] = obj
+                        else:
+                            byparent[parent][field].append(obj)
+        return res
+
+class SQLiteStore(object):
+    """SQLiteStore(filename=':memory:', typemap=fborm.objects.fbBug, \
+                   table='cases', batch_size=500, indexes=indexed)
+
+    Case store in the SQLite database **filename**, with the tables derived
+    from **typemap**, which always gets the fields of
+    :py:data:`fborm.sync.marktype` added. The cases are kept in **table**,
+    and each list field in its own table named ``<table>_<field>`` .
+
+    Integers and booleans are stored as ``INTEGER``, floats as ``REAL``,
+    strings and dates as ``TEXT``, the dates in the FogBugz ISO format so
+    that they sort, and comma separated lists as ``TEXT`` . The columns of
+    **table** named in **indexes** are indexed. Cases read back are
+    ``jsontree`` objects, the same as :py:func:`fborm.commands.search`
+    returns by default.
+
+    Opening an existing database with a typemap which has more fields adds
+    the new columns; a column is never dropped.
+    """
+    def __init__(self, filename=':memory:', typemap=objects.fbBug,
+                 table='cases', batch_size=500, indexes=indexed):
+        import sqlite3
+        if batch_size < 1:
+            raise ValueError("'batch_size' must be at least 1")
+        typemap = dict(typemap)
+        for name, conv in sync.marktype.iteritems():
+            typemap.setdefault(name, conv)
+        self.filename = filename
+        self.typemap = typemap
+        self.batch_size = batch_size
+        self.root = _Table(table, typemap, key='ixBug')
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        self.conn.text_factory = str
+        self._lock = threading.RLock()
+        self._columns = dict((column[0], column) for column in
+                             self.root.columns)
+        with self._lock, self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS "_state" '
+                              '(key TEXT PRIMARY KEY, value TEXT)')
+            self.root.create(self.conn)
+            for name in indexes:
+                if name in self._columns:
+                    self.conn.execute(
+                        'CREATE INDEX IF NOT EXISTS "%s_%s" ON "%s" ("%s")'
+                        % (table, name, table, name))
+
+    ## Writing
+
+    def upsert(self, cases):
+        """Store **cases**, replacing the stored cases with the same
+        ``ixBug`` along with all their child rows. Each batch of
+        **batch_size** cases is one transaction. Returns the number of cases
+        stored.
+        """
+        count = 0
+        batch = []
+        for case in cases:
+            batch.append(case)
+            if len(batch) >= self.batch_size:
+                count += self._upsert(batch)
+                batch = []
+        if batch:
+            count += self._upsert(batch)
+        return count
+
+    def _upsert(self, cases):
+        tables = list(self.root.tables())
+        with self._lock, self.conn:
+            conn = self.conn
+            keys = [case.get('ixBug') for case in cases]
+            self.root.delete(conn, keys)
+            ids = dict((table.name, conn.execute(
+                'SELECT MAX(_id) FROM "%s"' % table.name).fetchone()[0] or 0)
+                       for table in tables if not table.key)
+            rows = dict((table.name, []) for table in tables)
+            for case in cases:
+                self.root.rows(case, rows, ids)
+            for table in tables:
+                if rows[table.name]:
+                    conn.executemany(table.insert, rows[table.name])
+        return len(cases)
+
+    def delete(self, ixBugs):
+        """Remove the cases numbered **ixBugs**, if stored.
+        """
+        ixBugs = list(ixBugs)
+        with self._lock, self.conn:
+            for start in xrange(0, len(ixBugs), 500):
+                keys = ixBugs[start:start + 500]
+                self.root.delete(self.conn, keys)
+                self.conn.execute(
+                    'DELETE FROM "%s" WHERE ixBug IN (%s)' % (
+                        self.root.name, ', '.join('?' * len(keys))), keys)
+
+    def get_state(self):
+        """A copy of the state dictionary.
+        """
+        with self._lock:
+            return dict((key, json.loads(value)) for key, value in
+                        self.conn.execute('SELECT key, value FROM "_state"'))
+
+    def set_state(self, state):
+        """Replace the state dictionary, whose values must be JSON
+        serializable.
+        """
+        with self._lock, self.conn:
+            self.conn.execute('DELETE FROM "_state"')
+            self.conn.executemany(
+                'INSERT INTO "_state" (key, value) VALUES (?, ?)',
+                [(key, json.dumps(value)) for key, value in
+                 state.iteritems()])
+
+    def commit(self):
+        with self._lock:
+            self.conn.commit()
+
+    def close(self):
+        with self._lock:
+            self.conn.commit()
+            self.conn.close()
+
+    ## Reading
+
+    def select(self, where=None, params=(), order_by='ixBug', limit=None,
+               children=True):
+        """Return the cases matching the SQL condition **where** on the
+        case table, with **params** for its ``?`` placeholders, sorted by
+        the SQL **order_by** . With **children** false the list fields are
+        not loaded, which is much faster when only the columns are needed.
+        """
+        sql = self.root.select
+        if where:
+            sql += ' WHERE ' + where
+        if order_by:
+            sql += ' ORDER BY ' + order_by
+        if limit is not None:
+            sql += ' LIMIT %d' % limit
+        with self._lock:
+            rows = self.conn.execute(sql, list(params)).fetchall()
+            if children:
+                return [obj for key, obj, parent in
+                        self.root.load(self.conn, rows)]
+            children, self.root.children = self.root.children, []
+            try:
+                return [obj for key, obj, parent in
+                        self.root.load(self.conn, rows)]
+            finally:
+                self.root.children = children
+
+    def _where(self, equals):
+        terms = []
+        params = []
+        for name, value in sorted(equals.iteritems()):
+            if name not in self._columns:
+                raise ValueError("'%s' is not a column of the store" % name)
+            to_sql = self._columns[name][2]
+            if to_sql is not None:
+                value = to_sql(value)
+            if value is None:
+                terms.append('"%s" IS NULL' % name)
+            else:
+                terms.append('"%s" = ?' % name)
+                params.append(value)
+        return ' AND '.join(terms), params
+
+    def find(self, order_by='ixBug', limit=None, children=True, **equals):
+        """Return the cases whose columns equal the keyword arguments, such
+        as ``find(ixProject=3, fOpen=True)`` .
+        """
+        where, params = self._where(equals)
+        return self.select(where, params, order_by, limit, children)
+
+    def count(self, **equals):
+        """The number of cases whose columns equal the keyword arguments.
+        """
+        where, params = self._where(equals)
+        sql = 'SELECT COUNT(*) FROM "%s"' % self.root.name
+        if where:
+            sql += ' WHERE ' + where
+        with self._lock:
+            return self.conn.execute(sql, params).fetchone()[0]
+
+    def tagged(self, tag, field='tags', **kwdargs):
+        """Return the cases with **tag** in the list field **field**, such
+        as a ``tags`` field of :py:data:`fborm.types.fbtags` . Raises
+        ``ValueError`` if the typemap has no such list field.
+        """
+        if not any(name == field and child.scalar
+                   for name, child in self.root.children):
+            raise ValueError('%r is not a list field of the typemap' %
+                             (field,))
+        return self.select('ixBug IN (SELECT _parent FROM "%s_%s" '
+                           'WHERE value = ?)' % (self.root.name, field),
+                           [_utf8(tag)], **kwdargs)
+
+    def get(self, ixBug, default=None):
+        """The stored case **ixBug**, or **default** .
+        """
+        found = self.select('ixBug = ?', [ixBug])
+        return found[0] if found else default
+
+    def marks(self, ixBugs):
+        """Return a dictionary of the stored cases among **ixBugs** to a
+        dictionary of their :py:data:`fborm.sync.marktype` fields, read
+        without loading the cases or their child rows.
+        """
+        columns = [self._columns[name] for name in sorted(sync.marktype)]
+        sql = 'SELECT %s FROM "%s" WHERE ixBug IN (%%s)' % (
+            ', '.join('"%s"' % column[0] for column in columns),
+            self.root.name)
+        ixBugs = list(ixBugs)
+        res = {}
+        with self._lock:
+            for start in xrange(0, len(ixBugs), 500):
+                keys = ixBugs[start:start + 500]
+                for row in self.conn.execute(
+                        sql % ', '.join('?' * len(keys)), keys):
+                    mark = dict(
+                        (name, value if from_sql is None else from_sql(value))
+                        for (name, sqltype, to_sql, from_sql), value
+                        in zip(columns, row))
+                    res[mark['ixBug']] = mark
+        return res
+
+    def __contains__(self, ixBug):
+        with self._lock:
+            return self.conn.execute(
+                'SELECT 1 FROM "%s" WHERE ixBug = ?' % self.root.name,
+                [ixBug]).fetchone() is not None
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        """Iterate over the stored cases, in ``ixBug`` order.
+        """
+        return iter(self.select())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
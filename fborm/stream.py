@@ -0,0 +1,179 @@
+""".. _stream:
+
+==========================================
+Streaming XML API Parsing
+==========================================
+
+FogBugzPy parses every response into a complete BeautifulSoup tree before
+handing it back, and :py:func:`fborm.parse.extract_all` then builds the
+converted objects next to it. For searches returning many cases, especially
+with the ``events`` column, that means the whole response is held in memory
+twice.
+
+The functions here bypass the BeautifulSoup step. The raw response is fed
+through the `lxml`_ incremental parser, and each item is converted with the
+usual typemap as soon as its closing tag is seen. The element is then
+dropped from the partial tree, so memory use stays flat no matter how many
+cases or events are returned.
+
+.. code:: python
+
+    for case in fborm.search_stream(fb, fborm.objects.fbBug_withEvents,
+                                    q='project:"Big One"'):
+        archive(case)
+
+`lxml`_ is only needed if you use this module.
+
+.. _lxml: http://lxml.de/
+
+.. _fborm.stream:
+
+fborm.stream Module Documentation
+====================================
+"""
+import sys
+import fogbugz
+from . import objects
+from . import parse
+from . import projection
+from . import resilience
+
+class _node(object):
+    """Wrap an ``lxml`` element with the small part of the BeautifulSoup
+    ``Tag`` interface the type converters use: ``text``, ``name``,
+    ``get()``, ``find()`` and iterating over child elements.
+    """
+    __slots__ = ('elem',)
+
+    def __init__(self, elem):
+        self.elem = elem
+
+    @property
+    def name(self):
+        return self.elem.tag
+
+    @property
+    def text(self):
+        if len(self.elem):
+            return u''.join(self.elem.itertext())
+        text = self.elem.text
+        if text == '':
+            ## an empty CDATA section, parsed with strip_cdata=False;
+            ## BeautifulSoup reads those as a single space
+            return u' '
+        return text or u''
+
+    def get(self, name, default=None):
+        return self.elem.get(name, default)
+
+    def find(self, name):
+        found = self.elem.find('.//' + name)
+        if found is None:
+            return None
+        return _node(found)
+
+    @property
+    def children(self):
+        for child in self.elem:
+            if isinstance(child.tag, basestring):
+                yield _node(child)
+
+    @property
+    def descendants(self):
+        for child in self.elem.iterdescendants():
+            if isinstance(child.tag, basestring):
+                yield _node(child)
+
+    def __iter__(self):
+        return self.children
+
+    def __len__(self):
+        return len(self.elem)
+
+def raw_request(fb, cmd, **kwargs):
+    """raw_request(fb, cmd, **kwargs)
+
+    Send the API command **cmd** the same way FogBugzPy does, using the
+    token, URL and opener of the ``fogbugz.FogBugz`` instance **fb**, but
+    return the open response stream instead of parsing it.
+    The caller is responsible for closing the stream. If **fb** is wrapped
+    by a :py:class:`fborm.resilience.Resilience` the request is sent
+    through it.
+    """
+    import urllib2
+    kwargs['cmd'] = cmd
+    if fb._token:
+        kwargs['token'] = fb._token
+    files = kwargs.pop('Files', {})
+    content_type, body = fb._FogBugz__encode_multipart_formdata(kwargs, files)
+    headers = {'Content-Type': content_type,
+               'Content-Length': str(len(body))}
+    url = fb._url
+    if isinstance(url, unicode):
+        url = url.encode('utf-8')
+    start = body.tell() if hasattr(body, 'seek') else None
+    def send():
+        if start is not None:
+            body.seek(start)
+        try:
+            return fb._opener.open(urllib2.Request(url, body, headers))
+        except urllib2.URLError:
+            raise fogbugz.FogBugzConnectionError(sys.exc_info()[1])
+    policy = resilience.resilience_of(fb)
+    if policy is None:
+        return send()
+    return policy.call(cmd, send)
+
+def iterextract(stream, tag, fbtypemap, namemap={}):
+    """iterextract(stream, tag, fbtypemap, namemap={})
+
+    Generator converting every **tag** element in the XML **stream** with
+    **fbtypemap** as soon as it has been read, then discarding it.
+    An ``<error>`` response is raised as ``fogbugz.FogBugzAPIError``
+    just like FogBugzPy does.
+
+    .. code:: python
+
+        stream = raw_request(fb, 'listPeople')
+        for person in iterextract(stream, 'person', fborm.objects.fbPerson):
+            print person.sFullName
+    """
+    from lxml import etree
+    plan = parse.compile_typemap(fbtypemap, namemap)
+    for event, elem in etree.iterparse(stream, events=('end',),
+                                       tag=(tag, 'error'),
+                                       strip_cdata=False):
+        if elem.tag == 'error':
+            raise fogbugz.FogBugzAPIError(
+                'Error Code %s: %s' % (elem.get('code'), elem.text))
+        item = plan.extract(_node(elem))
+        ## drop the element and everything already converted before it,
+        ## otherwise the partial tree still grows with the response.
+        elem.clear()
+        parent = elem.getparent()
+        while elem.getprevious() is not None:
+            del parent[0]
+        yield item
+
+def search_stream(fb, casetype=objects.fbBug, q=None, namemap={},
+                  fields=None, **args):
+    """search_stream(fb, casetype=fborm.objects.fbBug, q=None, \
+                     namemap={}, fields=None, **args)
+
+    Generator version of :py:func:`fborm.commands.search` which yields the
+    cases one at a time as they are parsed from the response. There is no
+    ``sort_by`` argument as that would need every case in memory; the
+    cases are yielded in the order the server returns them.
+    """
+    if fields is not None:
+        casetype = projection.project(casetype, fields)
+    if 'cols' not in args:
+        args['cols'] = parse.keys2cols(casetype, namemap)
+    if q is not None:
+        args['q'] = q
+    stream = raw_request(fb, 'search', **args)
+    try:
+        for case in iterextract(stream, 'case', casetype, namemap):
+            yield case
+    finally:
+        stream.close()
@@ -0,0 +1,269 @@
+""".. _sync:
+
+==========================================
+Incremental Case Sync
+==========================================
+
+Mirroring cases by searching for all of them on every run costs the same
+however little has changed. A :py:class:`fborm.sync.CaseSync` keeps a
+high-water mark in the state of its store (see :py:mod:`fborm.store`): the
+latest ``dtLastUpdated`` and the highest ``ixBugEventLatest`` seen. Each
+run then
+
+#. searches for the cases edited since the mark, asking only for the
+   ``ixBug``, ``ixBugEventLatest``, ``dtLastUpdated`` and ``fOpen``
+   columns,
+#. drops the cases whose latest event is the one already stored, reading
+   only those columns of the stored cases (see
+   :py:meth:`fborm.store.SQLiteStore.marks`),
+#. fetches the remaining cases with the full **casetype**, in pages of
+   **page_size**, and stores them,
+#. moves the mark forward, and commits the store.
+
+So a run costs one cheap search plus the cases which actually changed.
+
+.. code:: python
+
+    store = fborm.DictStore('/var/lib/mirror/cases.pickle')
+    res = fbo.sync(store, casetype=fborm.objects.fbBug_withEvents,
+                   q='project:"Big One"')
+    for case in res.created + res.updated:
+        reindex(case)
+    for case in res.closed:
+        archive(case)
+
+The search goes back **overlap** seconds before the mark, one day by
+default. FogBugz reads the dates in a search in the time zone of the
+logged on user while ``dtLastUpdated`` is in UTC, and the overlap covers
+the difference; the cases it brings back again are dropped in the second
+step. The first run, without a mark, fetches the cases matched by
+**initial**, the open cases by default, as well as **q** .
+
+Event Histories
+---------------
+
+Long-lived cases have thousands of events, and a script auditing them
+reads the same history again every day for a few new events. A
+:py:class:`fborm.sync.EventSync` keeps the events of every case in its
+store, and on each run only converts the events newer than the stored
+``ixBugEventLatest`` of the changed cases, appending them to the stored
+list. Cases without new events are not fetched at all.
+
+.. code:: python
+
+    store = fborm.SQLiteStore('/var/lib/audit/history.db',
+                              typemap=fborm.historytype())
+    res = fbo.sync_events(store, q='project:"Big One"', initial='')
+    print res.events, 'new events in', len(res.created + res.updated)
+
+The FogBugz API has no way to ask for part of the ``events`` column, so
+the changed cases still come with their whole history; the older events
+are skipped without being converted.
+
+.. _fborm.sync:
+
+fborm.sync Module Documentation
+===============================
+"""
+import datetime
+import jsontree
+from . import commands
+from . import objects
+from . import parse
+from . import types
+
+marktype = dict(
+    ixBug               = types.fbint,
+    ixBugEventLatest    = types.fbint,
+    dtLastUpdated       = types.fbdatetime,
+    fOpen               = types.fbbool)
+"""The columns searched for to find the changed cases, which are also added
+to the **casetype** of the stored cases.
+"""
+
+class CaseSync(object):
+    """CaseSync(fb, store, casetype=fborm.objects.fbBug, q=None, \
+                namemap={}, initial='status:open', axis='edited', \
+                overlap=86400, page_size=250)
+
+    Incremental sync of the cases matching **q** into **store** . **axis**
+    is the search axis matching cases by the date they were last changed,
+    and **date_format** how the mark is written in the query.
+    """
+    date_format = '%Y-%m-%d %H:%M:%S'
+
+    def __init__(self, fb, store, casetype=objects.fbBug, q=None,
+                 namemap={}, initial='status:open', axis='edited',
+                 overlap=86400, page_size=250):
+        if page_size < 1:
+            raise ValueError("'page_size' must be at least 1")
+        self.fb = fb
+        self.store = store
+        self.casetype = dict(casetype)
+        for name, conv in marktype.iteritems():
+            self.casetype.setdefault(name, conv)
+        self.q = q
+        self.namemap = namemap
+        self.initial = initial
+        self.axis = axis
+        self.overlap = overlap
+        self.page_size = page_size
+
+    def query(self, state):
+        """The search for the cases changed since the mark in **state** .
+        """
+        mark = state.get('dtLastUpdated')
+        if mark:
+            since = (types.parse_fbdatetime(mark) -
+                     datetime.timedelta(seconds=self.overlap))
+            term = '%s:"%s.."' % (self.axis, since.strftime(self.date_format))
+        else:
+            term = self.initial
+        return ' '.join(part for part in (self.q, term) if part)
+
+    def _marks(self, ixBugs):
+        marks = getattr(self.store, 'marks', None)
+        if marks is not None:
+            return marks(ixBugs)
+        stored = ((ixBug, self.store.get(ixBug)) for ixBug in ixBugs)
+        return dict((ixBug, case) for ixBug, case in stored
+                    if case is not None)
+
+    def _changed(self, case, stored):
+        return (stored is None or
+                stored.get('ixBugEventLatest') != case.ixBugEventLatest or
+                stored.get('fOpen') != case.fOpen)
+
+    def fetch(self, ixBugs):
+        """Fetch the changed cases **ixBugs**, as they are to be stored.
+        """
+        return commands.search(self.fb, self.casetype,
+                               q=','.join(str(ix) for ix in ixBugs),
+                               namemap=self.namemap)
+
+    def run(self):
+        """Run one sync, and return a ``jsontree`` with the lists of cases
+        ``created`` (not stored before), ``closed`` (stored as open, now
+        closed) and ``updated`` (all other changes), the number of cases
+        ``checked``, the ``query`` run and the new ``state`` .
+        """
+        state = self.store.get_state()
+        q = self.query(state)
+        marks = commands.search(self.fb, marktype, q=q)
+        stored = self._marks([case.ixBug for case in marks])
+        changed = sorted(case.ixBug for case in marks
+                         if self._changed(case, stored.get(case.ixBug)))
+        res = jsontree.jsontree(created=[], updated=[], closed=[],
+                                checked=len(marks), query=q)
+        for start in xrange(0, len(changed), self.page_size):
+            cases = self.fetch(changed[start:start + self.page_size])
+            for case in cases:
+                mark = stored.get(case['ixBug'])
+                if mark is None:
+                    res.created.append(case)
+                elif mark.get('fOpen') and not case['fOpen']:
+                    res.closed.append(case)
+                else:
+                    res.updated.append(case)
+            self.store.upsert(cases)
+        dates = [case.dtLastUpdated for case in marks if case.dtLastUpdated]
+        if dates:
+            newest = max(dates).strftime(types.fbisofmt)
+            if newest > state.get('dtLastUpdated', ''):
+                state['dtLastUpdated'] = newest
+        events = [case.ixBugEventLatest for case in marks]
+        state['ixBugEvent'] = max(events + [state.get('ixBugEvent', 0)])
+        self.store.set_state(state)
+        self.store.commit()
+        res.state = state
+        return res
+
+def sync_cases(fb, store, casetype=objects.fbBug, **kwdargs):
+    """sync_cases(fb, store, casetype=fborm.objects.fbBug, q=None, \
+                  namemap={}, initial='status:open', axis='edited', \
+                  overlap=86400, page_size=250)
+
+    Run :py:meth:`fborm.sync.CaseSync.run` once.
+    """
+    return CaseSync(fb, store, casetype, **kwdargs).run()
+
+def historytype(eventtype=objects.fbBugEvent):
+    """The typemap of the cases stored by :py:class:`fborm.sync.EventSync`,
+    the :py:data:`fborm.sync.marktype` columns and the ``events`` as
+    **eventtype** . Pass it as the typemap of a
+    :py:class:`fborm.store.SQLiteStore` .
+    """
+    return dict(marktype, events=types.fbevents(eventtype))
+
+def _raw(data):
+    return data
+
+#: the events column, left as XML until the new events are picked out
+_rawevents = types.fbcol(_raw, colname='events', resname='events',
+                         settable=False)
+
+def _event_ix(elem):
+    ix = elem.get('ixBugEvent')
+    if ix is None:
+        return types.fbint(elem.find('ixBugEvent'))
+    return int(ix)
+
+class EventSync(CaseSync):
+    """EventSync(fb, store, eventtype=fborm.objects.fbBugEvent, q=None, \
+                 namemap={}, initial='status:open', axis='edited', \
+                 overlap=86400, page_size=100)
+
+    Incremental sync of the event histories of the cases matching **q**
+    into **store** . Works like :py:class:`fborm.sync.CaseSync`, storing
+    the cases as :py:func:`fborm.sync.historytype` with the events as
+    **eventtype**, but instead of replacing the stored events of a changed
+    case, only the events newer than its stored ``ixBugEventLatest`` are
+    converted and appended to them. The ``jsontree`` returned by
+    :py:meth:`run` also holds the number of new ``events`` .
+    """
+    def __init__(self, fb, store, eventtype=objects.fbBugEvent, q=None,
+                 namemap={}, initial='status:open', axis='edited',
+                 overlap=86400, page_size=100):
+        CaseSync.__init__(self, fb, store, historytype(eventtype), q,
+                          namemap, initial, axis, overlap, page_size)
+        self.eventtype = eventtype
+        self.fetchtype = dict(marktype, events=_rawevents)
+        self.events = 0
+
+    def fetch(self, ixBugs):
+        """Fetch the changed cases **ixBugs** and merge their new events
+        into the stored ones.
+        """
+        plan = parse.compile_typemap(self.eventtype, self.namemap)
+        cases = commands.search(self.fb, self.fetchtype,
+                                q=','.join(str(ix) for ix in ixBugs),
+                                namemap=self.namemap)
+        for case in cases:
+            stored = self.store.get(case['ixBug'])
+            events, latest = [], 0
+            if stored is not None:
+                events = list(stored.get('events') or ())
+                latest = stored.get('ixBugEventLatest') or 0
+            for elem in case['events'] or ():
+                if elem != u'\n' and _event_ix(elem) > latest:
+                    events.append(plan.extract(elem))
+                    self.events += 1
+            case['events'] = events
+        return cases
+
+    def run(self):
+        """Run one sync, see :py:meth:`fborm.sync.CaseSync.run` .
+        """
+        self.events = 0
+        res = CaseSync.run(self)
+        res.events = self.events
+        return res
+
+def sync_events(fb, store, eventtype=objects.fbBugEvent, **kwdargs):
+    """sync_events(fb, store, eventtype=fborm.objects.fbBugEvent, q=None, \
+                   namemap={}, initial='status:open', axis='edited', \
+                   overlap=86400, page_size=100)
+
+    Run :py:meth:`fborm.sync.EventSync.run` once.
+    """
+    return EventSync(fb, store, eventtype, **kwdargs).run()
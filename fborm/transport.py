@@ -0,0 +1,258 @@
+""".. _transport:
+
+==========================================
+Pooled HTTP Transport
+==========================================
+
+FogBugzPy opens a new connection for every API command, and so does
+:py:func:`fborm.util.download` . Against an HTTPS server the TLS handshake
+then costs more than the command itself. A
+:py:class:`fborm.transport.PooledTransport` keeps connections open and
+reuses them. It is thread-safe, holds at most **maxsize** connections per
+host, and can be shared by any number of FogBugz sessions.
+
+It is a drop in replacement for the ``urllib2`` opener FogBugzPy uses, so
+:py:class:`fborm.FogBugzORM` installs it in the FogBugz instance:
+
+.. code:: python
+
+    fbo = fborm.FogBugzORM('https://hostname/', token,
+                           transport=fborm.PooledTransport(maxsize=8))
+    fbo.download_to_file(attachment.sURL, '/tmp/' + attachment.sFilename)
+
+Only the initial ``api.xml`` request FogBugzPy makes while it is
+constructed goes through its own opener.
+
+.. _fborm.transport:
+
+fborm.transport Module Documentation
+====================================
+"""
+import errno
+import httplib
+import select
+import socket
+import threading
+import urllib2
+import urlparse
+import Queue
+from StringIO import StringIO
+
+_redirects = (301, 302, 303, 307)
+_idempotent = frozenset(['GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS', 'TRACE'])
+
+def _dropped(conn):
+    ## an idle connection the server closed reads as ready, at its end
+    if conn.sock is None:
+        return True
+    try:
+        return bool(select.select([conn.sock], [], [], 0)[0])
+    except (select.error, socket.error, ValueError):
+        return True
+
+def _stale(error, sent):
+    ## did the reused connection fail before the server saw the request?
+    if isinstance(error, socket.timeout):
+        return False
+    if not sent:
+        return True
+    if isinstance(error, httplib.BadStatusLine):
+        return True
+    return getattr(error, 'errno', None) == errno.ECONNRESET
+
+class _PooledResponse(object):
+    """File like response which hands its connection back to the pool once
+    the body has been read to the end.
+    """
+    def __init__(self, transport, key, conn, response, url):
+        self._transport = transport
+        self._key = key
+        self._conn = conn
+        self._response = response
+        self.url = url
+        self.code = self.status = response.status
+        self.reason = response.reason
+        self.headers = self.msg = response.msg
+        if response.isclosed():
+            self._release(True)
+
+    def info(self):
+        return self.headers
+
+    def geturl(self):
+        return self.url
+
+    def getcode(self):
+        return self.code
+
+    def read(self, amt=None):
+        if self._conn is None:
+            return ''
+        data = self._response.read(amt)
+        if self._response.isclosed():
+            self._release(True)
+        return data
+
+    def _release(self, reusable):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._transport._release(self._key, conn, reusable)
+
+    def close(self):
+        ## an unread body leaves the connection unusable
+        if self._conn is not None:
+            self._release(self._response.isclosed())
+        self._response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class PooledTransport(object):
+    """PooledTransport(maxsize=4, timeout=60, context=None)
+
+    Thread-safe keep-alive connection pool, with at most **maxsize**
+    connections per host. A thread asking for a connection to a host which
+    already has **maxsize** in use waits for one to be released. **timeout**
+    is the socket timeout in seconds, and **context** the ``ssl.SSLContext``
+    for HTTPS connections.
+    """
+    def __init__(self, maxsize=4, timeout=60, context=None):
+        if maxsize < 1:
+            raise ValueError("'maxsize' must be at least 1")
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.context = context
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+    def _host(self, key):
+        with self._lock:
+            host = self._hosts.get(key)
+            if host is None:
+                host = self._hosts[key] = (
+                    threading.BoundedSemaphore(self.maxsize),
+                    Queue.LifoQueue())
+            return host
+
+    def _connect(self, key):
+        scheme, netloc = key
+        if scheme == 'https':
+            if self.context is not None:
+                return httplib.HTTPSConnection(netloc, timeout=self.timeout,
+                                               context=self.context)
+            return httplib.HTTPSConnection(netloc, timeout=self.timeout)
+        if scheme == 'http':
+            return httplib.HTTPConnection(netloc, timeout=self.timeout)
+        raise urllib2.URLError('unknown url type: %s' % scheme)
+
+    def _acquire(self, key):
+        limit, idle = self._host(key)
+        limit.acquire()
+        while True:
+            try:
+                conn = idle.get_nowait()
+            except Queue.Empty:
+                break
+            if not _dropped(conn):
+                return conn, True
+            conn.close()
+        try:
+            return self._connect(key), False
+        except:
+            limit.release()
+            raise
+
+    def _release(self, key, conn, reusable):
+        limit, idle = self._host(key)
+        if reusable:
+            idle.put(conn)
+        else:
+            conn.close()
+        limit.release()
+
+    def close(self):
+        """Close all idle connections.
+        """
+        with self._lock:
+            hosts = self._hosts.values()
+        for limit, idle in hosts:
+            while True:
+                try:
+                    idle.get_nowait().close()
+                except Queue.Empty:
+                    break
+
+    def open(self, request, data=None, headers=None, redirects=5):
+        """Send **request**, either a ``urllib2.Request`` or a URL string,
+        and return a file like response. Non 2xx responses raise
+        ``urllib2.HTTPError`` and connection failures ``urllib2.URLError``,
+        like the ``urllib2`` opener it replaces.
+
+        A request failing on a reused connection, because the server closed
+        it while idle, is sent again on another one, if its method is
+        idempotent and the server can not have seen it: sending it failed,
+        or the connection was closed or reset without any response. A
+        timeout is never sent again.
+        """
+        extra = headers or {}
+        if isinstance(request, basestring):
+            url = request
+            headers = {}
+            method = 'POST' if data is not None else 'GET'
+        else:
+            url = request.get_full_url()
+            data = request.get_data()
+            headers = dict(request.header_items())
+            method = request.get_method()
+        headers.update(extra)
+        parts = urlparse.urlsplit(url)
+        key = (parts.scheme.lower(), parts.netloc)
+        selector = urlparse.urlunsplit(('', '', parts.path or '/',
+                                        parts.query, ''))
+        if hasattr(data, 'seek'):
+            start = data.tell()
+        retry = method in _idempotent
+        while True:
+            conn, reused = self._acquire(key)
+            sent = False
+            try:
+                conn.request(method, selector, data, headers)
+                sent = True
+                response = conn.getresponse()
+                break
+            except (httplib.HTTPException, socket.error), e:
+                self._release(key, conn, False)
+                if not (reused and retry and _stale(e, sent)):
+                    raise urllib2.URLError(e)
+                ## the server closed an idle keep-alive connection
+                if hasattr(data, 'seek'):
+                    data.seek(start)
+        if response.status in _redirects and redirects and method == 'GET':
+            location = response.getheader('location')
+            response.read()
+            self._release(key, conn, not response.will_close)
+            return self.open(urlparse.urljoin(url, location),
+                             headers=headers, redirects=redirects - 1)
+        if response.status >= 300:
+            body = response.read()
+            self._release(key, conn, not response.will_close)
+            raise urllib2.HTTPError(url, response.status, response.reason,
+                                    response.msg, StringIO(body))
+        return _PooledResponse(self, key, conn, response, url)
+
+_default_transport = None
+_default_lock = threading.Lock()
+
+def default_transport():
+    """The :py:class:`fborm.transport.PooledTransport` shared by everything
+    not given a transport of its own, such as
+    :py:func:`fborm.util.download` .
+    """
+    global _default_transport
+    with _default_lock:
+        if _default_transport is None:
+            _default_transport = PooledTransport()
+        return _default_transport
@@ -75,9 +75,46 @@ def fbdatetime(data):
     to the FogBugz API. This allows for rich datetime evaluation, comparison
     and modification.
     """
-    strdt = fbstring(data)
+    ## BeautifulSoup's .string is several times cheaper than .text for an
+    ## element holding only text, and None for anything else.
+    strdt = getattr(data, 'string', None)
+    if strdt is None:
+        strdt = data.text
     if not strdt:
         return ''
+    dt = _fbdatetime_cache.get(strdt)
+    if dt is None:
+        dt = parse_fbdatetime(strdt)
+        if len(_fbdatetime_cache) >= _fbdatetime_cache_max:
+            _fbdatetime_cache.clear()
+        ## a NavigableString would keep the whole parse tree alive
+        _fbdatetime_cache[unicode(strdt)] = dt
+    return dt
+
+## datetime objects are immutable, so converted values can be shared. Event
+## histories repeat the same timestamps (an edit and its notification, bulk
+## changes) and the list commands repeat them across every item.
+_fbdatetime_cache = {}
+_fbdatetime_cache_max = 16384
+
+def parse_fbdatetime(strdt):
+    """Parse an API datetime string, ``2013-06-29T22:24:43Z``, which is
+    always in the :py:data:`fborm.types.fbisofmt` format. The fields are
+    sliced out at their fixed positions, which is many times faster than
+    ``strptime``; anything not in exactly that layout is still handed to
+    ``strptime``, so it fails the same way.
+    """
+    if (len(strdt) == 20 and strdt[4] == strdt[7] == u'-' and
+        strdt[10] == u'T' and strdt[13] == strdt[16] == u':' and
+        strdt[19] == u'Z'):
+        try:
+            return datetime.datetime(int(strdt[0:4]), int(strdt[5:7]),
+                                     int(strdt[8:10]), int(strdt[11:13]),
+                                     int(strdt[14:16]), int(strdt[17:19]))
+        except ValueError:
+            pass
+    if isinstance(strdt, unicode):
+        strdt = strdt.encode('utf-8')
     return datetime.datetime.strptime(strdt, fbisofmt)
 
 def fblistof(fbtype):
@@ -88,11 +125,12 @@ def fblistof(fbtype):
             return []
         return [converter(value) for value in values]
     def _extractall(item, data, custom_map):
-        return extract_all(data, item, custom_map)
+        return parse.extract_all(data, item, custom_map)
         
     if isinstance(fbtype, dict):
         call = functools.partial(_extractall, fbtype)
         call.takes_map = True
+        call.typemap = fbtype
     elif callable(fbtype):
         call = functools.partial(_listof, fbtype)
     else:
@@ -123,6 +161,9 @@ def fbcol(fbtype, colname=None, resname=None, attrib=False,
         extractor.takes_map = fbtype.takes_map
     if hasattr(fbtype, 'takes_data'):
         extractor.takes_data = fbtype.takes_data
+    if hasattr(fbtype, 'typemap'):
+        extractor.typemap = fbtype.typemap
+        extractor.first = getattr(fbtype, 'first', False)
     extractor.attrib=attrib
     if colname:
         extractor.colname=colname
@@ -168,14 +209,20 @@ def fbevents(eventdict):
     return res  
 
 def _firstelem(conv):
-    def firstelem(conv, data):
-        converted = conv(data)
+    def firstelem(conv, data, *args):
+        converted = conv(data, *args)
         if isinstance(converted, (list, tuple)):
             if len(converted):
                 return converted[0]
             return None
         return converted
-    return functools.partial(firstelem, conv)
+    res = functools.partial(firstelem, conv)
+    if hasattr(conv, 'takes_map'):
+        res.takes_map = conv.takes_map
+    if hasattr(conv, 'typemap'):
+        res.typemap = conv.typemap
+        res.first = True
+    return res
     
 def fblatestevent(eventdict):
     res = fbcol(_firstelem(fblistof(eventdict)),
@@ -250,13 +297,37 @@ setter=lambda x: :py:data:`fborm.parse.fbsetconvert` (x) if x else ' ')
 fbixBugChildren.fbtype = 'fborm.types.fbixBugChildren'
 
 
+class _DiskFile(object):
+    """A file on disk to upload, only opened while it is being read, and
+    closed as soon as it has been read to the end. The streaming encoder in
+    :py:mod:`fborm.patch` reads it straight from disk by its **name**.
+    """
+    def __init__(self, name):
+        ## fail now, as open() used to, rather than half way through a request
+        open(name, 'rb').close()
+        self.name = name
+        self._fh = None
+
+    def read(self, size=-1):
+        if self._fh is None:
+            self._fh = open(self.name, 'rb')
+        data = self._fh.read(size)
+        if size < 0 or not data:
+            self.close()
+        return data
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
 def _maybeOpen(filemap):
     result = {}
     for name, fileobj in filemap.iteritems():
         if isinstance(name, unicode):
             name = name.encode('utf-8')
         if isinstance(fileobj, basestring):
-            fileobj = open(fileobj, 'rb')
+            fileobj = _DiskFile(fileobj)
         elif not hasattr(fileobj, 'read'):
             raise TypeError(
                 "The 'File' mapping must have values which are "
@@ -278,7 +349,7 @@ gettable=False, setname='Files', setter=_maybeOpen)
         result = dict(filemap)
         for name, fileobj in filemap.iteritmes():
             if isinstance(fileobj, basestring):
-                result[name] = open(fileobj, 'rb')
+                result[name] = _DiskFile(fileobj)
             elif not hasattr(fileobj, 'read'):
                 raise TypeError(
                     "The 'File' mapping must have values which are "
@@ -300,11 +371,10 @@ You need to pass in 'Files' set to a dictionary of file names mapped to
 open file handles set for reading in binary mode. To simplify this we treat
 this as a dictionary of file names, mapped to file names on disk, and the
 :py:data:`fborm.objects.fbFiles` column type converter will convert the on
-disk names into open file handles for you.
-
-We are cheating by creating a new dictionary which will go out of scope
-and be deleted. This will cause the file handles to be closed implicitly.
-Not very clean, but it is safe.
+disk names into file objects for you. These are only opened while the file
+is being read and closed as soon as it has been sent. With
+:py:func:`fborm.patch.monkey_patch` applied the files are streamed in
+blocks rather than read into memory, see :py:class:`fborm.patch.MultipartBody` .
 
 FogBugz has a file size limit which is configurable by administration up to
 100Meg. You are responcible for finding out what that limit is set to and
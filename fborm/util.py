@@ -21,32 +21,149 @@ def comma_or_space_split(sdata):
     """
     return [x for x in _re_coma_or_space_sep.split(sdata) if x]
 
-_shared_connection = None
-def _connection():
-    global _shared_connection
-    if _shared_connection is None:
-        import httplib2
-        _shared_connection = httplib2.Http()
-    return  _shared_connection
-
-def download(url):
-    response, content = _connection().request(url)
-    if response.status != 200:
+def _open(transport, url, headers, resilience):
+    if resilience is None:
+        return transport.open(url, headers=headers)
+    return resilience.call('download', transport.open, url, headers=headers)
+
+def download(url, transport=None, resilience=None):
+    """Return the body of **url**, fetched over **transport**, or the
+    shared :py:func:`fborm.transport.default_transport`, and through the
+    :py:class:`fborm.resilience.Resilience` **resilience** if given.
+    """
+    if transport is None:
+        from .transport import default_transport
+        transport = default_transport()
+    import urllib2
+    try:
+        response = _open(transport, url, {}, resilience)
+    except urllib2.HTTPError, e:
         raise RuntimeError("URL (%s) returned status code %d: %s" %
-                           (url, response.status, response.reason))
-    return content
+                           (url, e.code, e.msg))
+    try:
+        return response.read()
+    finally:
+        response.close()
+
+def _checksum(checksum):
+    if checksum is None:
+        return None, None
+    if isinstance(checksum, basestring):
+        if ':' not in checksum:
+            raise ValueError("checksum must look like 'sha1:<hexdigest>'")
+        checksum = checksum.split(':', 1)
+    name, digest = checksum
+    import hashlib
+    return hashlib.new(name), digest.lower()
+
+def download_to_file(url, filename, transport=None, chunk_size=65536,
+                     resume=False, checksum=None, resilience=None):
+    """download_to_file(url, filename, transport=None, chunk_size=65536, \
+                        resume=False, checksum=None, resilience=None)
 
-def download_to_file(url, filename):
+    Stream **url** into **filename** in blocks of **chunk_size** bytes, so
+    memory use does not depend on the size of the file.
+    
+    With **resume**, an existing partial **filename** is continued with an
+    HTTP ``Range`` request; if the server ignores the range the download
+    starts over. A failed download is then left on disk to be resumed,
+    otherwise it is removed.
+    
+    **checksum** is either ``(algorithm, hexdigest)`` or a string like
+    ``'sha1:<hexdigest>'`` with any ``hashlib`` algorithm. The file is
+    removed and ``RuntimeError`` raised if it does not match.
+    
+    The request is sent through the
+    :py:class:`fborm.resilience.Resilience` **resilience** if given.
+    
+    Returns the size of the file.
+    """
+    if transport is None:
+        from .transport import default_transport
+        transport = default_transport()
+    import urllib2
+    digest, expected = _checksum(checksum)
+    offset = 0
+    if resume and os.path.isfile(filename):
+        offset = os.path.getsize(filename)
+    headers = {}
+    if offset:
+        headers['Range'] = 'bytes=%d-' % offset
     try:
-        data = download(url)
-        fn = open(filename, 'wb')
-        fn.write(data)
-        fn.close()
+        try:
+            response = _open(transport, url, headers, resilience)
+        except urllib2.HTTPError, e:
+            if offset and e.code == 416:
+                ## nothing left to fetch, the file is already complete
+                response = None
+            else:
+                raise RuntimeError("URL (%s) returned status code %d: %s" %
+                                   (url, e.code, e.msg))
+        if response is not None and response.getcode() != 206:
+            offset = 0
+        fn = open(filename, 'r+b' if offset else 'wb')
+        try:
+            if digest is not None and offset:
+                for block in iter(lambda: fn.read(chunk_size), ''):
+                    digest.update(block)
+            fn.seek(offset)
+            fn.truncate()
+            if response is not None:
+                try:
+                    for block in iter(lambda: response.read(chunk_size), ''):
+                        fn.write(block)
+                        if digest is not None:
+                            digest.update(block)
+                finally:
+                    response.close()
+            size = fn.tell()
+        finally:
+            fn.close()
+        if digest is not None and digest.hexdigest() != expected:
+            resume = False
+            raise RuntimeError("URL (%s) checksum mismatch: %s != %s" %
+                               (url, digest.hexdigest(), expected))
+        return size
     except Exception, e:
-        if os.path.exists(filename) and os.path.isfile(filename):
+        if (not resume and
+            os.path.exists(filename) and os.path.isfile(filename)):
             try:
                 os.unlink(filename)
             except:
                 pass
         raise e
-    
\ No newline at end of file
+
+def download_many(downloads, workers=4, transport=None, **kwdargs):
+    """download_many(downloads, workers=4, transport=None, **kwdargs)
+
+    Run :py:func:`fborm.util.download_to_file` for each ``(url, filename)``
+    pair in **downloads** (or each item, if it is a dictionary), on
+    **workers** threads. The remaining keyword arguments are passed to
+    every download. Give **transport** a
+    :py:class:`fborm.transport.PooledTransport` with at least **workers**
+    connections per host to have them all run at once.
+
+    Returns a list in the same order as **downloads** of ``jsontree``
+    objects with the ``url``, ``filename``, ``size`` and ``error`` (the
+    exception raised, or ``None``) of each download.
+    """
+    import jsontree
+    from multiprocessing.pool import ThreadPool
+    if hasattr(downloads, 'iteritems'):
+        downloads = downloads.iteritems()
+    downloads = list(downloads)
+    def fetch(url_filename):
+        url, filename = url_filename
+        res = jsontree.jsontree(url=url, filename=filename,
+                                size=None, error=None)
+        try:
+            res.size = download_to_file(url, filename, transport, **kwdargs)
+        except Exception, e:
+            res.error = e
+        return res
+    pool = ThreadPool(workers)
+    try:
+        return pool.map(fetch, downloads)
+    finally:
+        pool.close()
+        pool.join()
@@ -16,7 +16,6 @@ setup(
         "Development Status :: 4 - Beta",
         "Environment :: Web Environment",
         "Programming Language :: Python",
-        "Programming Language :: Python :: 2.6",
         "Programming Language :: Python :: 2.7",
         "Intended Audience :: Developers",
         "Intended Audience :: System Administrators",